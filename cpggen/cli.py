@@ -2,18 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import json
 import os
 import shutil
 import signal
 import sys
 import tempfile
+from collections import Counter
 from multiprocessing import Pool, freeze_support
 from pathlib import Path, PurePath
 
 from quart import Quart, request
 from quart.utils import run_sync
 
-from cpggen import executor, utils
+from cpggen import corpus, executor, planner, staging, utils
 from cpggen.logger import LOG, console, enable_debug
 
 os.environ["PYTHONIOENCODING"] = "utf-8"
@@ -170,6 +172,62 @@ def build_args():
         action="store_true",
         default=os.getenv("USE_ATOM") in TRUTHY_VALUES,
     )
+    parser.add_argument(
+        "--min-files",
+        type=int,
+        default=utils.get_int_attr("CPGGEN_MIN_FILES", os.environ, None),
+        dest="min_files",
+        help="Skip auto-detected languages with fewer files than this",
+    )
+    parser.add_argument(
+        "--min-bytes",
+        type=int,
+        default=utils.get_int_attr("CPGGEN_MIN_BYTES", os.environ, None),
+        dest="min_bytes",
+        help="Skip auto-detected languages with fewer bytes of code than this",
+    )
+    parser.add_argument(
+        "--max-languages",
+        type=int,
+        default=utils.get_int_attr("CPGGEN_MAX_LANGUAGES", os.environ, None),
+        dest="max_languages",
+        help="Only process the given number of the largest auto-detected languages",
+    )
+    parser.add_argument(
+        "--small-languages",
+        default=os.getenv("CPGGEN_SMALL_LANGUAGES", "skip"),
+        dest="small_languages",
+        choices=["skip", "cheap"],
+        help="Skip the auto-detected languages below the thresholds or generate them without a build and with a smaller heap",
+    )
+    parser.add_argument(
+        "--split-modules",
+        action="store_true",
+        default=os.getenv("CPGGEN_SPLIT_MODULES") in TRUTHY_VALUES,
+        dest="split_modules",
+        help="Generate a separate CPG for each module of a monorepo",
+    )
+    parser.add_argument(
+        "--split-workspaces",
+        action="store_true",
+        default=os.getenv("CPGGEN_SPLIT_WORKSPACES") in TRUTHY_VALUES,
+        dest="split_workspaces",
+        help="Generate a separate CPG for each package of a js workspace",
+    )
+    parser.add_argument(
+        "--shard",
+        action="store_true",
+        default=os.getenv("CPGGEN_SHARD") in TRUTHY_VALUES,
+        dest="shard",
+        help="Split modules that are too big for a single frontend into shards",
+    )
+    parser.add_argument(
+        "--corpus",
+        action="store_true",
+        default=os.getenv("CPGGEN_CORPUS") in TRUTHY_VALUES,
+        dest="corpus_mode",
+        help="Generate a separate CPG for each jar or executable in a directory",
+    )
     parser.add_argument(
         "--vectors",
         action="store_true",
@@ -202,6 +260,8 @@ async def generate_cpg():
     """Method to generate CPG via the http route"""
     q = request.args
     params = await request.get_json()
+    # Inventories from previous requests could be stale
+    utils.clear_inventory_cache()
     if not params:
         params = {}
     url = ""
@@ -248,79 +308,255 @@ async def generate_cpg():
         else:
             utils.download_package_unsafe(url, clone_dir)
         src = clone_dir
-    if not cpg_out_dir:
-        cpg_out_dir = tempfile.mkdtemp(prefix="cpggen_cpg_out")
-    if cpg_out_dir and not os.path.exists(cpg_out_dir):
-        os.makedirs(cpg_out_dir, exist_ok=True)
+    # Sources extracted from an archive are removed once the jobs are done
+    expanded_src = utils.expand_source_archive(src)
+    extracted_dir = expanded_src if expanded_src != src else None
+    src = expanded_src
+    try:
+        if not cpg_out_dir:
+            cpg_out_dir = tempfile.mkdtemp(prefix="cpggen_cpg_out")
+        if cpg_out_dir and not os.path.exists(cpg_out_dir):
+            os.makedirs(cpg_out_dir, exist_ok=True)
+        shard = utils.get_boolean_attr(
+            "shard", q, params, os.getenv("CPGGEN_SHARD") in TRUTHY_VALUES
+        )
+        # Planning reads the whole tree so it is kept off the event loop
+        languages, language_stats, estimates = await run_sync(plan_languages)(
+            src,
+            languages,
+            min_files=utils.get_int_attr(
+                "min_files",
+                q,
+                params,
+                utils.get_int_attr("CPGGEN_MIN_FILES", os.environ, None),
+            ),
+            min_bytes=utils.get_int_attr(
+                "min_bytes",
+                q,
+                params,
+                utils.get_int_attr("CPGGEN_MIN_BYTES", os.environ, None),
+            ),
+            max_languages=utils.get_int_attr(
+                "max_languages",
+                q,
+                params,
+                utils.get_int_attr("CPGGEN_MAX_LANGUAGES", os.environ, None),
+            ),
+            small_languages=q.get("small_languages")
+            or params.get("small_languages")
+            or os.getenv("CPGGEN_SMALL_LANGUAGES", "skip"),
+            need_stats=shard,
+        )
+
+        split_modules = utils.get_boolean_attr(
+            "split_modules",
+            q,
+            params,
+            os.getenv("CPGGEN_SPLIT_MODULES") in TRUTHY_VALUES,
+        )
+        split_workspaces = utils.get_boolean_attr(
+            "split_workspaces",
+            q,
+            params,
+            os.getenv("CPGGEN_SPLIT_WORKSPACES") in TRUTHY_VALUES,
+        )
+        jobs = await run_sync(plan_jobs)(
+            src,
+            cpg_out_dir,
+            languages,
+            language_stats,
+            estimates,
+            split_modules,
+            shard,
+            split_workspaces=split_workspaces,
+        )
+
+        def sync_processor():
+            app_manifest_list = []
+            for job in jobs:
+                mlist = executor.get_exec_tool(job["extra_args"])(
+                    job["tool_lang"],
+                    job["src"],
+                    cpg_out_dir,
+                    job["src"],
+                    joern_home=os.getenv(
+                        "JOERN_HOME", str(Path.home() / "bin" / "joern" / "joern-cli")
+                    ),
+                    use_container=False,
+                    use_atom=use_atom,
+                    auto_build=auto_build,
+                    extra_args={
+                        "skip_sbom": skip_sbom,
+                        "slice_mode": slice_mode,
+                        "for_export": export,
+                        "for_slice": should_slice,
+                        "for_vectors": vectors,
+                        "url": url,
+                        **job["extra_args"],
+                    },
+                )
+                if mlist:
+                    app_manifest_list += mlist
+                if should_slice and mlist:
+                    for ml in mlist:
+                        if not os.path.exists(ml.get("cpg")):
+                            errors_warnings.append(
+                                f"""CPG file was not found at {ml.get("cpg")}"""
+                            )
+                            continue
+                        executor.exec_tool(
+                            "slice",
+                            ml.get("cpg"),
+                            cpg_out_dir,
+                            src,
+                            joern_home=os.getenv(
+                                "JOERN_HOME",
+                                str(Path.home() / "bin" / "joern" / "joern-cli"),
+                            ),
+                            use_container=False,
+                            use_atom=use_atom,
+                            auto_build=False,
+                            extra_args={
+                                "slice_mode": slice_mode,
+                                "slice_out": ml.get("slice_out"),
+                                "source_view": ml.get("source_view"),
+                            },
+                        )
+                        if not os.path.exists(ml.get("slice_out")):
+                            errors_warnings.append(
+                                f"""CPG slice file was not found at {ml.get("slice_out")}"""
+                            )
+            return {
+                "success": not errors_warnings,
+                "message": "\n".join(errors_warnings)
+                if errors_warnings
+                else f"CPG generated successfully at {cpg_out_dir}",
+                "out_dir": cpg_out_dir,
+                "app_manifests": app_manifest_list,
+                "estimates": estimates,
+            }
+
+        result = await run_sync(sync_processor)()
+    finally:
+        if extracted_dir:
+            shutil.rmtree(extracted_dir, ignore_errors=True)
+    return result
+
+
+def plan_languages(
+    src,
+    languages,
+    min_files=0,
+    min_bytes=0,
+    max_languages=0,
+    small_languages="skip",
+    need_stats=False,
+):
+    """
+    Method to detect or parse the languages and predict their cost.
+    Auto-detected languages below the thresholds are skipped, or marked cheap
+    with small_languages set to cheap, and the remaining languages are ordered
+    with the most expensive ones first. The statistics of explicit languages
+    are only computed when need_stats is set, which also counts the lines of
+    code for a more accurate estimate.
+    :return: Tuple of languages, language statistics and cost estimates
+    """
+    small = []
+    language_stats = {}
     if not languages or languages == "autodetect":
-        languages = utils.detect_project_type(src)
+        detected = utils.detect_project_type(src)
+        language_stats = utils.get_language_stats(src, detected)
+        languages = utils.filter_project_types(
+            detected,
+            language_stats,
+            min_files=min_files,
+            min_bytes=min_bytes,
+            max_languages=max_languages,
+        )
+        if small_languages == "cheap":
+            small = [lang for lang in dict.fromkeys(detected) if lang not in languages]
+            languages += small
+            if small:
+                LOG.info("Generating %s without a build", ", ".join(small))
     else:
         languages = languages.split(",")
+        if not need_stats:
+            return languages, {}, planner.estimate_costs(languages, {})
+    language_stats = planner.get_code_stats(
+        src, languages, count_loc=need_stats or None, stats=language_stats
+    )
+    for lang in small:
+        language_stats.setdefault(lang, {})["cheap"] = True
+    estimates = planner.estimate_costs(languages, language_stats)
+    for lang in languages:
+        LOG.debug(
+            "%s has %s. Estimated cost %s",
+            lang,
+            language_stats.get(lang),
+            estimates.get(lang),
+        )
+    return planner.order_by_cost(languages, estimates), language_stats, estimates
 
-    def sync_processor():
-        app_manifest_list = []
-        for lang in languages:
-            mlist = executor.exec_tool(
-                lang,
-                src,
-                cpg_out_dir,
-                src,
-                joern_home=os.getenv(
-                    "JOERN_HOME", str(Path.home() / "bin" / "joern" / "joern-cli")
-                ),
-                use_container=False,
-                use_atom=use_atom,
-                auto_build=auto_build,
-                extra_args={
-                    "skip_sbom": skip_sbom,
-                    "slice_mode": slice_mode,
-                    "for_export": export,
-                    "for_slice": should_slice,
-                    "for_vectors": vectors,
-                    "url": url,
-                },
-            )
-            if mlist:
-                app_manifest_list += mlist
-            if should_slice and mlist:
-                for ml in mlist:
-                    if not os.path.exists(ml.get("cpg")):
-                        errors_warnings.append(
-                            f"""CPG file was not found at {ml.get("cpg")}"""
-                        )
-                        continue
-                    executor.exec_tool(
-                        "slice",
-                        ml.get("cpg"),
-                        cpg_out_dir,
-                        src,
-                        joern_home=os.getenv(
-                            "JOERN_HOME",
-                            str(Path.home() / "bin" / "joern" / "joern-cli"),
-                        ),
-                        use_container=False,
-                        use_atom=use_atom,
-                        auto_build=False,
-                        extra_args={
-                            "slice_mode": slice_mode,
-                            "slice_out": ml.get("slice_out"),
-                        },
-                    )
-                    if not os.path.exists(ml.get("slice_out")):
-                        errors_warnings.append(
-                            f"""CPG slice file was not found at {ml.get("slice_out")}"""
-                        )
-        return {
-            "success": not errors_warnings,
-            "message": "\n".join(errors_warnings)
-            if errors_warnings
-            else f"CPG generated successfully at {cpg_out_dir}",
-            "out_dir": cpg_out_dir,
-            "app_manifests": app_manifest_list,
-        }
-
-    result = await run_sync(sync_processor)()
-    return result
+
+def plan_jobs(
+    src,
+    cpg_out_dir,
+    languages,
+    language_stats,
+    estimates,
+    split_modules=False,
+    shard=False,
+    snapshot=False,
+    split_workspaces=False,
+):
+    """
+    Method to turn the languages into frontend jobs. The module graph is saved
+    to the output directory when the languages are split into modules.
+    With split_workspaces, js workspaces are split into one job per package.
+    With snapshot, jobs that build in a source tree shared with other jobs are
+    run on a private snapshot of the source.
+    :return: List of jobs with the tool_lang, src and extra_args
+    """
+    # Modules and shards cannot be split when the output is a single file
+    if cpg_out_dir.endswith((".bin", ".cpg", ".zip", ".⚛", ".atom")):
+        split_modules = False
+        shard = False
+        split_workspaces = False
+    jobs, graph = planner.plan_jobs(
+        src,
+        languages,
+        language_stats,
+        estimates,
+        split_modules=split_modules,
+        shard=shard,
+        split_workspaces=split_workspaces,
+    )
+    if graph and len(jobs) > len(languages):
+        os.makedirs(cpg_out_dir, exist_ok=True)
+        with open(
+            os.path.join(cpg_out_dir, "modules.json"), mode="w", encoding="utf-8"
+        ) as fp:
+            json.dump(graph, fp)
+    # Small languages are generated without a build and with the predicted heap
+    cheap = {
+        lang.split("-")[0]
+        for lang, lang_stats in language_stats.items()
+        if lang_stats.get("cheap")
+    }
+    for job in jobs:
+        if job["tool_lang"].split("-")[0] in cheap:
+            job_memory = planner.get_job_memory(job["extra_args"].get("cost_estimate"))
+            job["extra_args"]["skip_build"] = True
+            if job_memory:
+                job["extra_args"]["job_memory"] = job_memory
+    if snapshot and os.getenv("CPGGEN_SNAPSHOT") not in ("false", "0"):
+        shared_src = Counter(job["src"] for job in jobs)
+        for job in jobs:
+            if shared_src[job["src"]] > 1 and executor.build_tools_map.get(
+                job["tool_lang"]
+            ):
+                job["extra_args"]["snapshot"] = True
+    return jobs
 
 
 def init_worker():
@@ -370,10 +606,37 @@ def cpg(
     should_slice=False,
     slice_mode=None,
     vectors=False,
+    min_files=0,
+    min_bytes=0,
+    max_languages=0,
+    split_modules=False,
+    shard=False,
+    corpus_mode=False,
+    small_languages="skip",
+    split_workspaces=False,
 ):
     """Method to generate cpg using multiple processes"""
     if __name__ in ("__main__", "cpggen.cli"):
+        # Share the inventory cache for local sources with the worker processes
+        cache_dir = utils.get_cache_dir(cpg_out_dir) if os.path.isdir(src) else None
+        if corpus_mode and os.path.isdir(src):
+            jobs, skipped = corpus.plan_corpus(
+                src,
+                None
+                if not languages or languages == "autodetect"
+                else languages.split(","),
+            )
+            write_corpus_report(cpg_out_dir, jobs, skipped)
+            return run_corpus(
+                jobs,
+                cpg_out_dir,
+                joern_home,
+                use_container,
+                use_atom,
+                {"skip_sbom": True, "slice_mode": slice_mode},
+            )
         with Pool(processes=os.cpu_count(), initializer=init_worker) as pool:
+            extracted_dir = None
             try:
                 ret = []
                 exec_results = []
@@ -387,20 +650,50 @@ def cpg(
                     else:
                         utils.download_package_unsafe(src, clone_dir)
                     src = clone_dir
-                if not languages or languages == "autodetect":
-                    languages = utils.detect_project_type(src)
-                else:
-                    languages = languages.split(",")
-                for lang in languages:
-                    LOG.debug("Detected language %s at %s", lang, src)
+                # Sources extracted from an archive are removed once the jobs are done
+                expanded_src = utils.expand_source_archive(src)
+                if expanded_src != src:
+                    extracted_dir = expanded_src
+                src = expanded_src
+                if cache_dir and os.path.isdir(src):
+                    utils.get_inventory(src, cache_dir=cache_dir)
+                languages, language_stats, estimates = plan_languages(
+                    src,
+                    languages,
+                    min_files=min_files,
+                    min_bytes=min_bytes,
+                    max_languages=max_languages,
+                    small_languages=small_languages,
+                    need_stats=shard,
+                )
+                jobs = plan_jobs(
+                    src,
+                    cpg_out_dir,
+                    languages,
+                    language_stats,
+                    estimates,
+                    split_modules=split_modules,
+                    shard=shard,
+                    snapshot=True,
+                    split_workspaces=split_workspaces,
+                )
+                # The jobs share the file checks of the tree through the cache
+                if cache_dir and any(
+                    staging.use_source_view(job["tool_lang"]) for job in jobs
+                ):
+                    staging.check_view_files(src, cache_dir)
+                for job in jobs:
+                    LOG.debug(
+                        "Detected language %s at %s", job["tool_lang"], job["src"]
+                    )
                     exec_results.append(
                         pool.apply_async(
-                            executor.exec_tool,
+                            executor.get_exec_tool(job["extra_args"]),
                             (
-                                lang,
-                                src,
+                                job["tool_lang"],
+                                job["src"],
                                 cpg_out_dir,
-                                src,
+                                job["src"],
                                 joern_home,
                                 use_container,
                                 use_atom,
@@ -412,6 +705,8 @@ def cpg(
                                     "for_slice": should_slice,
                                     "for_vectors": vectors,
                                     "url": url,
+                                    "inventory_cache_dir": cache_dir,
+                                    **job["extra_args"],
                                 },
                             ),
                         )
@@ -424,10 +719,105 @@ def cpg(
                 return ret
             except KeyboardInterrupt:
                 pool.terminate()
+            finally:
+                if extracted_dir:
+                    shutil.rmtree(extracted_dir, ignore_errors=True)
             pool.join()
     return None
 
 
+def write_corpus_report(cpg_out_dir, jobs, skipped):
+    """Method to save the corpus jobs and the skipped duplicates"""
+    for askipped in skipped:
+        LOG.debug(
+            "Skipping %s since it is a %s of %s",
+            askipped["file"],
+            askipped["reason"],
+            askipped["of"],
+        )
+    os.makedirs(cpg_out_dir, exist_ok=True)
+    with open(
+        os.path.join(cpg_out_dir, "corpus.json"), mode="w", encoding="utf-8"
+    ) as fp:
+        json.dump(
+            {
+                "jobs": [{"key": job["key"], "files": job["files"]} for job in jobs],
+                "skipped": skipped,
+            },
+            fp,
+        )
+
+
+def run_corpus(jobs, cpg_out_dir, joern_home, use_container, use_atom, extra_args):
+    """
+    Method to run the corpus jobs in parallel within the memory budget.
+    Jobs whose inputs are unchanged are restored from the corpus cache.
+    :return: List of manifests
+    """
+    ret = []
+    cache_dir = corpus.get_corpus_cache_dir(cpg_out_dir)
+    pending = []
+    for job in jobs:
+        # Cpgs are only reused for the same frontend and options
+        job["cache_key"] = corpus.get_cache_key(
+            job,
+            executor.get_frontend_info(
+                job["tool_lang"], joern_home, use_container, use_atom
+            ),
+            extra_args,
+        )
+        manifest = corpus.restore_cached(job, cpg_out_dir, cache_dir)
+        if manifest:
+            LOG.debug("Reusing the cached %s", manifest["cpg"])
+            ret.append(manifest)
+        else:
+            pending.append(job)
+    if not pending:
+        return ret
+    workers, heap_mb = corpus.get_corpus_workers(pending)
+    LOG.debug("Running %d corpus jobs with %d workers", len(pending), workers)
+    with Pool(processes=workers, initializer=init_worker) as pool:
+        try:
+            exec_results = []
+            for job in pending:
+                corpus.prepare_job(job)
+                exec_results.append(
+                    (
+                        job,
+                        pool.apply_async(
+                            executor.get_exec_tool(job["extra_args"]),
+                            (
+                                job["tool_lang"],
+                                job["src"],
+                                cpg_out_dir,
+                                job["src"],
+                                joern_home,
+                                use_container,
+                                use_atom,
+                                False,
+                                {
+                                    **extra_args,
+                                    **job["extra_args"],
+                                    "job_memory": f"{heap_mb}M",
+                                    "job_timeout": corpus.get_job_timeout(job),
+                                },
+                            ),
+                        ),
+                    )
+                )
+            for job, res in exec_results:
+                manifests_list = res.get()
+                corpus.cleanup_job(job)
+                for manifest in manifests_list or []:
+                    corpus.store_cached(job, manifest, cache_dir)
+                    ret.append(manifest)
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+        pool.join()
+    return ret
+
+
 def fix_export_repr(export_repr, export_format):
     """Method to validate and fix the export representation based on the format"""
     if export_format == "neo4jcsv":
@@ -511,6 +901,7 @@ def export_slice_cpg(
                                 "export_format": export_format if export else None,
                                 "slice_mode": slice_mode if should_slice else None,
                                 "slice_out": manifest_obj.get("slice_out"),
+                                "source_view": manifest_obj.get("source_view"),
                             },
                         ),
                     )
@@ -564,6 +955,14 @@ def main():
         should_slice=args.slice,
         slice_mode=args.slice_mode,
         vectors=args.vectors,
+        min_files=args.min_files,
+        min_bytes=args.min_bytes,
+        max_languages=args.max_languages,
+        split_modules=args.split_modules,
+        shard=args.shard,
+        corpus_mode=args.corpus_mode,
+        small_languages=args.small_languages,
+        split_workspaces=args.split_workspaces,
     )
     if args.export or args.slice or args.vectors:
         export_slice_cpg(
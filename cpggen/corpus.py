@@ -0,0 +1,402 @@
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from cpggen.logger import LOG
+from cpggen.planner import estimate_cost, get_memory_budget_mb
+from cpggen.staging import hash_file, link_file
+from cpggen.utils import (
+    find_exe_files,
+    find_java_artifacts,
+    get_cache_dir,
+    get_walk_workers,
+    inspect_archive,
+    link_artifacts,
+)
+
+# Jars smaller than this are analyzed together in batches of about this size
+CORPUS_BATCH_BYTES = int(os.getenv("CPGGEN_CORPUS_BATCH_BYTES", str(1024 * 1024)))
+
+# Timeout in seconds for each corpus job. 0 to derive it from the cost estimate
+CORPUS_TIMEOUT = int(os.getenv("CPGGEN_CORPUS_TIMEOUT", "0"))
+
+# Derived timeouts allow this many times the estimated duration
+CORPUS_TIMEOUT_FACTOR = 4
+
+# Lower bound for the derived timeouts in seconds
+CORPUS_MIN_TIMEOUT = 600
+
+# Languages that can be analyzed as a corpus
+corpus_languages = {
+    "jar": "jar",
+    "jimple": "jar",
+    "java": "jar",
+    "binary": "binary",
+}
+
+
+def hash_files(paths):
+    """
+    Method to hash many files on a thread pool
+    :param paths: List of file paths
+    :return: Dict of path to the hex digest
+    """
+    if len(paths) > 1 and get_walk_workers() > 1:
+        with ThreadPoolExecutor(max_workers=get_walk_workers()) as pool:
+            return dict(zip(paths, pool.map(hash_file, paths)))
+    return {p: hash_file(p) for p in paths}
+
+
+def get_class_entries(path):
+    """
+    Method to read the checksum and size of the classes in a jar from its
+    central directory
+    :param path: Jar path
+    :return: Set of (crc, size) tuples
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            return {
+                (info.CRC, info.file_size)
+                for info in zf.infolist()
+                if info.filename.endswith(".class")
+            }
+    except (OSError, zipfile.BadZipFile):
+        return set()
+
+
+def dedupe_jars(jars):
+    """
+    Method to drop exact duplicates and shaded copies of jars. Jars are visited
+    from the largest so that fat jars are kept and the jars whose classes are
+    all contained in a jar already kept are skipped.
+    :param jars: List of jar paths
+    :return: Tuple of the kept jars and the skipped jars. Kept jars are dicts
+        with the jar, hash and bytes while skipped jars have the file, reason and
+        the jar that was kept instead
+    """
+    hashes = hash_files(jars)
+    sizes = {j: os.path.getsize(j) for j in jars}
+    kept = []
+    skipped = []
+    seen_hashes = {}
+    seen_entries = {}
+    for jar in sorted(jars, key=lambda j: (-sizes[j], j)):
+        digest = hashes[jar]
+        if digest in seen_hashes:
+            skipped.append(
+                {"file": jar, "reason": "duplicate", "of": seen_hashes[digest]}
+            )
+            continue
+        entries = get_class_entries(jar)
+        if entries and all(e in seen_entries for e in entries):
+            seen_hashes[digest] = jar
+            skipped.append(
+                {
+                    "file": jar,
+                    "reason": "shaded",
+                    "of": seen_entries[next(iter(entries))],
+                }
+            )
+            continue
+        seen_hashes[digest] = jar
+        for e in entries:
+            seen_entries.setdefault(e, jar)
+        kept.append({"jar": jar, "hash": digest, "bytes": sizes[jar]})
+    return kept, skipped
+
+
+def make_job(tool_lang, src, key, name, files, stats):
+    """
+    Method to create a corpus job
+    :param tool_lang: Language of the frontend
+    :param src: Input file or None for batches
+    :param key: Content hash of the inputs used as the cache key
+    :param name: Name of the app
+    :param files: Input files
+    :param stats: Language statistics of the inputs
+    :return: Corpus job
+    """
+    return {
+        "tool_lang": tool_lang,
+        "src": src,
+        "key": key,
+        "files": files,
+        "extra_args": {
+            "module_name": name,
+            "full_app_name": f"{name}-{tool_lang}",
+            "language_stats": stats,
+            "cost_estimate": estimate_cost(tool_lang, stats),
+            "corpus": {"key": key, "files": files},
+        },
+    }
+
+
+def plan_jar_corpus(src_dir):
+    """
+    Method to plan one jimple job per jar for a directory of jars. Small jars
+    are batched together using a directory of symlinks.
+    :param src_dir: Directory with the jars
+    :return: Tuple of the list of jobs and the skipped jars
+    """
+    kept, skipped = dedupe_jars(find_java_artifacts(src_dir))
+    batches = []
+    batch = []
+    for jar in kept:
+        if jar["bytes"] >= CORPUS_BATCH_BYTES:
+            batches.append([jar])
+            continue
+        batch.append(jar)
+        if sum(j["bytes"] for j in batch) >= CORPUS_BATCH_BYTES:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    jobs = []
+    for batch in batches:
+        if len(batch) == 1:
+            key = batch[0]["hash"]
+            name = f"{os.path.splitext(os.path.basename(batch[0]['jar']))[0]}-{key[:8]}"
+        else:
+            key = hashlib.sha1(
+                ",".join(sorted(j["hash"] for j in batch)).encode("utf-8")
+            ).hexdigest()
+            name = f"batch-{key[:8]}"
+        summaries = [inspect_archive(j["jar"]) for j in batch]
+        stats = {
+            "files": len(batch),
+            "bytes": sum(j["bytes"] for j in batch),
+            "archive_bytes": sum(j["bytes"] for j in batch),
+            "uncompressed_bytes": sum(s["uncompressed_bytes"] for s in summaries if s),
+        }
+        jobs.append(
+            make_job(
+                "jimple",
+                batch[0]["jar"] if len(batch) == 1 else None,
+                key,
+                name,
+                [j["jar"] for j in batch],
+                stats,
+            )
+        )
+    return jobs, skipped
+
+
+def plan_binary_corpus(src_dir):
+    """
+    Method to plan one ghidra job per executable in a directory such as an
+    extracted firmware or a release folder. Identical binaries are analyzed once.
+    :param src_dir: Directory with the executables
+    :return: Tuple of the list of jobs and the skipped binaries
+    """
+    binaries = find_exe_files(src_dir)
+    hashes = hash_files(binaries)
+    jobs = []
+    skipped = []
+    seen_hashes = {}
+    for binary in sorted(binaries):
+        digest = hashes[binary]
+        if digest in seen_hashes:
+            skipped.append(
+                {"file": binary, "reason": "duplicate", "of": seen_hashes[digest]}
+            )
+            continue
+        seen_hashes[digest] = binary
+        stats = {"files": 1, "bytes": os.path.getsize(binary)}
+        name = f"{os.path.basename(binary)}-{digest[:8]}"
+        jobs.append(make_job("binary", binary, digest, name, [binary], stats))
+    return jobs, skipped
+
+
+def plan_corpus(src_dir, languages=None):
+    """
+    Method to plan the corpus jobs for the jars and executables in a directory
+    :param src_dir: Directory to analyze
+    :param languages: Optional list of languages. Jars and executables are both
+        analyzed by default
+    :return: Tuple of the list of jobs and the skipped files
+    """
+    kinds = {"jar", "binary"}
+    if languages:
+        kinds = {
+            corpus_languages[lang] for lang in languages if lang in corpus_languages
+        }
+    jobs = []
+    skipped = []
+    if "jar" in kinds:
+        jar_jobs, jar_skipped = plan_jar_corpus(src_dir)
+        jobs += jar_jobs
+        skipped += jar_skipped
+    if "binary" in kinds:
+        binary_jobs, binary_skipped = plan_binary_corpus(src_dir)
+        jobs += binary_jobs
+        skipped += binary_skipped
+    return jobs, skipped
+
+
+def get_job_timeout(job):
+    """
+    Method to return the timeout of a corpus job
+    :param job: Corpus job
+    :return: Timeout in seconds
+    """
+    if CORPUS_TIMEOUT > 0:
+        return CORPUS_TIMEOUT
+    seconds = job["extra_args"]["cost_estimate"]["seconds"]
+    return max(CORPUS_MIN_TIMEOUT, int(seconds * CORPUS_TIMEOUT_FACTOR))
+
+
+def get_corpus_workers(jobs, memory_mb=None, cpus=None):
+    """
+    Method to decide how many corpus jobs can run at the same time within the
+    memory budget and the heap to give each of them
+    :param jobs: List of corpus jobs
+    :param memory_mb: Optional memory budget in megabytes
+    :param cpus: Optional number of cores
+    :return: Tuple of the number of workers and the heap per job in megabytes
+    """
+    if memory_mb is None:
+        memory_mb = get_memory_budget_mb()
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+    heap_mb = max(
+        [j["extra_args"]["cost_estimate"]["heap_mb"] for j in jobs] or [memory_mb]
+    )
+    workers = max(1, min(cpus, len(jobs) or 1, memory_mb // max(1, heap_mb)))
+    return workers, memory_mb // workers
+
+
+def prepare_job(job):
+    """
+    Method to create the input of a corpus job. Batches are analyzed from a
+    temporary directory of symlinks to their jars.
+    :param job: Corpus job
+    :return: Job with the src set
+    """
+    if not job["src"]:
+        job["src"] = link_artifacts(job["files"])
+        job["cleanup"] = job["src"]
+    return job
+
+
+def cleanup_job(job):
+    """
+    Method to remove the temporary input of a corpus job
+    :param job: Corpus job
+    """
+    if job.get("cleanup"):
+        shutil.rmtree(job["cleanup"], ignore_errors=True)
+
+
+def get_corpus_cache_dir(cpg_out_dir):
+    """
+    Method to return the directory of the hash-keyed corpus cache
+    :param cpg_out_dir: CPG output directory
+    :return: Cache directory or None if caching is disabled
+    """
+    cache_dir = get_cache_dir(cpg_out_dir)
+    return os.path.join(cache_dir, "corpus") if cache_dir else None
+
+
+def place_file(src_file, dest_file):
+    """
+    Method to place a copy of a file using a clone or hardlink when possible
+    :param src_file: Source file
+    :param dest_file: Destination file
+    """
+    if os.path.exists(dest_file):
+        os.remove(dest_file)
+    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+    for method in ("reflink", "hardlink", "copy"):
+        try:
+            link_file(src_file, dest_file, method)
+            return
+        except OSError:
+            continue
+    raise OSError(f"Unable to copy {src_file} to {dest_file}")
+
+
+def get_cache_key(job, frontend, options=None):
+    """
+    Method to derive the cache key of a corpus job from the hash of its inputs
+    and everything that shapes the cpg such as the frontend, its version and
+    the options
+    :param job: Corpus job
+    :param frontend: Frontend info from get_frontend_info
+    :param options: Optional dict of the options passed to the frontend
+    :return: Hex digest
+    """
+    return hashlib.sha256(
+        json.dumps(
+            {
+                "inputs": job["key"],
+                "tool_lang": job["tool_lang"],
+                "frontend": frontend,
+                "options": options or {},
+            },
+            sort_keys=True,
+            default=str,
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def restore_cached(job, cpg_out_dir, cache_dir):
+    """
+    Method to reuse the cpg of an unchanged corpus job from the cache
+    :param job: Corpus job with the cache_key from get_cache_key
+    :param cpg_out_dir: CPG output directory
+    :param cache_dir: Corpus cache directory
+    :return: Manifest of the restored cpg or None if it is not cached
+    """
+    if not cache_dir:
+        return None
+    manifest_file = os.path.join(cache_dir, f"{job['cache_key']}.json")
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, encoding="utf-8") as fp:
+            manifest = json.load(fp)
+        cpg_name = os.path.basename(manifest["cpg"])
+        cpg_out = os.path.abspath(os.path.join(cpg_out_dir, cpg_name))
+        place_file(os.path.join(cache_dir, f"{job['cache_key']}-{cpg_name}"), cpg_out)
+    except (OSError, ValueError, KeyError) as e:
+        LOG.debug("Unable to restore %s from the cache: %s", job["cache_key"], e)
+        return None
+    manifest["cpg"] = cpg_out
+    manifest["cached"] = True
+    with open(
+        cpg_out.replace(".cpg.bin", ".manifest.json")
+        if cpg_out.endswith(".cpg.bin")
+        else f"{cpg_out}.manifest.json",
+        mode="w",
+        encoding="utf-8",
+    ) as fp:
+        json.dump(manifest, fp)
+    return manifest
+
+
+def store_cached(job, manifest, cache_dir):
+    """
+    Method to save the cpg of a corpus job in the cache
+    :param job: Corpus job with the cache_key from get_cache_key
+    :param manifest: Manifest produced for the job
+    :param cache_dir: Corpus cache directory
+    """
+    if not cache_dir or not manifest or not os.path.exists(manifest.get("cpg", "")):
+        return
+    try:
+        cpg_name = os.path.basename(manifest["cpg"])
+        place_file(
+            manifest["cpg"], os.path.join(cache_dir, f"{job['cache_key']}-{cpg_name}")
+        )
+        with open(
+            os.path.join(cache_dir, f"{job['cache_key']}.json"),
+            mode="w",
+            encoding="utf-8",
+        ) as fp:
+            json.dump(manifest, fp)
+    except OSError as e:
+        LOG.debug("Unable to cache %s: %s", manifest["cpg"], e)
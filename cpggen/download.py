@@ -0,0 +1,775 @@
+import asyncio
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import httpx
+import rich.progress
+from rich.progress import Progress
+
+from cpggen.logger import LOG
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# HTTP/2 needs the h2 package from the http2 extra of httpx. Installs without
+# it fall back to HTTP/1.1
+HTTP2_AVAILABLE = False
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    pass
+
+# Directory of the download cache shared by all runs and server requests
+DOWNLOAD_CACHE_DIR = os.getenv(
+    "CPGGEN_DOWNLOAD_CACHE_DIR",
+    os.path.join(str(Path.home()), ".cache", "cpggen", "downloads"),
+)
+
+# Least recently used blobs are evicted once the cache grows past this size
+DOWNLOAD_CACHE_BYTES = int(
+    os.getenv("CPGGEN_DOWNLOAD_CACHE_BYTES", str(2 * 1024 * 1024 * 1024))
+)
+
+# Size of the chunks read while hashing downloads
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Maximum number of downloads in flight at the same time
+DOWNLOAD_CONCURRENCY = int(os.getenv("CPGGEN_DOWNLOAD_CONCURRENCY", "8"))
+
+# Number of chunks buffered between a download and its consumer
+QUEUE_CHUNKS = 64
+
+# Number of times an interrupted download is resumed before giving up
+DOWNLOAD_RETRIES = int(os.getenv("CPGGEN_DOWNLOAD_RETRIES", "3"))
+
+
+def get_download_cache_dir():
+    """
+    Method to return the directory of the download cache
+    :return: Cache directory or None if caching is disabled
+    """
+    if os.getenv("CPGGEN_NO_CACHE") in ("true", "1") or not DOWNLOAD_CACHE_DIR:
+        return None
+    return DOWNLOAD_CACHE_DIR
+
+
+@contextmanager
+def cache_lock(cache_dir, blocking=True):
+    """
+    Context manager to hold the exclusive lock of the download cache so that
+    concurrent workers do not evict or index blobs at the same time
+    :param cache_dir: Cache directory
+    :param blocking: Boolean to wait for the lock. Otherwise BlockingIOError is
+        raised when another worker holds it
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, ".lock"), mode="a", encoding="utf-8") as fp:
+        if fcntl:
+            fcntl.flock(
+                fp.fileno(),
+                fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB,
+            )
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+def get_index_file(url, cache_dir):
+    """
+    Method to return the index entry of a download url
+    :param url: Resolved download url
+    :param cache_dir: Cache directory
+    :return: Path to the json index entry
+    """
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "index", f"{key}.json")
+
+
+def get_blob_file(checksum, cache_dir):
+    """
+    Method to return the path of a blob in the cache
+    :param checksum: sha256 of the content
+    :param cache_dir: Cache directory
+    :return: Path to the blob
+    """
+    return os.path.join(cache_dir, "blobs", checksum[:2], checksum)
+
+
+def lookup(url, cache_dir=None):
+    """
+    Method to find the cached content of a download url. Blobs are verified
+    against their checksum when they are written so a hit only compares the
+    size and mtime recorded in the index. Hits are marked as recently used.
+    :param url: Resolved download url
+    :param cache_dir: Optional cache directory
+    :return: Dict with the url, checksum, size, name and blob or None on a miss
+    """
+    cache_dir = cache_dir or get_download_cache_dir()
+    if not cache_dir:
+        return None
+    try:
+        with open(get_index_file(url, cache_dir), encoding="utf-8") as fp:
+            entry = json.load(fp)
+        blob = get_blob_file(entry["checksum"], cache_dir)
+        st = os.stat(blob)
+        if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+            LOG.warning("Removing the modified cached download of %s", url)
+            os.remove(blob)
+            return None
+        # The access time tracks the use while the mtime identifies the content
+        os.utime(blob, ns=(time.time_ns(), st.st_mtime_ns))
+    except (OSError, ValueError, KeyError):
+        return None
+    return {**entry, "blob": blob}
+
+
+def discard(url, cache_dir=None):
+    """
+    Method to drop the cache entry of a download url together with its blob,
+    for example when the blob turns out to be corrupt
+    :param url: Resolved download url
+    :param cache_dir: Optional cache directory
+    """
+    cache_dir = cache_dir or get_download_cache_dir()
+    if not cache_dir:
+        return
+    index_file = get_index_file(url, cache_dir)
+    try:
+        with cache_lock(cache_dir):
+            with open(index_file, encoding="utf-8") as fp:
+                entry = json.load(fp)
+            os.remove(index_file)
+            blob = get_blob_file(entry["checksum"], cache_dir)
+            if os.path.exists(blob):
+                os.remove(blob)
+    except (OSError, ValueError, KeyError) as e:
+        LOG.debug("Unable to drop the cached download of %s: %s", url, e)
+
+
+def open_blob(cache_dir=None, url=None):
+    """
+    Method to start writing a download into the cache. The content is hashed
+    while it is written so that it can be added without reading it again.
+    With a url, the partial file of an earlier interrupted download is reused.
+    :param cache_dir: Optional cache directory
+    :param url: Optional download url to resume
+    :return: Dict with the cache directory, path, file, digest, size, the
+        bytes of the partial file and its validators or None when caching
+        is disabled
+    """
+    cache_dir = cache_dir or get_download_cache_dir()
+    if not cache_dir:
+        return None
+    blob = {
+        "cache_dir": cache_dir,
+        "meta_file": None,
+        "digest": hashlib.sha256(),
+        "size": 0,
+        "partial": 0,
+        "etag": None,
+        "last_modified": None,
+    }
+    try:
+        tmp_dir = os.path.join(cache_dir, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        if url and fcntl:
+            key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+            path = os.path.join(tmp_dir, f"{key}.part")
+            fp = open(path, "ab")
+            try:
+                # Another worker is downloading the same url
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fp.close()
+                url = None
+        if url and fcntl:
+            blob["path"] = path
+            blob["fp"] = fp
+            blob["meta_file"] = f"{path}.json"
+            blob["partial"] = os.path.getsize(path)
+            if blob["partial"]:
+                try:
+                    with open(blob["meta_file"], encoding="utf-8") as mfp:
+                        meta = json.load(mfp)
+                    blob["etag"] = meta.get("etag")
+                    blob["last_modified"] = meta.get("last_modified")
+                except (OSError, ValueError):
+                    pass
+                # A partial file can only be resumed with a validator
+                if not blob["etag"] and not blob["last_modified"]:
+                    fp.truncate(0)
+                    blob["partial"] = 0
+        else:
+            fd, blob["path"] = tempfile.mkstemp(dir=tmp_dir)
+            blob["fp"] = os.fdopen(fd, "wb")
+    except OSError as e:
+        LOG.debug("Unable to use the download cache %s: %s", cache_dir, e)
+        return None
+    return blob
+
+
+def write_blob(blob, chunk):
+    """
+    Method to append a chunk to a blob opened with open_blob
+    :param blob: Blob from open_blob or None
+    :param chunk: Bytes
+    """
+    if not blob:
+        return
+    blob["fp"].write(chunk)
+    blob["digest"].update(chunk)
+    blob["size"] += len(chunk)
+
+
+def save_blob_validators(blob, etag, last_modified):
+    """
+    Method to remember the validators of a download so that its partial file
+    can be resumed by a later run
+    :param blob: Blob from open_blob or None
+    :param etag: ETag header of the response
+    :param last_modified: Last-Modified header of the response
+    """
+    if not blob or not blob["meta_file"]:
+        return
+    blob["etag"] = etag
+    blob["last_modified"] = last_modified
+    try:
+        with open(blob["meta_file"], mode="w", encoding="utf-8") as fp:
+            json.dump({"etag": etag, "last_modified": last_modified}, fp)
+    except OSError:
+        pass
+
+
+def close_blob(blob):
+    """
+    Method to keep the partial file of an interrupted download for a later run
+    :param blob: Blob from open_blob or None
+    """
+    if not blob:
+        return
+    blob["fp"].close()
+    if not blob["meta_file"] and os.path.exists(blob["path"]):
+        os.remove(blob["path"])
+
+
+def discard_blob(blob):
+    """
+    Method to drop a blob that was not downloaded completely or is corrupt
+    :param blob: Blob from open_blob or None
+    """
+    if not blob:
+        return
+    blob["fp"].close()
+    for path in (blob["path"], blob["meta_file"]):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def commit_blob(url, blob, name, checksums=None):
+    """
+    Method to add a completely written blob to the cache and index it by url
+    :param url: Resolved download url
+    :param blob: Blob from open_blob or None
+    :param name: File name of the download
+    :param checksums: Optional dict of the verified registry checksums
+    :return: Cache entry like lookup or None when caching is disabled
+    """
+    if not blob:
+        return None
+    blob["fp"].close()
+    cache_dir = blob["cache_dir"]
+    checksum = blob["digest"].hexdigest()
+    blob_file = get_blob_file(checksum, cache_dir)
+    entry = {"url": url, "checksum": checksum, "size": blob["size"], "name": name}
+    if checksums:
+        entry["checksums"] = checksums
+    try:
+        os.makedirs(os.path.dirname(blob_file), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "index"), exist_ok=True)
+        with cache_lock(cache_dir):
+            if os.path.exists(blob_file):
+                os.remove(blob["path"])
+            else:
+                os.replace(blob["path"], blob_file)
+            entry["mtime_ns"] = os.stat(blob_file).st_mtime_ns
+            if blob["meta_file"] and os.path.exists(blob["meta_file"]):
+                os.remove(blob["meta_file"])
+            index_file = get_index_file(url, cache_dir)
+            with open(f"{index_file}.tmp", mode="w", encoding="utf-8") as fp:
+                json.dump(entry, fp)
+            os.replace(f"{index_file}.tmp", index_file)
+            evict(cache_dir, keep=blob_file)
+    except OSError as e:
+        LOG.debug("Unable to cache the download %s: %s", url, e)
+        discard_blob(blob)
+        return None
+    return {**entry, "blob": blob_file}
+
+
+def store(url, path, cache_dir=None, name=None):
+    """
+    Method to add a downloaded file to the cache. Blobs are keyed by their
+    checksum so the same content downloaded from several urls is kept once.
+    :param url: Resolved download url
+    :param path: Downloaded file
+    :param cache_dir: Optional cache directory
+    :param name: Optional file name. Defaults to the name of path
+    :return: Cache entry like lookup or None when caching is disabled
+    """
+    blob = open_blob(cache_dir)
+    if not blob:
+        return None
+    try:
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b""):
+                write_blob(blob, chunk)
+    except OSError as e:
+        LOG.debug("Unable to cache the download %s: %s", url, e)
+        discard_blob(blob)
+        return None
+    return commit_blob(url, blob, name or os.path.basename(path))
+
+
+def evict(cache_dir, quota=None, keep=None):
+    """
+    Method to remove the least recently used blobs until the cache fits in the
+    quota. Index entries of the removed blobs are dropped on their next lookup.
+    The caller must hold the cache lock.
+    :param cache_dir: Cache directory
+    :param quota: Optional size in bytes. Defaults to DOWNLOAD_CACHE_BYTES
+    :param keep: Optional blob that must not be evicted
+    :return: List of the removed blobs
+    """
+    if quota is None:
+        quota = DOWNLOAD_CACHE_BYTES
+    blobs = []
+    for root, _, files in os.walk(os.path.join(cache_dir, "blobs")):
+        for file in files:
+            path = os.path.join(root, file)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            blobs.append((st.st_atime, path, st.st_size))
+    total = sum(b[2] for b in blobs)
+    removed = []
+    for _, path, size in sorted(blobs):
+        if total <= quota:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed.append(path)
+    if removed:
+        LOG.debug("Evicted %d downloads from the cache", len(removed))
+    return removed
+
+
+def open_transfer(url, name, checksum=None, cache_dir=None):
+    """
+    Method to prepare a download that can be resumed and verified
+    :param url: Resolved download url
+    :param name: File name of the download
+    :param checksum: Optional tuple of the hash algorithm and the hex digest
+        published by the registry
+    :param cache_dir: Optional cache directory
+    :return: Transfer dict
+    """
+    return {
+        "url": url,
+        "name": name,
+        "blob": open_blob(cache_dir, url),
+        "delivered": 0,
+        "total": None,
+        "etag": None,
+        "last_modified": None,
+        "checksum": checksum,
+        "verify": hashlib.new(checksum[0]) if checksum else None,
+    }
+
+
+def add_chunk(transfer, chunk):
+    """
+    Method to account for a chunk handed to the consumer of a transfer
+    :param transfer: Transfer from open_transfer
+    :param chunk: Bytes
+    """
+    transfer["delivered"] += len(chunk)
+    if transfer["verify"]:
+        transfer["verify"].update(chunk)
+
+
+def iter_partial(transfer):
+    """
+    Method to replay the partial file of an interrupted download
+    :param transfer: Transfer from open_transfer
+    :return: Generator of bytes
+    """
+    blob = transfer["blob"]
+    if not blob or not blob["partial"]:
+        return
+    transfer["etag"] = blob["etag"]
+    transfer["last_modified"] = blob["last_modified"]
+    with open(blob["path"], "rb") as fp:
+        remaining = blob["partial"]
+        while remaining > 0:
+            chunk = fp.read(min(HASH_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            blob["digest"].update(chunk)
+            blob["size"] += len(chunk)
+            add_chunk(transfer, chunk)
+            yield chunk
+    LOG.debug("Resuming %s from %d bytes", transfer["url"], transfer["delivered"])
+
+
+def get_range_headers(transfer):
+    """
+    Method to build the headers that resume a transfer from the bytes already
+    delivered. If-Range makes the server send the whole body if it changed.
+    :param transfer: Transfer from open_transfer
+    :return: Dict of headers
+    """
+    if not transfer["delivered"]:
+        return {}
+    headers = {"Range": f"bytes={transfer['delivered']}-"}
+    validator = transfer["etag"] or transfer["last_modified"]
+    if validator:
+        headers["If-Range"] = validator
+    return headers
+
+
+def check_response(transfer, response):
+    """
+    Method to validate the response of a transfer that may be resumed
+    :param transfer: Transfer from open_transfer
+    :param response: httpx response
+    :return: Number of bytes at the start of the body that were already
+        delivered and must be skipped
+    """
+    response.raise_for_status()
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    length = response.headers.get("Content-Length")
+    if not transfer["delivered"]:
+        transfer["etag"] = etag
+        transfer["last_modified"] = last_modified
+        transfer["total"] = int(length) if length else None
+        save_blob_validators(transfer["blob"], etag, last_modified)
+        return 0
+    if response.status_code == 206:
+        content_range = response.headers.get("Content-Range", "")
+        if not content_range.startswith(f"bytes {transfer['delivered']}-"):
+            raise ValueError(f"Unexpected range {content_range}")
+        total = content_range.rsplit("/", 1)[-1]
+        transfer["total"] = int(total) if total.isdigit() else None
+        return 0
+    # The server ignored the range. The body can only be reused if it is
+    # the same content.
+    if (etag and etag == transfer["etag"]) or (
+        last_modified and last_modified == transfer["last_modified"]
+    ):
+        transfer["total"] = int(length) if length else None
+        return transfer["delivered"]
+    raise ValueError("The download changed while it was being resumed")
+
+
+def finish_transfer(transfer):
+    """
+    Method to verify a completed transfer against the registry checksum
+    :param transfer: Transfer from open_transfer
+    """
+    if transfer["blob"]:
+        transfer["blob"]["fp"].flush()
+    if transfer["verify"]:
+        algorithm, expected = transfer["checksum"]
+        actual = transfer["verify"].hexdigest()
+        if actual != expected.lower():
+            raise ValueError(
+                f"{algorithm} mismatch for {transfer['url']}. Expected {expected}, got {actual}"
+            )
+
+
+def close_transfer(transfer, error=None):
+    """
+    Method to add a completed transfer to the cache. Interrupted transfers keep
+    their partial file for a later run while corrupt ones are dropped.
+    :param transfer: Transfer from open_transfer
+    :param error: Optional error that ended the transfer
+    :return: Cache entry or None
+    """
+    if error is None:
+        checksums = None
+        if transfer["checksum"]:
+            checksums = {transfer["checksum"][0]: transfer["checksum"][1].lower()}
+        return commit_blob(
+            transfer["url"], transfer["blob"], transfer["name"], checksums
+        )
+    if isinstance(error, (httpx.TransportError, OSError)):
+        close_blob(transfer["blob"])
+    else:
+        discard_blob(transfer["blob"])
+    return None
+
+
+def skip_bytes(chunk, skip):
+    """
+    Method to drop the start of a chunk that was already delivered
+    :param chunk: Bytes
+    :param skip: Number of bytes left to skip
+    :return: Tuple of the remaining chunk and bytes left to skip
+    """
+    if not skip:
+        return chunk, 0
+    return chunk[skip:], max(0, skip - len(chunk))
+
+
+def fetch_chunks(transfer, report=None):
+    """
+    Method to download a transfer as a stream of chunks. Interrupted downloads
+    are resumed with a range request.
+    :param transfer: Transfer from open_transfer
+    :param report: Optional function taking the delivered and total bytes
+    :return: Generator of bytes
+    """
+    yield from iter_partial(transfer)
+    attempt = 0
+    while True:
+        try:
+            with httpx.stream(
+                "GET",
+                transfer["url"],
+                headers=get_range_headers(transfer),
+                follow_redirects=True,
+            ) as response:
+                skip = check_response(transfer, response)
+                for chunk in response.iter_bytes():
+                    chunk, skip = skip_bytes(chunk, skip)
+                    if not chunk:
+                        continue
+                    write_blob(transfer["blob"], chunk)
+                    add_chunk(transfer, chunk)
+                    if report:
+                        report(transfer["delivered"], transfer["total"])
+                    yield chunk
+            break
+        except httpx.TransportError as e:
+            attempt += 1
+            if attempt > DOWNLOAD_RETRIES:
+                raise
+            LOG.debug("Resuming %s after %s", transfer["url"], e)
+    finish_transfer(transfer)
+
+
+async def fetch_transfer_async(client, transfer, chunks, progress=None):
+    """
+    Method to download a transfer into a queue of chunks using a shared async
+    client. Interrupted downloads are resumed with a range request.
+    :param client: httpx.AsyncClient
+    :param transfer: Transfer from open_transfer
+    :param chunks: Bounded asyncio.Queue that receives the chunks
+    :param progress: Optional rich progress to report to
+    """
+    task = None
+    if progress:
+        task = progress.add_task(transfer["name"], total=None)
+    for chunk in iter_partial(transfer):
+        await chunks.put(chunk)
+    attempt = 0
+    while True:
+        try:
+            async with client.stream(
+                "GET", transfer["url"], headers=get_range_headers(transfer)
+            ) as response:
+                skip = check_response(transfer, response)
+                async for chunk in response.aiter_bytes():
+                    chunk, skip = skip_bytes(chunk, skip)
+                    if not chunk:
+                        continue
+                    write_blob(transfer["blob"], chunk)
+                    add_chunk(transfer, chunk)
+                    await chunks.put(chunk)
+                    if task is not None:
+                        progress.update(
+                            task,
+                            completed=transfer["delivered"],
+                            total=transfer["total"],
+                        )
+            break
+        except httpx.TransportError as e:
+            attempt += 1
+            if attempt > DOWNLOAD_RETRIES:
+                raise
+            LOG.debug("Resuming %s after %s", transfer["url"], e)
+    finish_transfer(transfer)
+
+
+def iter_chunks(chunks, loop):
+    """
+    Method to iterate over the chunks of a download as they arrive. Each chunk
+    is handed over from the event loop so the download waits while the queue is
+    full instead of polling.
+    :param chunks: Bounded asyncio.Queue filled by fetch_transfer_async
+    :param loop: Event loop running the download
+    :return: Generator of bytes. Download errors are raised to the consumer
+    """
+    while True:
+        item = asyncio.run_coroutine_threadsafe(chunks.get(), loop).result()
+        if item is None:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def end_chunks(chunks, error):
+    """
+    Method to end the stream of a failed download without waiting. The chunks
+    that were not consumed yet are dropped since the consumer only needs the
+    error, so this also works while the download is being cancelled.
+    :param chunks: asyncio.Queue filled by fetch_transfer_async
+    :param error: Error raised to the consumer
+    """
+    while not chunks.empty():
+        chunks.get_nowait()
+    chunks.put_nowait(error)
+
+
+def consume_chunks(consume, transfer, chunks, loop):
+    """
+    Method to run a consumer on the chunks of a download. The queue is drained
+    even when the consumer stops early so that the download never blocks.
+    :param consume: Function taking the transfer and an iterator of chunks
+    :param transfer: Transfer from open_transfer
+    :param chunks: asyncio.Queue filled by fetch_transfer_async
+    :param loop: Event loop running the download
+    :return: Tuple of the result of consume and the error that stopped it
+    """
+    stream = iter_chunks(chunks, loop)
+    try:
+        return consume(transfer, stream), None
+    except (
+        OSError,
+        ValueError,
+        httpx.HTTPError,
+        tarfile.TarError,
+        zipfile.BadZipFile,
+    ) as e:
+        return None, e
+    finally:
+        try:
+            for _ in stream:
+                pass
+        except (OSError, ValueError, httpx.HTTPError):
+            pass
+
+
+async def fetch_all_async(transfers, consume, concurrency=None):
+    """
+    Method to download many transfers concurrently over one connection pool.
+    The body of each download is streamed to consume on a worker thread so
+    that the processing of a download overlaps with the transfers still running.
+    :param transfers: List of transfers from open_transfer
+    :param consume: Function taking the transfer and an iterator of chunks
+    :param concurrency: Optional number of downloads in flight
+    :return: Dict of url to the result of consume or None when it failed
+    """
+    concurrency = max(1, concurrency or DOWNLOAD_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    consumers = []
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    with Progress(
+        "{task.description}",
+        "[progress.percentage]{task.percentage:>3.0f}%",
+        rich.progress.BarColumn(bar_width=None),
+        rich.progress.DownloadColumn(),
+        rich.progress.TransferSpeedColumn(),
+    ) as progress, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        async with httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE, limits=limits, follow_redirects=True
+        ) as client:
+
+            async def run(transfer):
+                async with semaphore:
+                    chunks = asyncio.Queue(maxsize=QUEUE_CHUNKS)
+                    consumer = loop.run_in_executor(
+                        pool, consume_chunks, consume, transfer, chunks, loop
+                    )
+                    consumers.append(consumer)
+                    error = None
+                    ended = False
+                    try:
+                        await fetch_transfer_async(client, transfer, chunks, progress)
+                        await chunks.put(None)
+                        ended = True
+                    except (httpx.HTTPError, OSError, ValueError) as e:
+                        error = e
+                    except BaseException as e:
+                        error = e
+                        close_blob(transfer["blob"])
+                        raise
+                    finally:
+                        # The consumer thread waits for the end of the stream
+                        # even when the download is cancelled
+                        if not ended:
+                            end_chunks(chunks, error)
+                    result, consumer_error = await consumer
+                    error = error or consumer_error
+                    close_transfer(transfer, error)
+                    if error:
+                        LOG.warning("Unable to download %s: %s", transfer["url"], error)
+                        return transfer["url"], None
+                    return transfer["url"], result
+
+            tasks = [asyncio.ensure_future(run(t)) for t in transfers]
+            try:
+                results = await asyncio.gather(*tasks)
+            finally:
+                # The consumer threads receive their chunks through the event
+                # loop so they must finish before the pool is shut down
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await asyncio.gather(*consumers, return_exceptions=True)
+    return dict(results)
+
+
+def fetch_all(transfers, consume, concurrency=None):
+    """
+    Method to run the concurrent downloads from synchronous code. A separate
+    thread is used when the caller already runs an event loop such as the server.
+    :param transfers: List of transfers from open_transfer
+    :param consume: Function taking the transfer and an iterator of chunks
+    :param concurrency: Optional number of downloads in flight
+    :return: Dict of url to the result of consume or None when it failed
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(fetch_all_async(transfers, consume, concurrency))
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(
+            asyncio.run, fetch_all_async(transfers, consume, concurrency)
+        ).result()
@@ -1,4 +1,5 @@
 import importlib
+import importlib.metadata
 import json
 import os
 import shutil
@@ -13,17 +14,27 @@ from psutil._common import bytes2human
 from rich.progress import Progress
 
 from cpggen.logger import DEBUG, LOG, console
+from cpggen.planner import get_frontend_args, get_job_manifest
+from cpggen.staging import (
+    build_job_view,
+    build_snapshot,
+    get_view_manifest,
+    remove_source_view,
+    rewrite_view_paths,
+)
 from cpggen.utils import (
+    bundle_java_artifacts,
     check_command,
     find_csharp_artifacts,
     find_files,
     find_go_mods,
     find_gradle_files,
-    find_java_artifacts,
     find_makefiles,
     find_pom_files,
     find_sbt_files,
+    get_inventory,
     purl_to_friendly_name,
+    remove_bundle,
 )
 
 runtimeValues = {}
@@ -196,6 +207,8 @@ cpg_tools_map = {
     "atom": "%(atom_bin_dir)satom %(slice_mode)s --language %(parse_lang)s --slice-outfile %(slice_out)s --output %(atom_out)s %(src)s",
     "c": "%(joern_home)sc2cpg%(bin_ext)s -J-Xmx%(memory)s -o %(cpg_out)s %(src)s",
     "cpp": "%(joern_home)sc2cpg%(bin_ext)s -J-Xmx%(memory)s -o %(cpg_out)s %(src)s",
+    "c-with-compile-commands": "%(joern_home)sc2cpg%(bin_ext)s -J-Xmx%(memory)s -o %(cpg_out)s %(src)s",
+    "cpp-with-compile-commands": "%(joern_home)sc2cpg%(bin_ext)s -J-Xmx%(memory)s -o %(cpg_out)s %(src)s",
     "c-with-deps": "%(joern_home)sc2cpg%(bin_ext)s -J-Xmx%(memory)s -o %(cpg_out)s %(src)s --with-include-auto-discovery",
     "cpp-with-deps": "%(joern_home)sc2cpg%(bin_ext)s -J-Xmx%(memory)s -o %(cpg_out)s %(src)s --with-include-auto-discovery",
     "java": "%(joern_home)sjavasrc2cpg%(only_bat_ext)s -J-Xmx%(memory)s -o %(cpg_out)s %(src)s",
@@ -222,7 +235,8 @@ cpg_tools_map["ts"] = cpg_tools_map["js"]
 cpg_tools_map["javascript"] = cpg_tools_map["js"]
 cpg_tools_map["typescript"] = cpg_tools_map["js"]
 cpg_tools_map["maven"] = cpg_tools_map["jimple"]
-cpg_tools_map["jar"] = cpg_tools_map["jimple"]
+# jar projects are analyzed from the bundle of their built artifacts
+cpg_tools_map["jar"] = cpg_tools_map["jimple"].replace("%(src)s", "%(uber_jar)s")
 cpg_tools_map["pypi"] = cpg_tools_map["python"]
 
 build_tools_map = {
@@ -287,6 +301,97 @@ joern_parse_lang_map = {
 }
 
 
+def get_atom_bin_dir():
+    """
+    Method to find the directory of the atom command from ATOM_BIN_DIR,
+    ATOM_HOME or the usual install locations
+    :return: Directory ending with a separator or an empty string when atom is
+        only available on the PATH
+    """
+    atom_bin_dir = os.getenv("ATOM_BIN_DIR")
+    if atom_bin_dir:
+        return atom_bin_dir
+    if os.getenv("ATOM_HOME"):
+        return os.path.join(os.getenv("ATOM_HOME"), "bin", "")
+    # Handle the case where the user might have installed atom npm package on windows
+    # but not set the PATH environment variable
+    atom_bin_dir = (
+        str(Path.home() / "AppData" / "Roaming" / "npm")
+        if sys.platform == "win32"
+        else "/usr/local/bin"
+    )
+    atom_bin_dir = os.path.join(atom_bin_dir, "")
+    if sys.platform == "win32" and os.path.exists(atom_bin_dir):
+        os.environ["ATOM_BIN_DIR"] = atom_bin_dir
+        os.environ["PATH"] = os.environ["PATH"] + os.pathsep + atom_bin_dir + os.pathsep
+    # Handle case where atom is installed globally
+    if (
+        sys.platform != "win32"
+        and not os.path.exists(os.path.join(atom_bin_dir, "atom"))
+        and os.path.exists("/usr/bin/atom")
+    ):
+        atom_bin_dir = ""
+    return atom_bin_dir
+
+
+def get_frontend_info(tool_lang, joern_home, use_container=False, use_atom=False):
+    """
+    Method to describe the frontend that generates the cpg for a language. The
+    command, the stamp of its executable and the versions identify the output
+    of the frontend in cache keys.
+    :param tool_lang: Language or cpg_tools_map key
+    :param joern_home: Joern home directory
+    :param use_container: Boolean to use the container image
+    :param use_atom: Boolean to generate an atom
+    :return: Dict with the frontend, command, executable, stamp and versions
+    """
+    atom_bin_dir = get_atom_bin_dir()
+
+    def get_executable(cmd):
+        exe = cmd.split(" ")[0] % dict(
+            joern_home=joern_home or "",
+            atom_bin_dir=atom_bin_dir,
+            bin_ext=bin_ext,
+            only_bat_ext=only_bat_ext,
+            android_jar="",
+        )
+        return shutil.which(exe) or exe
+
+    cmd = cpg_tools_map.get(tool_lang, "")
+    # The atom is used when the frontend is not available
+    if (
+        not use_atom
+        and not use_container
+        and not check_command(get_executable(cmd))
+        and check_command(ATOM_CMD)
+    ):
+        use_atom = True
+    if use_atom:
+        cmd = cpg_tools_map["atom"]
+    executable = get_executable(cmd)
+    try:
+        st = os.stat(executable)
+        stamp = [st.st_size, st.st_mtime_ns]
+    except OSError:
+        stamp = None
+    try:
+        cpggen_version = importlib.metadata.version("cpggen")
+    except importlib.metadata.PackageNotFoundError:
+        cpggen_version = None
+    return {
+        "frontend": "atom" if use_atom else "cpg",
+        "command": cmd,
+        "executable": executable,
+        "stamp": stamp,
+        "atom_version": ATOM_VERSION,
+        "cpggen_version": cpggen_version,
+        "image": os.getenv("CPGGEN_IMAGE", "ghcr.io/appthreat/cpggen")
+        if use_container
+        else None,
+        "android_jar": os.getenv("JIMPLE_ANDROID_JAR"),
+    }
+
+
 def dot_convert(export_out_dir, env):
     """Method to convert .dot files to png format using dot command"""
     if check_command("dot"):
@@ -398,7 +503,9 @@ def do_jar_build(tool_lang, src, env):
         "maven": find_pom_files(src),
         "sbt": find_sbt_files(src),
     }
-    settings_xmls = find_files(src, "settings.xml", False, False)
+    settings_xmls = find_files(
+        src, "settings.xml", False, False, inventory=get_inventory(src)
+    )
     if settings_xmls:
         LOG.info(
             "Maven settings.xml is present in this repo. This usually means that specific maven settings and profiles needs to be passed via the environment variable MVN_ARGS to build this application correctly."
@@ -413,7 +520,9 @@ def do_jar_build(tool_lang, src, env):
 def do_go_build(src, env):
     """Method to build go apps"""
     build_artefacts = {
-        "mage": find_files(src, "magefile.go", False, False),
+        "mage": find_files(
+            src, "magefile.go", False, False, inventory=get_inventory(src)
+        ),
         "go": find_go_mods(src),
         "make": find_makefiles(src),
     }
@@ -443,6 +552,81 @@ def troubleshoot_app(lang_build_crashes, tool_lang):
     pass
 
 
+def get_exec_tool(extra_args):
+    """
+    Method to return the function that executes the tool for a job. Jobs that
+    ask for a snapshot are run on a private copy of the source.
+    :param extra_args: Job extra_args
+    :return: exec_tool_in_snapshot or exec_tool
+    """
+    if extra_args and extra_args.get("snapshot") is True:
+        return exec_tool_in_snapshot
+    return exec_tool
+
+
+def exec_tool_in_snapshot(
+    tool_lang,
+    src,
+    cpg_out_dir,
+    cwd=None,
+    joern_home=None,
+    use_container=False,
+    use_atom=False,
+    auto_build=False,
+    extra_args=None,
+    env=None,
+    stdout=subprocess.DEVNULL,
+):
+    """
+    Method to execute the tool on a private snapshot of the source so that the
+    builds of jobs sharing the same source can run at the same time
+    """
+    snapshot = build_snapshot(src)
+    extra_args = dict(extra_args)
+    if not snapshot:
+        extra_args["snapshot"] = None
+        return exec_tool(
+            tool_lang,
+            src,
+            cpg_out_dir,
+            cwd,
+            joern_home,
+            use_container,
+            use_atom,
+            auto_build,
+            extra_args,
+            env,
+            stdout,
+        )
+    original_src = snapshot["src"]
+
+    def to_snapshot(path):
+        path = os.path.abspath(path)
+        if path == original_src or path.startswith(original_src + os.sep):
+            return snapshot["view"] + path[len(original_src) :]
+        return path
+
+    extra_args["snapshot"] = snapshot
+    if extra_args.get("shard_files"):
+        extra_args["shard_files"] = [to_snapshot(f) for f in extra_args["shard_files"]]
+    try:
+        return exec_tool(
+            tool_lang,
+            snapshot["view"],
+            cpg_out_dir,
+            to_snapshot(cwd) if cwd else cwd,
+            joern_home,
+            use_container,
+            use_atom,
+            auto_build,
+            extra_args,
+            env,
+            stdout,
+        )
+    finally:
+        remove_source_view(snapshot)
+
+
 def exec_tool(
     tool_lang,
     src,
@@ -459,12 +643,18 @@ def exec_tool(
     """Method to execute tools to generate cpg or perform exports"""
     if env is None:
         env = os.environ.copy()
-    cpggen_memory = os.getenv("CPGGEN_MEMORY", max_memory)
+    if extra_args is None:
+        extra_args = {}
+    # Reuse the on-disk inventory cache of the parent process
+    if extra_args.get("inventory_cache_dir") and os.path.isdir(src):
+        get_inventory(src, cache_dir=extra_args["inventory_cache_dir"])
+    # Jobs running in parallel get a share of the memory
+    cpggen_memory = extra_args.get("job_memory") or os.getenv(
+        "CPGGEN_MEMORY", max_memory
+    )
     env[
         "JAVA_OPTS"
     ] = f'{os.getenv("JAVA_OPTS", "")} -Xms{cpggen_memory} -Xmx{cpggen_memory}'
-    if extra_args is None:
-        extra_args = {}
     with Progress(
         console=console,
         transient=True,
@@ -475,34 +665,12 @@ def exec_tool(
         task = None
         lang_build_crashes = {}
         app_manifest_list = []
+        uber_jar = ""
+        is_temp_bundle = False
         tool_lang_simple = tool_lang.split("-")[0]
         atom_home = os.getenv("ATOM_HOME")
-        atom_bin_dir = os.getenv("ATOM_BIN_DIR")
+        atom_bin_dir = get_atom_bin_dir()
         whats_built = "CPG"
-        if not atom_bin_dir:
-            if atom_home:
-                atom_bin_dir = os.path.join(atom_home, "bin", "")
-            else:
-                # Handle the case where the user might have installed atom npm package on windows
-                # but not set the PATH environment variable
-                atom_bin_dir = (
-                    str(Path.home() / "AppData" / "Roaming" / "npm")
-                    if sys.platform == "win32"
-                    else "/usr/local/bin"
-                )
-                atom_bin_dir = os.path.join(atom_bin_dir, "")
-                if sys.platform == "win32" and os.path.exists(atom_bin_dir):
-                    os.environ["ATOM_BIN_DIR"] = atom_bin_dir
-                    os.environ["PATH"] = (
-                        os.environ["PATH"] + os.pathsep + atom_bin_dir + os.pathsep
-                    )
-                # Handle case where atom is installed globally
-                if (
-                    sys.platform != "win32"
-                    and not os.path.exists(os.path.join(atom_bin_dir, "atom"))
-                    and os.path.exists("/usr/bin/atom")
-                ):
-                    atom_bin_dir = ""
         # Set joern_home from environment variable
         # This is required to handle bundled exe mode
         if (
@@ -534,6 +702,8 @@ def exec_tool(
             ):
                 use_atom = True
                 whats_built = "atom"
+        # Views are removed even when a module fails unexpectedly
+        staged_views = []
         try:
             stderr = subprocess.DEVNULL
             if LOG.isEnabledFor(DEBUG):
@@ -562,7 +732,7 @@ def exec_tool(
             if not cmd_with_args:
                 return
             # Perform build first
-            if build_tools_map.get(tool_lang):
+            if build_tools_map.get(tool_lang) and not extra_args.get("skip_build"):
                 if os.getenv("CI"):
                     LOG.debug(
                         "Automatically building %s for %s. To speed up this step, cache the build dependencies using the CI cache settings.",
@@ -582,14 +752,11 @@ def exec_tool(
                         tool_lang,
                     )
                 lang_build_crashes[tool_lang] = do_build(tool_lang, src, cwd, env)
-            uber_jar = ""
             csharp_artifacts = ""
-            # For languages like scala, jsp or jar we need to create an uber jar containing all jar, war files from the source directory
+            # For languages like scala, jsp or jar we need a single input with all the jar, war files from the source directory
             if "uber_jar" in cmd_with_args:
                 stdout = subprocess.PIPE
-                java_artifacts = find_java_artifacts(src)
-                if len(java_artifacts) > 0:
-                    uber_jar = java_artifacts[0]
+                uber_jar, is_temp_bundle = bundle_java_artifacts(src)
             if "csharp_artifacts" in cmd_with_args:
                 stdout = subprocess.PIPE
                 csharp_artifacts = find_csharp_artifacts(src)
@@ -597,7 +764,7 @@ def exec_tool(
                     csharp_artifacts = csharp_artifacts[0]
             modules = [src]
             # For go, the modules are based on the presence of go.mod files
-            if tool_lang == "go":
+            if tool_lang == "go" and not extra_args.get("module"):
                 go_mods = find_go_mods(src)
                 if go_mods:
                     modules = [os.path.dirname(gmod) for gmod in go_mods]
@@ -639,7 +806,7 @@ def exec_tool(
                     else os.path.abspath(
                         os.path.join(
                             cpg_out_dir,
-                            f"{os.path.basename(amodule)}-{tool_lang_simple}.cpg.bin",
+                            f"{extra_args.get('module_name') or os.path.basename(amodule)}-{tool_lang_simple}.cpg.bin",
                         )
                     )
                 )
@@ -679,14 +846,27 @@ def exec_tool(
                         ".cpg.bin", f".{extra_args['slice_mode']}.json"
                     )
                     extra_args["slice_out"] = slice_out
+                # Point the frontend at a pruned view of the source
+                source_view, exclusion_report = build_job_view(
+                    tool_lang,
+                    amodule,
+                    extra_args,
+                    manifest_out.replace(".manifest.json", ".exclusions.json")
+                    if manifest_out
+                    else None,
+                )
+                staged_views.append(source_view)
+                frontend_src = (
+                    source_view["view"] if source_view else os.path.abspath(amodule)
+                )
                 cmd_with_args = cmd_with_args % dict(
-                    src=os.path.abspath(amodule),
+                    src=frontend_src,
                     cpg_out=cpg_out,
                     atom_out=atom_out,
                     atom_bin_dir=atom_bin_dir,
                     joern_home=joern_home,
                     home_dir=str(Path.home()),
-                    uber_jar=uber_jar,
+                    uber_jar=uber_jar or frontend_src,
                     csharp_artifacts=csharp_artifacts,
                     memory=cpggen_memory,
                     tool_lang=tool_lang,
@@ -730,6 +910,12 @@ def exec_tool(
                     **extra_args,
                 )
                 cmd_list_with_args = cmd_with_args.split(" ")
+                cmd_list_with_args += get_frontend_args(
+                    ATOM_CMD if use_atom else cpg_cmd_lang,
+                    extra_args,
+                    frontend_src,
+                    os.path.abspath(amodule),
+                )
                 sbom_cmd_list_with_args = sbom_cmd_with_args.split(" ")
                 lang_cmd = cmd_list_with_args[0]
                 if not check_command(lang_cmd) and not os.path.exists(lang_cmd):
@@ -747,6 +933,9 @@ def exec_tool(
                             "%s is not found. Ensure the PATH variable in your container image is set to the bin directory of Joern.",
                             lang_cmd,
                         )
+                    remove_source_view(source_view)
+                    if is_temp_bundle:
+                        remove_bundle(uber_jar)
                     return
                 # Is this an Export or Slice task?
                 if tool_lang in ("export", "slice", "vectors"):
@@ -830,6 +1019,10 @@ def exec_tool(
                                         total=100,
                                     )
                                     dot_convert(cpg_out_dir, env)
+                                # Slices of a cpg built from a view point into it
+                                rewrite_view_paths(
+                                    slice_out, extra_args.get("source_view")
+                                )
                             else:
                                 LOG.warning(
                                     "Unable to %s %s to %s. Try running joern-%s manually using the command %s",
@@ -856,7 +1049,7 @@ def exec_tool(
                     os.path.basename(amodule),
                     " ".join(cmd_list_with_args),
                 )
-                cwd = amodule
+                cwd = amodule if os.path.isdir(amodule) else os.path.dirname(amodule)
                 if tool_lang in ("binary",):
                     cwd = os.getcwd()
                 if tool_lang != "binary" and not extra_args.get("skip_sbom"):
@@ -897,16 +1090,28 @@ def exec_tool(
                     completed=20,
                     total=100,
                 )
-                cp = subprocess.run(
-                    cmd_list_with_args,
-                    stdout=stdout,
-                    stderr=stderr,
-                    cwd=cwd,
-                    env=env,
-                    check=False,
-                    shell=USE_SHELL,
-                    encoding="utf-8",
-                )
+                try:
+                    cp = subprocess.run(
+                        cmd_list_with_args,
+                        stdout=stdout,
+                        stderr=stderr,
+                        cwd=cwd,
+                        env=env,
+                        check=False,
+                        shell=USE_SHELL,
+                        encoding="utf-8",
+                        timeout=extra_args.get("job_timeout"),
+                    )
+                except subprocess.TimeoutExpired:
+                    LOG.warning(
+                        "%s for %s timed out after %s seconds",
+                        whats_built,
+                        os.path.basename(amodule),
+                        extra_args.get("job_timeout"),
+                    )
+                    remove_source_view(source_view)
+                    progress.update(task, completed=100, total=100)
+                    continue
                 if cp and stdout == subprocess.PIPE:
                     for _ in cp.stdout:
                         progress.update(task, completed=5)
@@ -918,6 +1123,8 @@ def exec_tool(
                 # If the tool produced atom file then prefer that over cpg
                 if not os.path.exists(cpg_out) and os.path.exists(atom_out):
                     cpg_out = atom_out
+                # The view is removed once the manifest is written
+                rewrite_view_paths(slice_out, source_view)
                 if os.path.exists(cpg_out):
                     if os.getenv("CI"):
                         LOG.info(
@@ -985,6 +1192,15 @@ def exec_tool(
                             "cpg_frontend_invocation": " ".join(cmd_list_with_args),
                             "sbom_invocation": " ".join(sbom_cmd_list_with_args),
                         }
+                        app_manifest.update(get_job_manifest(extra_args))
+                        app_manifest.update(
+                            get_view_manifest(
+                                amodule,
+                                source_view,
+                                extra_args.get("snapshot"),
+                                exclusion_report,
+                            )
+                        )
                         app_manifest_list.append(app_manifest)
                         json.dump(app_manifest, mfp)
                 else:
@@ -1005,6 +1221,7 @@ def exec_tool(
                     if cp.stderr:
                         LOG.info(cp.stderr)
                     troubleshoot_app(lang_build_crashes, tool_lang)
+                remove_source_view(source_view)
                 progress.update(task, completed=100, total=100)
         except subprocess.SubprocessError as se:
             if not os.getenv("AT_DEBUG_MODE"):
@@ -1012,4 +1229,9 @@ def exec_tool(
                     "Set the environment variable AT_DEBUG_MODE to debug to see the debug logs"
                 )
             LOG.warning(se)
+        finally:
+            for staged_view in staged_views:
+                remove_source_view(staged_view)
+        if is_temp_bundle:
+            remove_bundle(uber_jar)
     return app_manifest_list
@@ -0,0 +1,1199 @@
+import glob
+import json
+import math
+import os
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+from cpggen.logger import LOG
+from cpggen.staging import get_view_files, source_view_languages
+from cpggen.utils import (
+    get_file_sizes,
+    get_inventory,
+    get_language_stats,
+    get_project_type_files,
+    get_walk_workers,
+    project_type_extensions,
+)
+
+# Size of the chunks read while counting lines
+LINE_COUNT_CHUNK_SIZE = 1024 * 1024
+
+# Average number of bytes per line used when the lines were not counted
+AVERAGE_LINE_BYTES = 40
+
+# Project types whose inputs are binaries and hence are costed by size
+binary_project_types = ("jimple", "binary", "jar", "maven")
+
+# Rough cost of each frontend. A fixed startup cost for the JVM plus the cost
+# per thousand lines of code or per megabyte of binary input.
+# Override or extend with a json file of the same shape using CPGGEN_COST_MODEL
+frontend_cost_model = {
+    "default": {
+        "startup_seconds": 15,
+        "seconds_per_kloc": 0.5,
+        "seconds_per_mb": 2,
+        "base_heap_mb": 1024,
+        "heap_mb_per_kloc": 8,
+        "heap_mb_per_mb": 40,
+    },
+    "c": {
+        "startup_seconds": 10,
+        "seconds_per_kloc": 0.4,
+        "seconds_per_mb": 0,
+        "base_heap_mb": 1024,
+        "heap_mb_per_kloc": 10,
+        "heap_mb_per_mb": 0,
+    },
+    "java": {
+        "startup_seconds": 15,
+        "seconds_per_kloc": 0.6,
+        "seconds_per_mb": 0,
+        "base_heap_mb": 1024,
+        "heap_mb_per_kloc": 12,
+        "heap_mb_per_mb": 0,
+    },
+    "js": {
+        "startup_seconds": 10,
+        "seconds_per_kloc": 0.3,
+        "seconds_per_mb": 0,
+        "base_heap_mb": 1024,
+        "heap_mb_per_kloc": 6,
+        "heap_mb_per_mb": 0,
+    },
+    "python": {
+        "startup_seconds": 10,
+        "seconds_per_kloc": 0.4,
+        "seconds_per_mb": 0,
+        "base_heap_mb": 1024,
+        "heap_mb_per_kloc": 8,
+        "heap_mb_per_mb": 0,
+    },
+    "kotlin": {
+        "startup_seconds": 30,
+        "seconds_per_kloc": 1.0,
+        "seconds_per_mb": 0,
+        "base_heap_mb": 2048,
+        "heap_mb_per_kloc": 16,
+        "heap_mb_per_mb": 0,
+    },
+    "jimple": {
+        "startup_seconds": 20,
+        "seconds_per_kloc": 0,
+        "seconds_per_mb": 4,
+        "base_heap_mb": 2048,
+        "heap_mb_per_kloc": 0,
+        "heap_mb_per_mb": 60,
+    },
+    "binary": {
+        "startup_seconds": 60,
+        "seconds_per_kloc": 0,
+        "seconds_per_mb": 30,
+        "base_heap_mb": 2048,
+        "heap_mb_per_kloc": 0,
+        "heap_mb_per_mb": 200,
+    },
+}
+frontend_cost_model["cpp"] = frontend_cost_model["c"]
+frontend_cost_model["ts"] = frontend_cost_model["js"]
+frontend_cost_model["javascript"] = frontend_cost_model["js"]
+frontend_cost_model["typescript"] = frontend_cost_model["js"]
+frontend_cost_model["jar"] = frontend_cost_model["jimple"]
+frontend_cost_model["maven"] = frontend_cost_model["jimple"]
+frontend_cost_model["pypi"] = frontend_cost_model["python"]
+
+# Build files that mark the root of a module and the kind of module
+module_markers = {
+    "pom.xml": "java",
+    "build.gradle": "java",
+    "build.gradle.kts": "java",
+    "build.sbt": "java",
+    "package.json": "js",
+    "pyproject.toml": "python",
+    "setup.py": "python",
+    "go.mod": "go",
+    "CMakeLists.txt": "c",
+}
+
+# Languages that can be generated per module for each kind of module
+module_languages = {
+    "java": ("java", "kotlin", "scala", "jsp"),
+    "js": ("js", "ts", "javascript", "typescript"),
+    "python": ("python", "py"),
+    "go": ("go",),
+    "c": ("c", "cpp"),
+}
+
+# Files that define the packages of a js workspace
+workspace_files = (
+    "package.json",
+    "pnpm-workspace.yaml",
+    "lerna.json",
+    "workspace.json",
+)
+
+# Modules predicted to take longer than this are spread over the cores
+SHARD_MIN_SECONDS = int(os.getenv("CPGGEN_SHARD_MIN_SECONDS", "600"))
+
+# Headers are needed by every shard to resolve the includes
+shared_extensions = (".h", ".hh", ".hpp", ".hxx", ".inc")
+
+# Planning details of a job that are kept in its manifest
+manifest_job_keys = (
+    "module",
+    "workspace",
+    "shard",
+    "compile_commands",
+    "corpus",
+    "language_stats",
+    "cost_estimate",
+)
+
+# Project files read by the frontends that every shard of a module needs
+shard_common_names = {
+    "js": ("package.json", "tsconfig.json", "jsconfig.json"),
+    "ts": ("package.json", "tsconfig.json", "jsconfig.json"),
+    "javascript": ("package.json", "tsconfig.json", "jsconfig.json"),
+    "typescript": ("package.json", "tsconfig.json", "jsconfig.json"),
+    "python": ("pyproject.toml", "setup.py", "setup.cfg"),
+    "php": ("composer.json",),
+}
+
+# Prefixes of the build directories searched for a compile_commands.json
+compile_commands_dirs = ("build", "out", "cmake-build")
+
+# Compiler flags that add an include directory
+include_flags = ("-I", "-isystem", "-iquote", "-idirafter")
+
+
+def load_cost_model(model_file):
+    """
+    Method to merge the overrides of a cost model file onto the defaults.
+    Frontends that are only partially overridden keep their other defaults.
+    :param model_file: Path to a json file keyed by frontend
+    """
+    try:
+        with open(model_file, encoding="utf-8") as cfp:
+            overrides = json.load(cfp)
+    except (OSError, ValueError) as e:
+        LOG.warning("Unable to load the cost model: %s", e)
+        return
+    if not isinstance(overrides, dict):
+        LOG.warning("Ignoring the cost model %s since it is not an object", model_file)
+        return
+    for tool_lang, override in overrides.items():
+        if not isinstance(override, dict):
+            LOG.warning("Ignoring the cost model of %s", tool_lang)
+            continue
+        base = frontend_cost_model.get(
+            tool_lang,
+            frontend_cost_model.get(
+                tool_lang.split("-")[0], frontend_cost_model["default"]
+            ),
+        )
+        frontend_cost_model[tool_lang] = {**base, **override}
+
+
+if os.getenv("CPGGEN_COST_MODEL") and os.path.exists(os.getenv("CPGGEN_COST_MODEL")):
+    load_cost_model(os.getenv("CPGGEN_COST_MODEL"))
+
+
+def count_lines(path):
+    """
+    Method to count the lines of a file using bulk reads
+    :param path: File path
+    :return: Number of lines. A final line without a newline is also counted
+    """
+    lines = 0
+    last_chunk = b""
+    try:
+        with open(path, "rb", buffering=0) as fp:
+            while True:
+                chunk = fp.read(LINE_COUNT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                lines += chunk.count(b"\n")
+                last_chunk = chunk
+    except OSError:
+        return 0
+    if last_chunk and not last_chunk.endswith(b"\n"):
+        lines += 1
+    return lines
+
+
+def count_lines_parallel(paths):
+    """
+    Method to count the lines of many files on a thread pool
+    :param paths: List of file paths
+    :return: List of line counts
+    """
+    if len(paths) > 1 and get_walk_workers() > 1:
+        with ThreadPoolExecutor(max_workers=get_walk_workers()) as pool:
+            return list(pool.map(count_lines, paths, chunksize=32))
+    return [count_lines(p) for p in paths]
+
+
+def get_code_stats(src_dir, project_types, count_loc=None, stats=None):
+    """
+    Method to compute the files, bytes and lines of code of each project type.
+    Only the files kept by the ignore rules of the inventory are counted.
+    Reading every file to count the lines is only done on request.
+    :param src_dir: Source directory
+    :param project_types: List of project types
+    :param count_loc: Boolean to count the lines. Set CPGGEN_COUNT_LINES to true
+        to count by default
+    :param stats: Optional statistics from get_language_stats to reuse
+    :return: Dict of project type to a dict with the files, bytes and lines
+    """
+    if count_loc is None:
+        count_loc = os.getenv("CPGGEN_COUNT_LINES") in ("true", "1")
+    inventory = None
+    if src_dir and os.path.isdir(src_dir):
+        inventory = get_inventory(src_dir)
+    stats = {p: (stats or {})[p] for p in project_types if p in (stats or {})}
+    missing = [p for p in project_types if p not in stats]
+    if missing:
+        stats.update(get_language_stats(src_dir, missing, inventory))
+    if not count_loc:
+        return stats
+    for project_type, lang_stats in stats.items():
+        if project_type.split("-")[0] in binary_project_types:
+            continue
+        files = get_project_type_files(src_dir, project_type, inventory)
+        lang_stats["lines"] = sum(count_lines_parallel(files))
+    return stats
+
+
+def get_cost_model(tool_lang):
+    """
+    Method to return the cost model of a frontend
+    :param tool_lang: Language or cpg_tools_map key such as java-with-deps
+    :return: Dict with the cost coefficients
+    """
+    return frontend_cost_model.get(
+        tool_lang,
+        frontend_cost_model.get(
+            tool_lang.split("-")[0], frontend_cost_model["default"]
+        ),
+    )
+
+
+def estimate_cost(tool_lang, lang_stats):
+    """
+    Method to predict the runtime and heap of a frontend invocation
+    :param tool_lang: Language or cpg_tools_map key
+    :param lang_stats: Dict with the files, bytes and optionally lines
+    :return: Dict with the predicted seconds and heap in megabytes
+    """
+    model = get_cost_model(tool_lang)
+    lang_stats = lang_stats or {}
+    size_mb = lang_stats.get("bytes", 0) / (1024 * 1024)
+    if tool_lang.split("-")[0] in binary_project_types:
+        kloc = 0
+        # Archives are costed by the size of their contents
+        if lang_stats.get("uncompressed_bytes"):
+            size_mb = (
+                lang_stats["bytes"]
+                - lang_stats.get("archive_bytes", 0)
+                + lang_stats["uncompressed_bytes"]
+            ) / (1024 * 1024)
+    elif "lines" in lang_stats:
+        kloc = lang_stats["lines"] / 1000
+    else:
+        kloc = lang_stats.get("bytes", 0) / AVERAGE_LINE_BYTES / 1000
+    seconds = (
+        model["startup_seconds"]
+        + model["seconds_per_kloc"] * kloc
+        + model["seconds_per_mb"] * size_mb
+    )
+    heap_mb = (
+        model["base_heap_mb"]
+        + model["heap_mb_per_kloc"] * kloc
+        + model["heap_mb_per_mb"] * size_mb
+    )
+    return {"seconds": int(seconds), "heap_mb": int(heap_mb)}
+
+
+def estimate_costs(project_types, stats):
+    """
+    Method to predict the cost of each project type
+    :param project_types: List of project types
+    :param stats: Statistics from get_code_stats
+    :return: Dict of project type to the predicted cost
+    """
+    return {
+        project_type: estimate_cost(project_type, stats.get(project_type))
+        for project_type in project_types
+    }
+
+
+def order_by_cost(project_types, estimates):
+    """
+    Method to order the project types with the most expensive ones first so
+    that the longest jobs start early in the worker pool
+    :param project_types: List of project types
+    :param estimates: Predicted costs from estimate_costs
+    :return: Sorted list of project types
+    """
+    return sorted(
+        project_types,
+        key=lambda p: estimates.get(p, {}).get("seconds", 0),
+        reverse=True,
+    )
+
+
+def find_modules(src_dir, inventory=None):
+    """
+    Method to discover the module roots of a monorepo and their nesting
+    using the build files in the inventory
+    :param src_dir: Source directory
+    :param inventory: Optional inventory of src_dir
+    :return: Module graph dict with the src and the list of modules. Each module
+        has its root, relative path, build files, module types, parent and children
+    """
+    if inventory is None:
+        inventory = get_inventory(src_dir)
+    src_dir = inventory["src"]
+    modules = {}
+    for marker, module_type in module_markers.items():
+        for i in inventory["names"].get(marker, []):
+            root = os.path.dirname(inventory["files"][i])
+            module = modules.setdefault(
+                root,
+                {
+                    "root": root,
+                    "path": os.path.relpath(root, src_dir),
+                    "markers": [],
+                    "types": [],
+                    "parent": None,
+                    "children": [],
+                },
+            )
+            module["markers"].append(marker)
+            if module_type not in module["types"]:
+                module["types"].append(module_type)
+    for root in sorted(modules):
+        parent = os.path.dirname(root)
+        while parent not in modules and len(parent) > len(src_dir):
+            parent = os.path.dirname(parent)
+        if parent in modules and parent != root:
+            modules[root]["parent"] = modules[parent]["path"]
+            modules[parent]["children"].append(modules[root]["path"])
+    return {"src": src_dir, "modules": [modules[root] for root in sorted(modules)]}
+
+
+def get_module_type(tool_lang):
+    """
+    Method to return the kind of module used by a language
+    :param tool_lang: Language or cpg_tools_map key
+    :return: Module type or None if the language cannot be split into modules
+    """
+    tool_lang_simple = tool_lang.split("-")[0]
+    for module_type, languages in module_languages.items():
+        if tool_lang_simple in languages:
+            return module_type
+    return None
+
+
+def get_module_jobs(graph, tool_lang, inventory=None):
+    """
+    Method to split a language into independent jobs, one per module.
+    A module is only split into its child modules when it has no source files
+    of its own, so that every source file is covered by exactly one job.
+    :param graph: Module graph from find_modules
+    :param tool_lang: Language or cpg_tools_map key
+    :param inventory: Optional inventory of the source directory
+    :return: List of jobs with the root, path, files and bytes. An empty list is
+        returned when the language should be generated for the whole src
+    """
+    module_type = get_module_type(tool_lang)
+    if not module_type:
+        return []
+    src_dir = graph["src"]
+    if inventory is None:
+        inventory = get_inventory(src_dir)
+    roots = {
+        m["root"]: {"root": m["root"], "path": m["path"], "files": [], "children": []}
+        for m in graph["modules"]
+        if module_type in m["types"]
+    }
+    roots.setdefault(
+        src_dir, {"root": src_dir, "path": ".", "files": [], "children": []}
+    )
+    # Nest the modules of this type using their nearest enclosing module
+    for root in sorted(roots):
+        if root == src_dir:
+            continue
+        parent = os.path.dirname(root)
+        while parent not in roots:
+            parent = os.path.dirname(parent)
+        roots[parent]["children"].append(roots[root])
+    # Each file belongs to its nearest module
+    for f in get_project_type_files(src_dir, tool_lang, inventory):
+        parent = os.path.dirname(f)
+        while parent not in roots and len(parent) > len(src_dir):
+            parent = os.path.dirname(parent)
+        roots.get(parent, roots[src_dir])["files"].append(f)
+
+    def collect(node):
+        if node["files"] or not node["children"]:
+            return [node] if node["files"] else []
+        jobs = []
+        for child in node["children"]:
+            jobs += collect(child)
+        return jobs
+
+    jobs = collect(roots[src_dir])
+    if len(jobs) < 2:
+        return []
+    for job in jobs:
+        subtree = []
+        pending = [job]
+        while pending:
+            node = pending.pop()
+            subtree += node["files"]
+            pending += node["children"]
+        job["files"] = len(subtree)
+        job["bytes"] = sum(get_file_sizes(subtree, inventory))
+        del job["children"]
+    return sorted(jobs, key=lambda j: j["bytes"], reverse=True)
+
+
+def read_pnpm_workspace(path):
+    """
+    Method to read the package globs of a pnpm-workspace.yaml without a yaml
+    parser. Only the packages list is needed.
+    :param path: Path to pnpm-workspace.yaml
+    :return: List of package globs
+    """
+    patterns = []
+    in_packages = False
+    try:
+        with open(path, encoding="utf-8") as fp:
+            for line in fp:
+                stripped = line.split("#")[0].strip()
+                if not stripped:
+                    continue
+                if not line[0].isspace():
+                    in_packages = stripped == "packages:"
+                    continue
+                if in_packages and stripped.startswith("-"):
+                    patterns.append(stripped[1:].strip().strip("'\""))
+    except OSError:
+        return []
+    return patterns
+
+
+def get_workspace_patterns(src_dir):
+    """
+    Method to read the package globs of the npm, yarn, pnpm, lerna and nx
+    workspace definitions at the root of a js monorepo
+    :param src_dir: Source directory
+    :return: Tuple of the list of package globs, the list of nx project
+        directories and the workspace tools found
+    """
+    patterns = []
+    projects = []
+    tools = []
+    for name in workspace_files:
+        path = os.path.join(src_dir, name)
+        if not os.path.isfile(path):
+            continue
+        if name == "pnpm-workspace.yaml":
+            found = read_pnpm_workspace(path)
+        else:
+            try:
+                with open(path, encoding="utf-8") as fp:
+                    data = json.load(fp)
+            except (OSError, ValueError) as e:
+                LOG.debug("Unable to read %s: %s", path, e)
+                continue
+            if not isinstance(data, dict):
+                continue
+            if name == "workspace.json":
+                # nx maps the project names to their root or to a config
+                found = [
+                    v if isinstance(v, str) else v.get("root", "")
+                    for v in (data.get("projects") or {}).values()
+                    if isinstance(v, (str, dict))
+                ]
+                found = [f for f in found if isinstance(f, str) and f]
+                if found:
+                    projects += found
+                    tools.append(name)
+                continue
+            else:
+                found = data.get("workspaces") or data.get("packages") or []
+                # yarn also accepts an object with the packages and nohoist
+                if isinstance(found, dict):
+                    found = found.get("packages", [])
+        found = [f for f in found if isinstance(f, str) and f]
+        if found:
+            patterns += found
+            tools.append(name)
+    return patterns, projects, tools
+
+
+def find_workspaces(src_dir, inventory=None):
+    """
+    Method to discover the packages of a js workspace. Globs from the workspace
+    definitions are expanded and nx project.json files are treated as packages.
+    :param src_dir: Source directory
+    :param inventory: Optional inventory of src_dir
+    :return: Dict with the src, the workspace tools and the list of packages
+        with their root, relative path and name. None for other sources
+    """
+    if inventory is None:
+        inventory = get_inventory(src_dir)
+    src_dir = inventory["src"]
+    patterns, projects, tools = get_workspace_patterns(src_dir)
+    roots = {
+        os.path.abspath(os.path.join(src_dir, p))
+        for p in projects
+        if os.path.isdir(os.path.join(src_dir, p))
+    }
+    for i in inventory["names"].get("project.json", []):
+        roots.add(os.path.dirname(inventory["files"][i]))
+    if inventory["names"].get("project.json"):
+        tools.append("project.json")
+    excluded = set()
+    for pattern in patterns:
+        target = excluded if pattern.startswith("!") else roots
+        pattern = pattern.lstrip("!").rstrip("/")
+        for path in glob.glob(os.path.join(src_dir, pattern), recursive=True):
+            # Globs only match the directories that are packages
+            if os.path.isfile(os.path.join(path, "package.json")):
+                target.add(os.path.abspath(path))
+    roots.discard(src_dir)
+    roots = {
+        r
+        for r in roots - excluded
+        if "node_modules" not in os.path.relpath(r, src_dir).split(os.sep)
+    }
+    if not roots:
+        return None
+    packages = []
+    for root in sorted(roots):
+        name = None
+        try:
+            with open(os.path.join(root, "package.json"), encoding="utf-8") as fp:
+                name = json.load(fp).get("name")
+        except (OSError, ValueError, AttributeError):
+            pass
+        packages.append(
+            {
+                "root": root,
+                "path": os.path.relpath(root, src_dir),
+                "name": name or os.path.basename(root),
+            }
+        )
+    return {"src": src_dir, "tools": tools, "packages": packages}
+
+
+def get_workspace_jobs(workspaces, tool_lang, inventory=None):
+    """
+    Method to split a js or ts language into one job per workspace package.
+    Files outside the packages are generated together in a job for the root.
+    Every job is pointed at an explicit list of files so that the nested
+    node_modules and the other packages are never part of its input.
+    :param workspaces: Workspaces from find_workspaces
+    :param tool_lang: Language or cpg_tools_map key
+    :param inventory: Optional inventory of the source directory
+    :return: List of jobs. Empty when the language has fewer than two packages
+    """
+    if get_module_type(tool_lang) != "js":
+        return []
+    src_dir = workspaces["src"]
+    if inventory is None or inventory["src"] != src_dir:
+        inventory = get_inventory(src_dir)
+    packages = {
+        p["root"]: {**p, "files": [], "common": []} for p in workspaces["packages"]
+    }
+    root_package = {
+        "root": src_dir,
+        "path": ".",
+        "name": None,
+        "files": [],
+        "common": [],
+    }
+    # ts and typescript share the file extensions of js
+    lang_files = set(get_project_type_files(src_dir, "js", inventory))
+
+    def owner(f):
+        parent = os.path.dirname(f)
+        while parent not in packages and len(parent) > len(src_dir):
+            parent = os.path.dirname(parent)
+        return packages.get(parent, root_package)
+
+    for f in get_view_files(src_dir, inventory):
+        package = owner(f)
+        package["files" if f in lang_files else "common"].append(f)
+    targets = [p for p in packages.values() if p["files"]]
+    if root_package["files"]:
+        targets.append(root_package)
+    if len(targets) < 2:
+        return []
+    app_name = os.path.basename(src_dir)
+    jobs = []
+    for package in targets:
+        module_name = "-".join(
+            [app_name]
+            + ([] if package["path"] == "." else package["path"].split(os.sep))
+        )
+        package_stats = {
+            "files": len(package["files"]),
+            "bytes": sum(get_file_sizes(package["files"], inventory)),
+        }
+        jobs.append(
+            {
+                "tool_lang": tool_lang,
+                "src": package["root"],
+                "extra_args": {
+                    "module": package["path"],
+                    "module_name": module_name,
+                    "full_app_name": f"{module_name}-{tool_lang.split('-')[0]}",
+                    "workspace": package["name"],
+                    "shard_files": package["files"] + package["common"],
+                    "language_stats": package_stats,
+                    "cost_estimate": estimate_cost(tool_lang, package_stats),
+                },
+            }
+        )
+    return sorted(
+        jobs, key=lambda j: j["extra_args"]["language_stats"]["bytes"], reverse=True
+    )
+
+
+def get_memory_budget_mb():
+    """
+    Method to return the heap available to a frontend from CPGGEN_MEMORY or the
+    available memory
+    :return: Memory in megabytes
+    """
+    memory = os.getenv("CPGGEN_MEMORY", "").strip().upper()
+    units = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+    try:
+        if memory and memory[-1] in units:
+            return int(float(memory[:-1]) * units[memory[-1]])
+        if memory:
+            return int(memory) // (1024 * 1024)
+    except ValueError:
+        LOG.debug("Unable to parse the memory %s", memory)
+    return psutil.virtual_memory().available // (1024 * 1024)
+
+
+def get_job_memory(estimate, memory_mb=None):
+    """
+    Method to return the heap of a job from its predicted cost capped to the
+    memory budget
+    :param estimate: Predicted cost from estimate_cost
+    :param memory_mb: Optional memory budget in megabytes
+    :return: Memory such as 2048M or None without an estimate
+    """
+    if not estimate or not estimate.get("heap_mb"):
+        return None
+    if memory_mb is None:
+        memory_mb = get_memory_budget_mb()
+    return f"{min(estimate['heap_mb'], memory_mb)}M"
+
+
+def get_shard_count(tool_lang, estimate, memory_mb=None, cpus=None):
+    """
+    Method to derive the number of shards of a module from its predicted cost,
+    the memory budget and the core count. Modules that do not fit in the memory
+    are split until each shard fits. Long running modules are spread over the
+    cores as long as the shards running together fit in the memory.
+    :param tool_lang: Language or cpg_tools_map key
+    :param estimate: Predicted cost from estimate_cost
+    :param memory_mb: Optional memory budget in megabytes
+    :param cpus: Optional number of cores
+    :return: Number of shards
+    """
+    if not estimate:
+        return 1
+    if memory_mb is None:
+        memory_mb = get_memory_budget_mb()
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+    base_heap_mb = get_cost_model(tool_lang)["base_heap_mb"]
+    variable_heap_mb = max(0, estimate["heap_mb"] - base_heap_mb)
+    shards = 1
+    if estimate["heap_mb"] > memory_mb and memory_mb > base_heap_mb:
+        shards = math.ceil(variable_heap_mb / (memory_mb - base_heap_mb))
+    if estimate["seconds"] >= SHARD_MIN_SECONDS and base_heap_mb:
+        shards = max(
+            shards,
+            min(cpus, int((memory_mb - variable_heap_mb) // base_heap_mb)),
+        )
+    return max(1, shards)
+
+
+def split_shards(src_dir, files, sizes, shard_count):
+    """
+    Method to split files into shards of roughly equal size. Files are taken in
+    path order and directories are kept together unless they are larger than half
+    a shard so that each shard covers a few neighbouring directories.
+    :param src_dir: Source directory
+    :param files: List of files with full path
+    :param sizes: List of the file sizes
+    :param shard_count: Number of shards
+    :return: List of shards. Each shard is a list of files
+    """
+    file_sizes = dict(zip(files, sizes))
+    total = sum(sizes)
+    if shard_count < 2 or len(files) < 2 or not total:
+        return [list(files)]
+    target = total / shard_count
+    groups = {}
+    for f in sorted(files, key=lambda f: os.path.relpath(f, src_dir).split(os.sep)):
+        groups.setdefault(os.path.dirname(f), []).append(f)
+    units = []
+    for group in groups.values():
+        group_size = sum(file_sizes[f] for f in group)
+        # Large directories are split to keep the shards balanced
+        if group_size > target / 2:
+            units += [([f], file_sizes[f]) for f in group]
+        else:
+            units.append((group, group_size))
+    shards = [[]]
+    done = 0
+    for unit_files, unit_size in units:
+        # Start a new shard once the running total passes the next boundary
+        if shards[-1] and len(shards) < shard_count:
+            if done + unit_size / 2 > target * len(shards):
+                shards.append([])
+        shards[-1] += unit_files
+        done += unit_size
+    return shards
+
+
+def get_common_files(src_dir, tool_lang, inventory=None):
+    """
+    Method to return the files that every shard needs besides its own source
+    files. These are the headers for c and cpp and the project files read by
+    the js, python and php frontends.
+    :param src_dir: Source directory
+    :param tool_lang: Language or cpg_tools_map key
+    :param inventory: Optional inventory of src_dir
+    :return: List of files with full path
+    """
+    lang = tool_lang.split("-")[0]
+    extensions = shared_extensions if lang in ("c", "cpp") else ()
+    names = shard_common_names.get(lang, ())
+    return [
+        f
+        for f in get_view_files(src_dir, inventory)
+        if f.endswith(extensions) or os.path.basename(f) in names
+    ]
+
+
+def shard_job(job, shard_count, inventory=None):
+    """
+    Method to split a frontend job into one job per shard. Each shard gets the
+    common files such as headers along with its source files and a heap sized
+    for its share of the module.
+    :param job: Job from plan_jobs
+    :param shard_count: Number of shards
+    :param inventory: Optional inventory of the job source
+    :return: List of jobs
+    """
+    tool_lang = job["tool_lang"]
+    job_src = os.path.abspath(job["src"])
+    if inventory is None or inventory["src"] != job_src:
+        inventory = get_inventory(job_src)
+    files = [
+        f
+        for f in get_project_type_files(job_src, tool_lang, inventory)
+        if not f.endswith(shared_extensions)
+    ]
+    shards = split_shards(job_src, files, get_file_sizes(files, inventory), shard_count)
+    if len(shards) < 2:
+        return [job]
+    shard_files = set(files)
+    common_files = [
+        f
+        for f in get_common_files(job_src, tool_lang, inventory)
+        if f not in shard_files
+    ]
+    memory_mb = get_memory_budget_mb()
+    base_name = job["extra_args"].get("module_name") or os.path.basename(job_src)
+    jobs = []
+    for i, shard in enumerate(shards):
+        shard_stats = {
+            "files": len(shard),
+            "bytes": sum(get_file_sizes(shard, inventory)),
+        }
+        module_name = f"{base_name}-shard{i + 1}"
+        shard_estimate = estimate_cost(tool_lang, shard_stats)
+        extra_args = {
+            **job["extra_args"],
+            "module_name": module_name,
+            "full_app_name": f"{module_name}-{tool_lang.split('-')[0]}",
+            "shard": {"index": i, "count": len(shards), **shard_stats},
+            "shard_files": shard + common_files,
+            "language_stats": shard_stats,
+            "cost_estimate": shard_estimate,
+        }
+        job_memory = get_job_memory(shard_estimate, memory_mb)
+        if job_memory:
+            extra_args["job_memory"] = job_memory
+        jobs.append({"tool_lang": tool_lang, "src": job_src, "extra_args": extra_args})
+    return jobs
+
+
+def find_compile_commands(src_dir):
+    """
+    Method to locate the compilation database of a c or cpp project. The source
+    root and the build directories directly under it are searched.
+    Set CPGGEN_COMPILE_COMMANDS to the path of a database to use or to false to
+    ignore the ones found in the source.
+    :param src_dir: Source directory
+    :return: Path to compile_commands.json or None
+    """
+    compile_commands = os.getenv("CPGGEN_COMPILE_COMMANDS", "")
+    if compile_commands.lower() in ("false", "0", "no"):
+        return None
+    if compile_commands:
+        return (
+            os.path.abspath(compile_commands)
+            if os.path.isfile(compile_commands)
+            else None
+        )
+    candidates = [os.path.join(src_dir, "compile_commands.json")]
+    try:
+        candidates += [
+            os.path.join(src_dir, d, "compile_commands.json")
+            for d in sorted(os.listdir(src_dir))
+            if d.startswith(compile_commands_dirs)
+        ]
+    except OSError:
+        return None
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+    return None
+
+
+def parse_compile_command(entry):
+    """
+    Method to extract the translation unit, include directories and defines
+    from an entry of a compilation database
+    :param entry: Entry with the directory, file and command or arguments
+    :return: Dict with the file, includes and defines
+    """
+    directory = entry.get("directory", "")
+    args = entry.get("arguments") or shlex.split(entry.get("command", ""))
+    includes = []
+    defines = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        values = None
+        for flag in include_flags + ("-D",):
+            if arg == flag and i + 1 < len(args):
+                values = (flag, args[i + 1])
+                i += 1
+                break
+            if arg.startswith(flag) and len(arg) > len(flag):
+                values = (flag, arg[len(flag) :])
+                break
+        if values and values[0] == "-D":
+            defines.append(values[1])
+        elif values:
+            includes.append(os.path.normpath(os.path.join(directory, values[1])))
+        i += 1
+    return {
+        "file": os.path.normpath(os.path.join(directory, entry["file"])),
+        "includes": includes,
+        "defines": defines,
+    }
+
+
+def load_compile_commands(db_file, src_dir):
+    """
+    Method to read the translation units of a compilation database that belong
+    to the source directory. Files compiled more than once keep the first entry.
+    :param db_file: Path to compile_commands.json
+    :param src_dir: Source directory
+    :return: List of translation units from parse_compile_command
+    """
+    src_dir = os.path.abspath(src_dir)
+    try:
+        with open(db_file, encoding="utf-8") as fp:
+            entries = json.load(fp)
+        units = [parse_compile_command(e) for e in entries]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        LOG.debug("Unable to read the compilation database %s: %s", db_file, e)
+        return []
+    seen = set()
+    ret = []
+    for unit in units:
+        afile = os.path.abspath(unit["file"])
+        if afile in seen or not afile.startswith(src_dir + os.sep):
+            continue
+        if not os.path.isfile(afile):
+            continue
+        seen.add(afile)
+        ret.append({**unit, "file": afile})
+    return ret
+
+
+def get_compile_args(units, src_dir):
+    """
+    Method to collect the include directories and defines used by some
+    translation units. Include directories under the source are made relative
+    so that they can be resolved against a source view or snapshot.
+    :param units: List of translation units
+    :param src_dir: Source directory
+    :return: Dict with the includes and defines
+    """
+    src_dir = os.path.abspath(src_dir)
+    includes = {}
+    defines = {}
+    for unit in units:
+        for include in unit["includes"]:
+            if include == src_dir or include.startswith(src_dir + os.sep):
+                include = os.path.relpath(include, src_dir)
+            includes.setdefault(include, True)
+        for define in unit["defines"]:
+            defines.setdefault(define, True)
+    return {"includes": list(includes), "defines": list(defines)}
+
+
+def format_compile_args(compile_commands, src_dir, original_dir=None):
+    """
+    Method to build the c2cpg arguments for the include directories and defines.
+    Each value is a separate argument so that paths with spaces are kept intact.
+    Include directories that are not staged in a source view, such as those
+    under vendor, point to the original source.
+    :param compile_commands: compile_commands of the job extra_args
+    :param src_dir: Directory the frontend is pointed at
+    :param original_dir: Optional source directory that src_dir is a view of
+    :return: List of arguments
+    """
+    if not compile_commands:
+        return []
+    args = []
+    for include in compile_commands["includes"]:
+        include_dir = os.path.join(src_dir, include)
+        if original_dir and not os.path.isdir(include_dir):
+            include_dir = os.path.join(original_dir, include)
+        args += ["--include", include_dir]
+    for define in compile_commands["defines"]:
+        args += ["--define", define]
+    return args
+
+
+def get_frontend_args(cmd_lang, extra_args, src_dir, original_dir=None):
+    """
+    Method to return the arguments added to the frontend command of a job. These
+    are the include directories and defines of its translation units, which
+    are only passed to c2cpg.
+    :param cmd_lang: cpg_tools_map key of the command
+    :param extra_args: Job extra_args
+    :param src_dir: Directory the frontend is pointed at
+    :param original_dir: Optional source directory that src_dir is a view of
+    :return: List of arguments
+    """
+    if not cmd_lang.endswith("-with-compile-commands"):
+        return []
+    return format_compile_args(
+        extra_args.get("compile_commands"), src_dir, original_dir
+    )
+
+
+def get_job_manifest(extra_args):
+    """
+    Method to return the planning details of a job that are kept in its manifest
+    :param extra_args: Job extra_args
+    :return: Dict of the manifest fields
+    """
+    return {k: extra_args[k] for k in manifest_job_keys if extra_args.get(k)}
+
+
+def plan_compile_commands_jobs(job, db_file, shard=False, inventory=None):
+    """
+    Method to limit a c or cpp job to the translation units of a compilation
+    database. With shard, the translation units are split over several jobs
+    that each get only the include directories and defines of their units.
+    :param job: Job from plan_jobs
+    :param db_file: Path to compile_commands.json
+    :param shard: Boolean to split the translation units into shards
+    :param inventory: Optional inventory of the job source
+    :return: List of jobs or None if the database has no unit for the job
+    """
+    tool_lang = job["tool_lang"]
+    job_src = os.path.abspath(job["src"])
+    unit_extensions = tuple(
+        e for e in project_type_extensions["c"] if e not in shared_extensions
+    )
+    units = [
+        u
+        for u in load_compile_commands(db_file, job_src)
+        if u["file"].endswith(unit_extensions)
+    ]
+    if not units:
+        return None
+    if inventory is None or inventory["src"] != job_src:
+        inventory = get_inventory(job_src)
+    files = [u["file"] for u in units]
+    sizes = get_file_sizes(files, inventory)
+    shard_count = 1
+    if shard:
+        shard_count = get_shard_count(
+            tool_lang,
+            estimate_cost(tool_lang, {"files": len(files), "bytes": sum(sizes)}),
+        )
+    shards = split_shards(job_src, files, sizes, shard_count)
+    units_by_file = {u["file"]: u for u in units}
+    common_files = [
+        f
+        for f in get_common_files(job_src, tool_lang, inventory)
+        if not f.endswith(unit_extensions)
+    ]
+    cc_tool_lang = f"{tool_lang.split('-')[0]}-with-compile-commands"
+    base_name = job["extra_args"].get("module_name") or os.path.basename(job_src)
+    jobs = []
+    for i, shard_units in enumerate(shards):
+        shard_stats = {
+            "files": len(shard_units),
+            "bytes": sum(get_file_sizes(shard_units, inventory)),
+        }
+        extra_args = {
+            **job["extra_args"],
+            "shard_files": shard_units + common_files,
+            "compile_commands": {
+                "file": db_file,
+                "units": len(shard_units),
+                **get_compile_args([units_by_file[f] for f in shard_units], job_src),
+            },
+            "language_stats": shard_stats,
+            "cost_estimate": estimate_cost(tool_lang, shard_stats),
+        }
+        if len(shards) > 1:
+            module_name = f"{base_name}-shard{i + 1}"
+            extra_args["module_name"] = module_name
+            extra_args["full_app_name"] = f"{module_name}-{tool_lang.split('-')[0]}"
+            extra_args["shard"] = {"index": i, "count": len(shards), **shard_stats}
+            job_memory = get_job_memory(extra_args["cost_estimate"])
+            if job_memory:
+                extra_args["job_memory"] = job_memory
+        jobs.append(
+            {"tool_lang": cc_tool_lang, "src": job_src, "extra_args": extra_args}
+        )
+    return jobs
+
+
+def plan_jobs(
+    src_dir,
+    languages,
+    stats,
+    estimates,
+    split_modules=False,
+    shard=False,
+    split_workspaces=False,
+):
+    """
+    Method to turn the languages into frontend jobs. With split_modules, the
+    languages of a monorepo are fanned out as one job per module. With shard,
+    modules that are too big for a single frontend are split into shards.
+    c and cpp jobs are limited to the translation units of a compilation
+    database when one is found.
+    With split_workspaces, js and ts are generated per workspace package.
+    :param src_dir: Source directory
+    :param languages: Ordered list of languages
+    :param stats: Statistics from get_code_stats
+    :param estimates: Predicted costs from estimate_costs
+    :param split_modules: Boolean to split the languages into module jobs
+    :param shard: Boolean to split the large jobs into shards
+    :param split_workspaces: Boolean to split js workspaces into package jobs
+    :return: Tuple of the list of jobs and the module graph if one was built.
+        Each job has the tool_lang, src and the extra_args for exec_tool
+    """
+    jobs = []
+    graph = None
+    workspaces = None
+    inventory = None
+    if split_modules and os.path.isdir(src_dir):
+        inventory = get_inventory(src_dir)
+        graph = find_modules(src_dir, inventory)
+    if (
+        split_workspaces
+        and os.path.isdir(src_dir)
+        and any(get_module_type(lang) == "js" for lang in languages)
+    ):
+        inventory = inventory or get_inventory(src_dir)
+        workspaces = find_workspaces(src_dir, inventory)
+    for tool_lang in languages:
+        if workspaces:
+            workspace_jobs = get_workspace_jobs(workspaces, tool_lang, inventory)
+            if workspace_jobs:
+                jobs += workspace_jobs
+                continue
+        module_jobs = []
+        if graph and graph["modules"]:
+            module_jobs = get_module_jobs(graph, tool_lang, inventory)
+        if not module_jobs:
+            jobs.append(
+                {
+                    "tool_lang": tool_lang,
+                    "src": src_dir,
+                    "extra_args": {
+                        "language_stats": stats.get(tool_lang),
+                        "cost_estimate": estimates.get(tool_lang),
+                    },
+                }
+            )
+            continue
+        app_name = os.path.basename(os.path.abspath(src_dir))
+        for module in module_jobs:
+            module_name = "-".join([app_name] + module["path"].split(os.sep))
+            module_stats = {"files": module["files"], "bytes": module["bytes"]}
+            jobs.append(
+                {
+                    "tool_lang": tool_lang,
+                    "src": module["root"],
+                    "extra_args": {
+                        "module": module["path"],
+                        "module_name": module_name,
+                        "full_app_name": f"{module_name}-{tool_lang.split('-')[0]}",
+                        "language_stats": module_stats,
+                        "cost_estimate": estimate_cost(tool_lang, module_stats),
+                    },
+                }
+            )
+    if not os.path.isdir(src_dir):
+        return jobs, graph
+    # c and cpp jobs with a compilation database are limited to its units
+    db_file = None
+    if any(lang.split("-")[0] in ("c", "cpp") for lang in languages):
+        db_file = find_compile_commands(src_dir)
+    planned_jobs = []
+    for job in jobs:
+        cc_jobs = None
+        if db_file and job["tool_lang"].split("-")[0] in ("c", "cpp"):
+            cc_jobs = plan_compile_commands_jobs(
+                job, find_compile_commands(job["src"]) or db_file, shard=shard
+            )
+        planned_jobs += cc_jobs or [job]
+    jobs = planned_jobs
+    if not shard:
+        return jobs, graph
+    sharded_jobs = []
+    for job in jobs:
+        shard_count = 1
+        # Jobs with an explicit list of files are already split
+        if job["extra_args"].get("shard_files"):
+            sharded_jobs.append(job)
+            continue
+        if job["tool_lang"] in source_view_languages:
+            shard_count = get_shard_count(
+                job["tool_lang"], job["extra_args"].get("cost_estimate")
+            )
+        if shard_count > 1:
+            sharded_jobs += shard_job(job, shard_count)
+        else:
+            sharded_jobs.append(job)
+    return sharded_jobs, graph
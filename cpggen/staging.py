@@ -0,0 +1,798 @@
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from cpggen.logger import LOG
+from cpggen.utils import (
+    get_file_sizes,
+    get_int_attr,
+    get_inventory,
+    get_walk_workers,
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to clone a file on Linux
+FICLONE = 0x40049409
+
+# cpg_tools_map keys whose frontends parse the source files directly and can be
+# pointed at a pruned view of the source. Variants that fetch dependencies or
+# need build outputs, vendored dependencies or wrapper directories such as
+# gradle and .mvn of the original tree are not listed.
+source_view_languages = (
+    "c",
+    "cpp",
+    "c-with-compile-commands",
+    "cpp-with-compile-commands",
+    "java",
+    "kotlin",
+    "js",
+    "ts",
+    "javascript",
+    "typescript",
+    "python",
+    "php",
+)
+
+# Number of bytes read from the start of each file by the exclusion heuristics
+HEURISTIC_PREFIX_BYTES = 8192
+
+# Files larger than this are left out of the source view. 0 to keep all files
+MAX_SOURCE_FILE_BYTES = get_int_attr(
+    "CPGGEN_MAX_FILE_BYTES", os.environ, None, 2 * 1024 * 1024
+)
+
+# Minified and bundled files have very long lines
+MAX_AVERAGE_LINE_LENGTH = 300
+
+# Source code is usually below 5.5 bits per byte while embedded data, base64
+# blobs and compressed content are closer to 8
+MAX_ENTROPY_BITS = 6.5
+
+# Size of the chunks read while hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Identical files and subtrees smaller than this are kept since small files
+# such as __init__.py are commonly identical but still define distinct modules
+DEDUPE_MIN_BYTES = get_int_attr("CPGGEN_DEDUPE_MIN_BYTES", os.environ, None, 16384)
+
+# Banners written by code generators on a comment line in the header of the
+# files they produce. Prose such as "do not edit this section" is not a banner
+generated_markers = (
+    rb"@generated\b",
+    rb"Code generated .* DO NOT EDIT\.",
+    rb"Generated by the protocol buffer compiler\.  DO NOT EDIT!",
+    rb"Generated by the gRPC .*DO NOT EDIT!",
+    rb"Autogenerated by Thrift Compiler",
+    rb"<auto-generated>",
+)
+generated_banner = re.compile(
+    rb"^[ \t]*(?:#|//|/\*|\*|--|;|<!--)?[ \t]*("
+    + rb"|".join(generated_markers)
+    + rb")",
+    re.MULTILINE,
+)
+
+# Exclusion reasons and digests of the files checked by this process keyed by
+# path. Entries are dropped when the size or mtime of the file changes
+file_cache = {}
+
+FILE_CACHE_VERSION = 1
+
+
+def use_source_view(tool_lang):
+    """
+    Method to check if the frontend for the language should use a source view.
+    Set CPGGEN_SOURCE_VIEW to true to build the views.
+    :param tool_lang: Language or cpg_tools_map key
+    :return: True if a source view should be built
+    """
+    if os.getenv("CPGGEN_SOURCE_VIEW") not in ("true", "1"):
+        return False
+    return tool_lang in source_view_languages
+
+
+def get_view_files(src, inventory=None):
+    """
+    Method to return the files that belong in the source view. These are the
+    files of the inventory that are not ignored. Directories are only left out
+    when their name is ignored, so the files of directories such as reporting
+    that detection skips by prefix are included.
+    :param src: Source directory
+    :param inventory: Optional inventory of src
+    :return: List of files with full path
+    """
+    if inventory is None:
+        inventory = get_inventory(src)
+    ignored = inventory["ignored"]
+    return [
+        f for i, f in enumerate(inventory["files"]) if i not in ignored
+    ] + inventory.get("skipped", [])
+
+
+def get_entropy(data):
+    """
+    Method to compute the shannon entropy of some bytes
+    :param data: Bytes
+    :return: Entropy in bits per byte
+    """
+    if not data:
+        return 0
+    total = len(data)
+    return -sum(
+        count / total * math.log2(count / total) for count in Counter(data).values()
+    )
+
+
+def get_exclusion_reason(path, size=None):
+    """
+    Method to check if a file looks generated, minified or is too large for the
+    frontends using its size and a bounded read of its first bytes
+    :param path: File path
+    :param size: Optional size of the file
+    :return: Tuple of the reason and the detail or None if the file should be kept
+    """
+    try:
+        if size is None:
+            size = os.stat(path).st_size
+        if MAX_SOURCE_FILE_BYTES and size > MAX_SOURCE_FILE_BYTES:
+            return "oversized", f"{size} bytes"
+        with open(path, "rb") as fp:
+            prefix = fp.read(HEURISTIC_PREFIX_BYTES)
+    except OSError:
+        return None
+    banner = generated_banner.search(prefix[:2048])
+    if banner:
+        return "generated", banner.group(1).decode(errors="replace")
+    # Short files do not carry enough signal for the statistics
+    if len(prefix) < 1024:
+        return None
+    average_line_length = len(prefix) // (prefix.count(b"\n") + 1)
+    if average_line_length > MAX_AVERAGE_LINE_LENGTH:
+        return "minified", f"average line length {average_line_length}"
+    entropy = get_entropy(prefix)
+    if entropy > MAX_ENTROPY_BITS:
+        return "high entropy", f"{entropy:.1f} bits per byte"
+    return None
+
+
+def get_file_stamp(path):
+    """
+    Method to return the size and modification time of a file
+    :param path: File path
+    :return: List of the size and mtime or None if the file is missing
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_file_cache(cache_dir):
+    """
+    Method to load the file checks saved by an earlier job
+    :param cache_dir: Cache directory
+    :return: Dict of file path to the stamp and the results
+    """
+    try:
+        with open(os.path.join(cache_dir, "files.json"), encoding="utf-8") as fp:
+            cache_data = json.load(fp)
+        if cache_data.get("version") == FILE_CACHE_VERSION:
+            return cache_data.get("files", {})
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {}
+
+
+def merge_file_cache(entries, new_entries):
+    """
+    Method to add file checks to the file cache. Results of the same version of
+    a file are combined and other versions are replaced.
+    :param entries: Dict of file path to the stamp and the results to update
+    :param new_entries: Dict of file path to the stamp and the results
+    """
+    for f, entry in new_entries.items():
+        current = entries.get(f)
+        if current and current.get("stamp") == entry.get("stamp"):
+            entries[f] = {**current, **entry}
+        else:
+            entries[f] = entry
+
+
+def save_file_cache(cache_dir, entries):
+    """
+    Method to persist the file checks atomically
+    :param cache_dir: Cache directory
+    :param entries: Dict of file path to the stamp and the results
+    """
+    # Keep the results saved by the other jobs in the meantime
+    cached_entries = load_file_cache(cache_dir)
+    merge_file_cache(cached_entries, entries)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=cache_dir, suffix=".tmp", encoding="utf-8", delete=False
+        ) as fp:
+            json.dump({"version": FILE_CACHE_VERSION, "files": cached_entries}, fp)
+        os.replace(fp.name, os.path.join(cache_dir, "files.json"))
+    except OSError as e:
+        LOG.debug("Unable to save the file cache in %s: %s", cache_dir, e)
+
+
+def check_files(files, field, check, cache_dir=None):
+    """
+    Method to run a per file check once per version of each file. Results are
+    reused until the size or mtime of a file changes and are shared with the
+    other jobs of the tree through the cache directory.
+    :param files: List of file paths
+    :param field: Name of the result in the file cache
+    :param check: Function returning the results for a list of file paths
+    :param cache_dir: Optional cache directory
+    :return: List of results. Missing files have a result of None
+    """
+    if len(files) > 1 and get_walk_workers() > 1:
+        with ThreadPoolExecutor(max_workers=get_walk_workers()) as pool:
+            stamps = list(pool.map(get_file_stamp, files, chunksize=64))
+    else:
+        stamps = [get_file_stamp(f) for f in files]
+
+    def get_pending():
+        pending = []
+        for f, stamp in zip(files, stamps):
+            entry = file_cache.get(f)
+            if stamp and (not entry or entry["stamp"] != stamp or field not in entry):
+                pending.append((f, stamp))
+        return pending
+
+    pending = get_pending()
+    # Pick up the files checked by the other jobs
+    if pending and cache_dir:
+        current = dict(zip(files, stamps))
+        merge_file_cache(
+            file_cache,
+            {
+                f: entry
+                for f, entry in load_file_cache(cache_dir).items()
+                if f in current and entry.get("stamp") == current[f]
+            },
+        )
+        pending = get_pending()
+    if pending:
+        results = check([f for f, _ in pending])
+        for (f, stamp), result in zip(pending, results):
+            entry = file_cache.get(f)
+            if not entry or entry["stamp"] != stamp:
+                entry = file_cache[f] = {"stamp": stamp}
+            entry[field] = result
+        if cache_dir:
+            save_file_cache(
+                cache_dir,
+                {f: file_cache[f] for f, stamp in zip(files, stamps) if stamp},
+            )
+    return [file_cache[f][field] if stamp else None for f, stamp in zip(files, stamps)]
+
+
+def find_excluded_files(files, inventory=None, cache_dir=None):
+    """
+    Method to find the files that should be left out of the source view.
+    Files are only read again when their size or mtime changed so the jobs of a
+    tree share the results. Set CPGGEN_EXCLUDE_GENERATED to false to keep
+    every file.
+    :param files: List of file paths
+    :param inventory: Optional inventory used to cache the file sizes
+    :param cache_dir: Optional cache directory used to share the results with
+        the other jobs
+    :return: Dict of file path to the reason and the detail
+    """
+    if os.getenv("CPGGEN_EXCLUDE_GENERATED") in ("false", "0") or not files:
+        return {}
+
+    def check(paths):
+        sizes = get_file_sizes(paths, inventory)
+        if len(paths) > 1 and get_walk_workers() > 1:
+            with ThreadPoolExecutor(max_workers=get_walk_workers()) as pool:
+                return list(pool.map(get_exclusion_reason, paths, sizes, chunksize=32))
+        return [get_exclusion_reason(f, size) for f, size in zip(paths, sizes)]
+
+    reasons = check_files(files, "reason", check, cache_dir)
+    return {f: tuple(reason) for f, reason in zip(files, reasons) if reason}
+
+
+def hash_file(path):
+    """
+    Method to compute the digest of the contents of a file
+    :param path: File path
+    :return: Hex digest or None if the file could not be read
+    """
+    h = hashlib.sha1()
+    try:
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def is_under(path, dirs):
+    """
+    Method to check if a relative path is inside one of the given directories
+    :param path: Relative path
+    :param dirs: Set of relative directory paths
+    :return: True if one of the parents of path is in dirs
+    """
+    parent = os.path.dirname(path)
+    while parent:
+        if parent in dirs:
+            return True
+        parent = os.path.dirname(parent)
+    return False
+
+
+def dedupe_files(src, files, inventory=None, min_bytes=None, cache_dir=None):
+    """
+    Method to keep a single representative of large identical subtrees and
+    files. Only files sharing their size with another file are hashed and the
+    digests are reused by the other jobs of the tree.
+    Set CPGGEN_DEDUPE to true to enable.
+    :param src: Source directory
+    :param files: List of files with full path
+    :param inventory: Optional inventory used to cache the file sizes
+    :param min_bytes: Minimum size of identical files and subtrees that are
+        deduplicated
+    :param cache_dir: Optional cache directory used to share the digests with
+        the other jobs
+    :return: Tuple of the kept files and a dict of each alias to its
+        representative. Both are relative to src
+    """
+    if os.getenv("CPGGEN_DEDUPE") not in ("true", "1") or len(files) < 2:
+        return files, {}
+    if min_bytes is None:
+        min_bytes = DEDUPE_MIN_BYTES
+    sizes = dict(zip(files, get_file_sizes(files, inventory)))
+    size_counts = Counter(sizes.values())
+    candidates = [f for f in files if size_counts[sizes[f]] > 1]
+
+    def check(paths):
+        if len(paths) > 1 and get_walk_workers() > 1:
+            with ThreadPoolExecutor(max_workers=get_walk_workers()) as pool:
+                return list(pool.map(hash_file, paths))
+        return [hash_file(f) for f in paths]
+
+    hashes = dict(zip(candidates, check_files(candidates, "digest", check, cache_dir)))
+    rel_paths = {f: os.path.relpath(f, src) for f in files}
+    # Merkle digest of each directory whose files could all be hashed
+    entries = {}
+    file_counts = Counter()
+    dir_sizes = Counter()
+    for f in files:
+        rel_dir = os.path.dirname(rel_paths[f])
+        entries.setdefault(rel_dir, []).append((os.path.basename(f), hashes.get(f)))
+        while rel_dir:
+            file_counts[rel_dir] += 1
+            dir_sizes[rel_dir] += sizes[f]
+            rel_dir = os.path.dirname(rel_dir)
+            entries.setdefault(rel_dir, [])
+    dir_digests = {}
+    for rel_dir in sorted(entries, key=lambda d: d.count(os.sep), reverse=True):
+        if not rel_dir:
+            continue
+        digest = None
+        if all(d for _, d in entries[rel_dir]):
+            digest = hashlib.sha1(
+                json.dumps(sorted(entries[rel_dir])).encode("utf-8")
+            ).hexdigest()
+            if file_counts[rel_dir] > 1 and dir_sizes[rel_dir] >= min_bytes:
+                dir_digests.setdefault(digest, []).append(rel_dir)
+        entries[os.path.dirname(rel_dir)].append(
+            (os.path.basename(rel_dir) + os.sep, digest)
+        )
+    aliases = {}
+    aliased_dirs = set()
+    for rel_dirs in sorted(
+        dir_digests.values(), key=lambda g: min(d.count(os.sep) for d in g)
+    ):
+        rel_dirs = sorted(d for d in rel_dirs if not is_under(d, aliased_dirs))
+        for rel_dir in rel_dirs[1:]:
+            aliases[rel_dir] = rel_dirs[0]
+            aliased_dirs.add(rel_dir)
+    files = [f for f in files if not is_under(rel_paths[f], aliased_dirs)]
+    # The first path in sorted order represents the identical files
+    representatives = {}
+    for f in files:
+        digest = hashes.get(f)
+        if digest and sizes[f] >= min_bytes:
+            representatives[digest] = min(
+                representatives.get(digest, rel_paths[f]), rel_paths[f]
+            )
+    kept = []
+    for f in files:
+        representative = representatives.get(hashes.get(f))
+        if representative and representative != rel_paths[f]:
+            aliases[rel_paths[f]] = representative
+            continue
+        kept.append(f)
+    return kept, aliases
+
+
+def reflink_file(src_file, dest_file):
+    """
+    Method to create a copy-on-write clone of a file. This is only supported on
+    Linux file systems such as btrfs and xfs.
+    :param src_file: Original file
+    :param dest_file: Path of the clone
+    """
+    if not fcntl:
+        raise OSError("Reflinks are not supported on this platform")
+    try:
+        with open(src_file, "rb") as sfp, open(dest_file, "wb") as dfp:
+            fcntl.ioctl(dfp.fileno(), FICLONE, sfp.fileno())
+    except OSError:
+        if os.path.exists(dest_file):
+            os.remove(dest_file)
+        raise
+    shutil.copystat(src_file, dest_file)
+
+
+def link_file(src_file, dest_file, method):
+    """
+    Method to place a file in the view using the given method
+    :param src_file: Original file
+    :param dest_file: Path of the file in the view
+    :param method: One of reflink, hardlink, symlink or copy
+    """
+    if method == "reflink":
+        reflink_file(src_file, dest_file)
+    elif method == "hardlink":
+        os.link(src_file, dest_file)
+    elif method == "symlink":
+        os.symlink(src_file, dest_file)
+    else:
+        shutil.copy2(src_file, dest_file)
+
+
+def link_files(files, dest_files, methods):
+    """
+    Method to place many files in a scratch directory in parallel. Each file is
+    placed with the first method that works for it so that trees spanning
+    several devices are placed completely.
+    :param files: List of original files
+    :param dest_files: List of destination paths
+    :param methods: Methods to try in order
+    :return: Tuple of the method used for most files, the number of files placed
+        and a dict of the files that could not be placed with the error
+    """
+    for dest_dir in sorted({os.path.dirname(f) for f in dest_files}):
+        os.makedirs(dest_dir, exist_ok=True)
+
+    def link(pair):
+        error = None
+        for method in methods:
+            try:
+                link_file(pair[0], pair[1], method)
+                return method, None
+            except OSError as e:
+                error = e
+        LOG.debug("Unable to place %s in %s: %s", pair[0], pair[1], error)
+        return None, str(error)
+
+    pairs = list(zip(files, dest_files))
+    if len(pairs) > 1 and get_walk_workers() > 1:
+        with ThreadPoolExecutor(max_workers=get_walk_workers()) as pool:
+            results = list(pool.map(link, pairs, chunksize=64))
+    else:
+        results = [link(p) for p in pairs]
+    used = Counter(method for method, _ in results if method)
+    failed = {f: error for f, (method, error) in zip(files, results) if not method}
+    if not used:
+        return None, 0, failed
+    return used.most_common(1)[0][0], sum(used.values()), failed
+
+
+def build_source_view(src, files=None, view_dir=None, inventory=None, cache_dir=None):
+    """
+    Method to build a pruned view of the source containing only the analyzable
+    and non-ignored files. Files are hardlinked into a scratch directory and
+    symlinks or copies are used for the files that cannot be hardlinked.
+    Generated, minified and oversized files are excluded and only a single copy
+    of large identical subtrees and files is kept when deduplication is enabled.
+    :param src: Source directory
+    :param files: Optional list of files to include. Defaults to the inventory
+    :param view_dir: Optional scratch directory. Defaults to CPGGEN_VIEW_DIR or
+        the temp directory
+    :param inventory: Optional inventory of src
+    :param cache_dir: Optional cache directory shared by the jobs of the tree
+    :return: Dict with the view path, the original src, the number of files, the
+        link method, the excluded files and the aliases of the deduplicated files
+        or None if the view could not be built
+    """
+    src = os.path.abspath(src)
+    if not os.path.isdir(src):
+        return None
+    if inventory is None:
+        inventory = get_inventory(src)
+    if files is None:
+        files = get_view_files(src, inventory)
+    excluded = find_excluded_files(files, inventory, cache_dir)
+    if excluded:
+        files = [f for f in files if f not in excluded]
+    files, aliases = dedupe_files(src, files, inventory, cache_dir=cache_dir)
+    if not files:
+        return None
+    scratch_dir = tempfile.mkdtemp(
+        prefix="cpggen_view_", dir=view_dir or os.getenv("CPGGEN_VIEW_DIR")
+    )
+    # Keep the name of the source directory since frontends use it as the app name
+    view = os.path.join(scratch_dir, os.path.basename(src))
+    dest_files = [os.path.join(view, os.path.relpath(f, src)) for f in files]
+    method, linked, failed = link_files(
+        files, dest_files, ("hardlink", "symlink", "copy")
+    )
+    if not method:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        return None
+    # Files that could not be placed are reported like the excluded files
+    if failed:
+        LOG.warning(
+            "%d files of %s could not be placed in the source view and are left out of the cpg",
+            len(failed),
+            src,
+        )
+        excluded = {**excluded, **{f: ("unlinkable", e) for f, e in failed.items()}}
+    LOG.debug(
+        "Source view for %s with %d files created at %s using %s. %d files excluded and %d duplicates skipped",
+        src,
+        linked,
+        view,
+        method,
+        len(excluded),
+        len(aliases),
+    )
+    return {
+        "view": view,
+        "src": src,
+        "files": linked,
+        "method": method,
+        "exclusions": [
+            {"file": os.path.relpath(f, src), "reason": reason, "detail": detail}
+            for f, (reason, detail) in sorted(excluded.items())
+        ],
+        "aliases": aliases,
+    }
+
+
+def check_view_files(src, cache_dir):
+    """
+    Method to check the files of a tree once before the jobs build their source
+    views so that the jobs reuse the results from the cache directory
+    :param src: Source directory
+    :param cache_dir: Cache directory
+    """
+    inventory = get_inventory(src)
+    files = get_view_files(src, inventory)
+    excluded = find_excluded_files(files, inventory, cache_dir)
+    dedupe_files(
+        src,
+        [f for f in files if f not in excluded],
+        inventory,
+        cache_dir=cache_dir,
+    )
+
+
+def build_job_view(tool_lang, src, extra_args, report_file=None):
+    """
+    Method to build the source view that a frontend job is pointed at. Shards
+    are limited to their files while export, slice and vectors jobs read a cpg.
+    :param tool_lang: Language or cpg_tools_map key
+    :param src: Source directory of the job
+    :param extra_args: Job extra_args with the shard files and the cache directory
+    :param report_file: Optional path of the exclusion report
+    :return: Tuple of the source view and the exclusion report. Each is None
+        when not used
+    """
+    cache_dir = extra_args.get("inventory_cache_dir")
+    source_view = None
+    if extra_args.get("shard_files"):
+        source_view = build_source_view(
+            src, files=extra_args["shard_files"], cache_dir=cache_dir
+        )
+    elif tool_lang not in ("export", "slice", "vectors") and use_source_view(tool_lang):
+        source_view = build_source_view(src, cache_dir=cache_dir)
+    exclusion_report = None
+    if source_view and report_file:
+        exclusion_report = write_exclusion_report(source_view, report_file)
+    return source_view, exclusion_report
+
+
+def get_view_manifest(src, source_view=None, snapshot=None, exclusion_report=None):
+    """
+    Method to describe how the paths of a cpg map back to the original source
+    :param src: Source directory the frontend was run on
+    :param source_view: Optional source view from build_source_view
+    :param snapshot: Optional snapshot from build_snapshot
+    :param exclusion_report: Optional path of the exclusion report
+    :return: Dict of the manifest fields
+    """
+    fields = {}
+    # Paths in the cpg are relative to the view
+    if source_view:
+        fields["source_view"] = {
+            k: v for k, v in source_view.items() if k != "exclusions"
+        }
+    # Paths in the snapshot map back to the original source
+    if snapshot:
+        fields["src"] = map_view_path(src, snapshot)
+        fields["snapshot"] = snapshot
+        if source_view:
+            fields["source_view"]["src"] = map_view_path(source_view["src"], snapshot)
+    if exclusion_report:
+        fields["exclusion_report"] = exclusion_report
+    return fields
+
+
+def write_exclusion_report(source_view, report_file):
+    """
+    Method to save the files that were left out of a source view
+    :param source_view: Source view from build_source_view
+    :param report_file: Path of the json report
+    :return: Path of the report or None if no file was excluded
+    """
+    if not source_view or not source_view.get("exclusions"):
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(report_file)), exist_ok=True)
+    with open(report_file, mode="w", encoding="utf-8") as fp:
+        json.dump(source_view["exclusions"], fp)
+    return report_file
+
+
+def build_snapshot(src, snapshot_dir=None):
+    """
+    Method to build a private copy of the source tree so that builds running at
+    the same time do not overwrite each other's outputs. Files are cloned with
+    reflinks where the file system supports copy-on-write and hardlinked or
+    copied otherwise. The .git directory is shared using a symlink.
+    :param src: Source directory
+    :param snapshot_dir: Optional scratch directory. Defaults to CPGGEN_VIEW_DIR
+        or the temp directory
+    :return: Dict with the snapshot path, the original src, the number of files
+        and the link method or None if the snapshot could not be built
+    """
+    src = os.path.abspath(src)
+    if not os.path.isdir(src):
+        return None
+    scratch_dir = tempfile.mkdtemp(
+        prefix="cpggen_snapshot_", dir=snapshot_dir or os.getenv("CPGGEN_VIEW_DIR")
+    )
+    snapshot = os.path.join(scratch_dir, os.path.basename(src))
+    os.makedirs(snapshot)
+    files = []
+    for root, dirs, filenames in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        dest_root = os.path.normpath(os.path.join(snapshot, rel_root))
+        for d in list(dirs):
+            src_dir = os.path.join(root, d)
+            if d == ".git" or os.path.islink(src_dir):
+                os.makedirs(dest_root, exist_ok=True)
+                os.symlink(
+                    os.readlink(src_dir) if os.path.islink(src_dir) else src_dir,
+                    os.path.join(dest_root, d),
+                )
+                dirs.remove(d)
+        for f in filenames:
+            src_file = os.path.join(root, f)
+            if os.path.islink(src_file):
+                os.makedirs(dest_root, exist_ok=True)
+                os.symlink(os.readlink(src_file), os.path.join(dest_root, f))
+            else:
+                files.append(src_file)
+        if not filenames:
+            os.makedirs(dest_root, exist_ok=True)
+    method, linked = None, 0
+    if files:
+        method, linked, failed = link_files(
+            files,
+            [os.path.join(snapshot, os.path.relpath(f, src)) for f in files],
+            ("reflink", "hardlink", "copy"),
+        )
+        if not method:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            return None
+        if failed:
+            LOG.warning(
+                "%d files of %s could not be placed in the snapshot. Example: %s",
+                len(failed),
+                src,
+                next(iter(failed)),
+            )
+    LOG.debug(
+        "Snapshot of %s with %d files created at %s using %s",
+        src,
+        linked,
+        snapshot,
+        method,
+    )
+    return {"view": snapshot, "src": src, "files": linked, "method": method}
+
+
+def remove_source_view(source_view):
+    """
+    Method to remove a source view or a snapshot. The original files are never
+    touched.
+    :param source_view: Source view from build_source_view or build_snapshot
+    """
+    if source_view and source_view.get("view"):
+        shutil.rmtree(os.path.dirname(source_view["view"]), ignore_errors=True)
+
+
+def map_view_path(path, source_view):
+    """
+    Method to map a path in the source view back to the original source
+    :param path: Path reported by a frontend
+    :param source_view: Source view from build_source_view or the manifest
+    :return: Path in the original source
+    """
+    if not source_view or not path:
+        return path
+    view = source_view["view"]
+    if path == view or path.startswith(view + os.sep):
+        return source_view["src"] + path[len(view) :]
+    return path
+
+
+def rewrite_view_paths(path, source_view):
+    """
+    Method to rewrite the paths of a source view in a text output such as a
+    slice file to the original source so that it stays valid once the view
+    is removed
+    :param path: File written by a frontend
+    :param source_view: Source view from build_source_view or the manifest
+    :return: True if the file was rewritten
+    """
+    if not source_view or not path or not os.path.isfile(path):
+        return False
+    view = source_view["view"]
+    try:
+        with open(path, encoding="utf-8") as fp:
+            content = fp.read()
+    except (OSError, UnicodeDecodeError):
+        return False
+    # Backslashes are escaped in json on windows
+    replacements = {view: source_view["src"]}
+    if "\\" in view:
+        replacements[view.replace("\\", "\\\\")] = source_view["src"].replace(
+            "\\", "\\\\"
+        )
+    if not any(old in content for old in replacements):
+        return False
+    for old, new in replacements.items():
+        content = content.replace(old, new)
+    with open(f"{path}.tmp", mode="w", encoding="utf-8") as fp:
+        fp.write(content)
+    os.replace(f"{path}.tmp", path)
+    return True
+
+
+def expand_aliases(rel_path, aliases):
+    """
+    Method to list every copy of a file that was deduplicated in a source view
+    :param rel_path: Path relative to the source of a file in the view
+    :param aliases: Aliases recorded in the source view of the manifest
+    :return: List of the relative paths of the file and all its copies
+    """
+    paths = [rel_path]
+    for alias, representative in aliases.items():
+        if rel_path == representative:
+            paths.append(alias)
+        elif rel_path.startswith(representative + os.sep):
+            paths.append(alias + rel_path[len(representative) :])
+    return paths
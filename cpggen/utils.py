@@ -1,12 +1,17 @@
+import hashlib
 import json
 import os
 import re
 import shutil
+import stat
+import subprocess
 import tarfile
 import tempfile
+import time
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from sys import platform
 
 import httpx
 import rich.progress
@@ -14,6 +19,8 @@ from packageurl import PackageURL
 from packageurl.contrib import purl2url
 from rich.progress import Progress
 
+from cpggen import download
+from cpggen.logger import LOG
 from cpggen.source import ghsa
 
 GIT_AVAILABLE = False
@@ -27,6 +34,32 @@ except ImportError:
 MAVEN_CENTRAL_URL = "https://repo1.maven.org/maven2/"
 ANDROID_MAVEN = "https://maven.google.com/"
 
+# Extract tar and zip downloads while they arrive instead of saving them first
+STREAM_DOWNLOADS = os.getenv("CPGGEN_STREAM_DOWNLOADS") not in ("false", "0")
+
+# Downloads with these extensions are extracted unless expand_archive is off
+download_archive_extensions = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# Zip downloads up to this size are spooled in memory before the extraction
+ZIP_SPOOL_BYTES = int(os.getenv("CPGGEN_ZIP_SPOOL_BYTES", str(64 * 1024 * 1024)))
+
+# Size of the reads from a download stream
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Verify downloads against the checksums published by maven central and pypi
+VERIFY_DOWNLOADS = os.getenv("CPGGEN_VERIFY_DOWNLOADS") not in ("false", "0")
+
+PYPI_SOURCE_URL = "https://pypi.io/packages/source/"
+
+# Directory of the bare mirrors of the cloned git repos
+GIT_CACHE_DIR = os.getenv(
+    "CPGGEN_GIT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "cpggen", "git"),
+)
+
+# Least recently used mirrors are evicted once the git cache grows past this size
+GIT_CACHE_BYTES = int(os.getenv("CPGGEN_GIT_CACHE_BYTES", str(5 * 1024 * 1024 * 1024)))
+
 # Default ignore list
 ignore_directories = [
     ".git",
@@ -105,6 +138,76 @@ ignore_files = [
     ".nib",
 ]
 
+# Inventories built by this process keyed by the absolute source directory
+inventory_cache = {}
+
+# Bump this whenever the format of the on-disk inventory cache changes
+INVENTORY_CACHE_VERSION = 1
+
+# Directories modified within this window are listed again on the next run
+# since their mtime could still change within the same timestamp tick
+INVENTORY_RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+# Compiled form of the default ignore lists
+compiled_ignore_rules = {}
+
+# Compiled .gitignore and .cpggenignore patterns keyed by source directory
+ignore_patterns_cache = {}
+
+# Bytes that can appear in text files
+TEXT_CHARS = bytearray({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7F})
+
+# Magic numbers of thin Mach-O binaries in both byte orders
+MACHO_MAGIC_NUMBERS = (
+    b"\xfe\xed\xfa\xce",
+    b"\xfe\xed\xfa\xcf",
+    b"\xce\xfa\xed\xfe",
+    b"\xcf\xfa\xed\xfe",
+)
+
+# Binary kinds that can be decompiled with ghidra
+executable_binary_kinds = ("elf", "pe", "macho")
+
+# Binary kind of files keyed by path along with the inode, mtime and size
+binary_kind_cache = {}
+
+# Zip based archives that can be inspected without extraction
+archive_extensions = (".jar", ".war", ".ear", ".apk", ".aar", ".zip", ".whl")
+
+# Summary of archives keyed by path along with the inode, mtime and size
+archive_summary_cache = {}
+
+# File extensions used to compute the statistics of each project type
+project_type_extensions = {
+    "python": (".py",),
+    "php": (".php",),
+    "scala": (".scala", ".sbt"),
+    "kotlin": (".kt", ".kts"),
+    "java": (".java",),
+    "js": (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx"),
+    "c": (".c", ".cc", ".cpp", ".cxx", ".h", ".hh", ".hpp"),
+    "llvm": (".bc", ".ll"),
+    "jimple": (".jar", ".war", ".ear", ".apk", ".zip", ".dex", ".class", ".jimple"),
+    "go": (".go",),
+    "csharp": (".cs",),
+}
+
+
+def compile_ignore_rules():
+    """
+    Method to compile the default ignore lists into sets and a prefix pattern.
+    The rules are compiled once per run and reused for every lookup.
+    :return: Dict with the compiled ignore rules
+    """
+    if not compiled_ignore_rules:
+        dirs = frozenset(d.lower() for d in ignore_directories)
+        compiled_ignore_rules["dirs"] = dirs
+        compiled_ignore_rules["files"] = frozenset(f.lower() for f in ignore_files)
+        compiled_ignore_rules["dir_prefix"] = re.compile(
+            "|".join(re.escape(d) for d in sorted(dirs, key=len, reverse=True))
+        )
+    return compiled_ignore_rules
+
 
 def is_ignored_file(file_name):
     """
@@ -114,13 +217,15 @@ def is_ignored_file(file_name):
     """
     if not file_name:
         return False
+    ignored_suffixes = compile_ignore_rules()["files"]
     file_name = file_name.lower()
-    extn = "".join(Path(file_name).suffixes)
-    if extn in ignore_files or file_name in ignore_files:
-        return True
-    for ie in ignore_files:
-        if file_name.endswith(ie):
+    # Every ignore entry starts with a dot, so only the tails starting at a dot
+    # need to be looked up
+    pos = file_name.find(".")
+    while pos != -1:
+        if file_name[pos:] in ignored_suffixes:
             return True
+        pos = file_name.find(".", pos + 1)
     return False
 
 
@@ -130,10 +235,9 @@ def filter_ignored_dirs(dirs):
     :param dirs: Directories to ignore
     :return: Filtered directory list
     """
-    [
-        dirs.remove(d)
-        for d in list(dirs)
-        if d.lower() in ignore_directories or d.startswith(".")
+    ignored_dirs = compile_ignore_rules()["dirs"]
+    dirs[:] = [
+        d for d in dirs if not d.startswith(".") and d.lower() not in ignored_dirs
     ]
     return dirs
 
@@ -145,37 +249,154 @@ def is_ignored_dir(base_dir, dir_name):
     :param dir_name: Directory to compare
     :return: Boolean True if directory can be ignored. False otherwise
     """
-    base_dir = base_dir.lower()
+    rules = compile_ignore_rules()
+    base_dir = base_dir.lower().rstrip(os.path.sep)
     dir_name = dir_name.lower()
-    if platform != "win32":
-        if dir_name.startswith("."):
-            return True
-        elif dir_name.startswith(os.path.sep + base_dir):
-            dir_name = re.sub(r"^" + os.path.sep + base_dir + os.path.sep, "", dir_name)
-        elif dir_name.startswith(base_dir):
-            dir_name = re.sub(r"^" + base_dir + os.path.sep, "", dir_name)
-    for d in ignore_directories:
-        if (
-            dir_name == d
-            or dir_name.startswith(d)
-            or (os.path.sep + d + os.path.sep) in dir_name
-        ):
-            return True
-    return False
+    for prefix in (os.path.sep + base_dir, base_dir):
+        if dir_name == prefix:
+            return False
+        if dir_name.startswith(prefix + os.path.sep):
+            dir_name = dir_name[len(prefix) + 1 :]
+            break
+    if dir_name.startswith(".") or rules["dir_prefix"].match(dir_name):
+        return True
+    return any(part in rules["dirs"] for part in dir_name.split(os.path.sep)[1:-1])
 
 
-def find_files(src, src_ext_name, use_start=False, quick=False):
+def translate_ignore_pattern(pattern):
+    """
+    Method to convert a single gitignore style pattern into a regex
+    :param pattern: Line from a .gitignore or .cpggenignore file
+    :return: Tuple of compiled regex, negation flag and directory only flag or None
+    """
+    pattern = pattern.rstrip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\"):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[" and "]" in pattern[i + 1 :]:
+            end = pattern.index("]", i + 1)
+            char_class = pattern[i + 1 : end]
+            if char_class.startswith("!"):
+                char_class = "^" + char_class[1:]
+            regex += f"[{char_class}]"
+            i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+    regex = ("^" if anchored else "^(?:.*/)?") + regex + "$"
+    try:
+        return re.compile(regex), negate, dir_only
+    except re.error:
+        return None
+
+
+def get_ignore_patterns(src, use_gitignore=None):
+    """
+    Method to compile the ignore patterns of a source directory. Patterns from
+    .cpggenignore are always used while the patterns from .gitignore are merged
+    when use_gitignore or the environment variable CPGGEN_USE_GITIGNORE is set.
+    :param src: Source directory
+    :param use_gitignore: Boolean to merge the patterns from .gitignore
+    :return: List of compiled patterns
+    """
+    if not src or not os.path.isdir(src):
+        return []
+    if use_gitignore is None:
+        use_gitignore = os.getenv("CPGGEN_USE_GITIGNORE") in ("true", "1")
+    ignore_files_list = (
+        [".gitignore", ".cpggenignore"] if use_gitignore else [".cpggenignore"]
+    )
+    key = [os.path.abspath(src)]
+    for name in ignore_files_list:
+        try:
+            key.append(os.stat(os.path.join(src, name)).st_mtime_ns)
+        except OSError:
+            key.append(None)
+    key = tuple(key)
+    if key not in ignore_patterns_cache:
+        patterns = []
+        for name in ignore_files_list:
+            try:
+                with open(os.path.join(src, name), encoding="utf-8") as fp:
+                    for line in fp:
+                        compiled = translate_ignore_pattern(line)
+                        if compiled:
+                            patterns.append(compiled)
+            except (OSError, UnicodeDecodeError):
+                continue
+        ignore_patterns_cache[key] = patterns
+    return ignore_patterns_cache[key]
+
+
+def is_ignored_path(patterns, rel_path, is_dir=False, check_parents=False):
+    """
+    Method to check a relative path against the compiled ignore patterns.
+    The last matching pattern wins as with git.
+    :param patterns: List of compiled patterns
+    :param rel_path: Path relative to the source directory using / as separator
+    :param is_dir: Boolean to indicate that the path is a directory
+    :param check_parents: Boolean to also check the parent directories
+    :return: Boolean True if the path can be ignored. False otherwise
+    """
+    if not patterns:
+        return False
+    if check_parents:
+        parts = rel_path.split("/")
+        for i in range(1, len(parts)):
+            if is_ignored_path(patterns, "/".join(parts[:i]), True):
+                return True
+    ignored = False
+    for regex, negate, dir_only in patterns:
+        if dir_only and not is_dir:
+            continue
+        if regex.match(rel_path):
+            ignored = not negate
+    return ignored
+
+
+def find_files(src, src_ext_name, use_start=False, quick=False, inventory=None):
     """
     Method to find files with given extension
     :param src: Source directory
     :param src_ext_name: Extension
     :param use_start: Boolean to check for file prefix
     :param quick: Quick search mode to return after a single hit
+    :param inventory: Optional inventory of src to search instead of walking the tree
     :return: List of files with full path
     """
+    # Reuse the inventory when a cache is configured unless the tree changed
+    if inventory is None and get_cache_dir(None):
+        inventory = get_inventory(src, validate=True)
+    if inventory is not None:
+        return search_inventory(inventory, src_ext_name, use_start, quick)
     result = []
-    for root, dirs, files in os.walk(src):
-        filter_ignored_dirs(dirs)
+    for root, dirs, files in walk_tree(src, patterns=get_ignore_patterns(src)):
         if not is_ignored_dir(src, root):
             for file in files:
                 if is_ignored_file(file):
@@ -189,6 +410,482 @@ def find_files(src, src_ext_name, use_start=False, quick=False):
     return result
 
 
+def get_file_extension(file_name):
+    """
+    Method to return the last suffix of a file name including the dot
+    :param file_name: File name
+    :return: Extension such as .py or an empty string
+    """
+    pos = file_name.rfind(".")
+    return file_name[pos:] if pos != -1 else ""
+
+
+def add_inventory_file(inventory, full_path, file_name):
+    """
+    Method to add a single file to the inventory indexes
+    :param inventory: Inventory dict
+    :param full_path: Absolute path of the file
+    :param file_name: Name of the file
+    """
+    idx = len(inventory["files"])
+    inventory["files"].append(full_path)
+    inventory["names"].setdefault(file_name, []).append(idx)
+    if is_ignored_file(file_name):
+        inventory["ignored"].add(idx)
+        return
+    inventory["extensions"].setdefault(get_file_extension(file_name), []).append(idx)
+
+
+def add_skipped_file(inventory, full_path, file_name):
+    """
+    Method to record a file of a directory that is_ignored_dir skips by prefix.
+    These files are not searched during detection but belong in source views.
+    :param inventory: Inventory dict
+    :param full_path: Absolute path of the file
+    :param file_name: Name of the file
+    """
+    if not is_ignored_file(file_name):
+        inventory["skipped"].append(full_path)
+
+
+def list_directory(path, listings=None, new_listings=None):
+    """
+    Method to list the sub-directories and files of a single directory.
+    Listings from a previous run are reused when the directory mtime and inode
+    are unchanged.
+    :param path: Directory to list
+    :param listings: Optional dict of cached listings keyed by path
+    :param new_listings: Optional dict to record the listings that were used
+    :return: Tuple of directory names and file names
+    """
+    st = None
+    # The directory stamp is only needed when the listings are cached
+    if listings is not None or new_listings is not None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return [], []
+        stamp = [st.st_mtime_ns, st.st_ino]
+        cached = listings.get(path) if listings is not None else None
+        if cached and cached.get("stamp") == stamp:
+            if new_listings is not None:
+                new_listings[path] = cached
+            return cached["dirs"], cached["files"]
+    dirs = []
+    files = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                # DirEntry carries the file type from readdir so no stat is needed
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif not entry.is_symlink() or not entry.is_dir():
+                        files.append(entry.name)
+                except OSError:
+                    continue
+    except OSError:
+        return [], []
+    if new_listings is not None and st is not None:
+        # Do not trust the stamp of directories that were modified just now
+        if time.time_ns() - st.st_mtime_ns < INVENTORY_RACY_WINDOW_NS:
+            stamp = None
+        new_listings[path] = {"stamp": stamp, "dirs": dirs, "files": files}
+    return dirs, files
+
+
+def get_walk_workers():
+    """
+    Method to determine the number of threads used to list directories.
+    Set CPGGEN_WALK_THREADS to 1 to walk the tree serially.
+    :return: Number of threads
+    """
+    try:
+        return max(1, int(os.getenv("CPGGEN_WALK_THREADS", "")))
+    except ValueError:
+        return min(32, (os.cpu_count() or 1) + 4)
+
+
+def walk_tree(src, listings=None, new_listings=None, patterns=None, max_workers=None):
+    """
+    Method to walk a directory tree like os.walk while skipping the ignored
+    directories. Directories are listed with os.scandir on a bounded thread pool
+    so that the latency of slow and network filesystems overlaps. Directories
+    are always yielded in breadth-first order irrespective of the thread count.
+    :param src: Source directory
+    :param listings: Optional dict of cached listings keyed by path
+    :param new_listings: Optional dict to record the listings that were used
+    :param patterns: Optional list of compiled ignore patterns for src
+    :param max_workers: Number of threads. Defaults to get_walk_workers()
+    :return: Generator of root, dirs and files tuples
+    """
+    if max_workers is None:
+        max_workers = get_walk_workers()
+
+    def filter_listing(rel_root, dirs, files):
+        dirs = filter_ignored_dirs(list(dirs))
+        if patterns:
+            dirs = [
+                d for d in dirs if not is_ignored_path(patterns, f"{rel_root}{d}", True)
+            ]
+            files = [
+                f for f in files if not is_ignored_path(patterns, f"{rel_root}{f}")
+            ]
+        return dirs, files
+
+    if max_workers <= 1:
+        pending = deque([(src, "")])
+        while pending:
+            root, rel_root = pending.popleft()
+            dirs, files = filter_listing(
+                rel_root, *list_directory(root, listings, new_listings)
+            )
+            yield root, dirs, files
+            pending += [(os.path.join(root, d), f"{rel_root}{d}/") for d in dirs]
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque(
+            [(src, "", pool.submit(list_directory, src, listings, new_listings))]
+        )
+        try:
+            while pending:
+                root, rel_root, future = pending.popleft()
+                dirs, files = filter_listing(rel_root, *future.result())
+                # Queue the children before yielding so that the threads stay busy
+                for d in dirs:
+                    child = os.path.join(root, d)
+                    pending.append(
+                        (
+                            child,
+                            f"{rel_root}{d}/",
+                            pool.submit(list_directory, child, listings, new_listings),
+                        )
+                    )
+                yield root, dirs, files
+        finally:
+            # The caller might stop early. Do not list the remaining directories
+            for _, _, future in pending:
+                future.cancel()
+
+
+def list_git_files(src):
+    """
+    Method to list the files tracked in the index of a git checkout.
+    Only the root of a checkout is supported since the paths of sub-directories
+    could be untracked.
+    :param src: Source directory
+    :return: List of paths relative to src using / as separator or None
+    """
+    if os.getenv("CPGGEN_USE_GIT_INDEX") in ("false", "0"):
+        return None
+    if not os.path.exists(os.path.join(src, ".git")) or not check_command("git"):
+        return None
+    try:
+        cp = subprocess.run(
+            ["git", "ls-files", "-z", "--cached", "--recurse-submodules"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=src,
+            check=False,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if cp.returncode:
+        return None
+    return [os.fsdecode(f) for f in cp.stdout.split(b"\0") if f]
+
+
+def build_git_inventory(src, inventory, git_files, patterns):
+    """
+    Method to fill the inventory from the files tracked by git while applying
+    the same ignore rules as the tree walk
+    :param src: Source directory
+    :param inventory: Inventory dict to fill
+    :param git_files: List of tracked paths relative to src
+    :param patterns: List of compiled ignore patterns for src
+    """
+    walked_dirs = {"": True}
+    listed_dirs = {}
+
+    def is_walked(rel_dir):
+        if rel_dir not in walked_dirs:
+            parent, _, name = rel_dir.rpartition("/")
+            walked_dirs[rel_dir] = (
+                is_walked(parent)
+                and bool(filter_ignored_dirs([name]))
+                and not is_ignored_path(patterns, rel_dir, True)
+            )
+        return walked_dirs[rel_dir]
+
+    for rel_path in git_files:
+        rel_dir, _, file = rel_path.rpartition("/")
+        if not is_walked(rel_dir):
+            continue
+        root = os.path.join(src, *rel_dir.split("/")) if rel_dir else src
+        if rel_dir not in listed_dirs:
+            listed_dirs[rel_dir] = not is_ignored_dir(src, root)
+        if is_ignored_path(patterns, rel_path):
+            continue
+        if not listed_dirs[rel_dir]:
+            add_skipped_file(inventory, os.path.abspath(os.path.join(root, file)), file)
+            continue
+        add_inventory_file(inventory, os.path.abspath(os.path.join(root, file)), file)
+
+
+def build_inventory(src, listings=None, new_listings=None):
+    """
+    Method to walk the source directory once and build an inventory of files.
+    Files in directories skipped by is_ignored_dir are only kept for the source
+    views while ignored files are recorded but only returned by searches that
+    ask for them. For git checkouts, the tracked files are read from the index
+    instead of walking the tree.
+    :param src: Source directory
+    :param listings: Optional dict of cached directory listings to reuse
+    :param new_listings: Optional dict to record the listings that were used
+    :return: Inventory dict with the files, names and extensions
+    """
+    inventory = {
+        "src": os.path.abspath(src),
+        "backend": "walk",
+        "files": [],
+        "names": {},
+        "extensions": {},
+        "ignored": set(),
+        "skipped": [],
+    }
+    patterns = get_ignore_patterns(src)
+    git_files = list_git_files(src)
+    if git_files:
+        inventory["backend"] = "git"
+        build_git_inventory(src, inventory, git_files, patterns)
+        return inventory
+    for root, dirs, files in walk_tree(src, listings, new_listings, patterns):
+        add_file = add_skipped_file if is_ignored_dir(src, root) else add_inventory_file
+        for file in files:
+            add_file(inventory, os.path.abspath(os.path.join(root, file)), file)
+    return inventory
+
+
+def search_inventory(
+    inventory, src_ext_name, use_start=False, quick=False, include_ignored=False
+):
+    """
+    Method to search the inventory with the same semantics as find_files
+    :param inventory: Inventory dict
+    :param src_ext_name: Extension or file name
+    :param use_start: Boolean to check for file prefix
+    :param quick: Quick search mode to return after a single hit
+    :param include_ignored: Boolean to include files that are usually ignored
+    :return: List of files with full path
+    """
+    ignored = inventory["ignored"]
+    names = inventory["names"]
+    if (
+        not use_start
+        and not include_ignored
+        and src_ext_name.startswith(".")
+        and src_ext_name.count(".") == 1
+    ):
+        # Simple extensions can be answered directly from the extension index
+        indexes = list(inventory["extensions"].get(src_ext_name, []))
+        indexes += [i for i in names.get(src_ext_name, []) if i not in ignored]
+    else:
+        indexes = []
+        for name, name_indexes in names.items():
+            if name.endswith(src_ext_name) or (
+                use_start and name.startswith(src_ext_name)
+            ):
+                indexes += [
+                    i for i in name_indexes if include_ignored or i not in ignored
+                ]
+    if not indexes:
+        return []
+    if quick:
+        return [inventory["files"][min(indexes)]]
+    return [inventory["files"][i] for i in sorted(set(indexes))]
+
+
+def get_cache_dir(cpg_out_dir):
+    """
+    Method to determine the directory used for the on-disk inventory cache.
+    The cache is stored in the user cache directory so that nothing is written
+    to the source checkout. Searches without a cpg output directory only use
+    the cache when CPGGEN_CACHE_DIR is set.
+    :param cpg_out_dir: CPG output directory
+    :return: Cache directory or None if caching is disabled
+    """
+    if os.getenv("CPGGEN_NO_CACHE") in ("true", "1"):
+        return None
+    if os.getenv("CPGGEN_CACHE_DIR"):
+        return os.getenv("CPGGEN_CACHE_DIR")
+    if not cpg_out_dir:
+        return None
+    return os.path.join(os.path.expanduser("~"), ".cache", "cpggen")
+
+
+def is_scratch_path(path):
+    """
+    Method to check if a path is inside a scratch directory created by cpggen
+    such as a source view, a snapshot, a clone or an extracted archive. These
+    are removed after the run so their inventories are not persisted.
+    :param path: Path to check
+    :return: Boolean True if the path is temporary. False otherwise
+    """
+    path = os.path.abspath(path)
+    for scratch_root in (tempfile.gettempdir(), os.getenv("CPGGEN_VIEW_DIR")):
+        if not scratch_root:
+            continue
+        scratch_root = os.path.join(os.path.abspath(scratch_root), "")
+        if path.startswith(scratch_root) and path[len(scratch_root) :].startswith(
+            "cpggen"
+        ):
+            return True
+    return False
+
+
+def get_inventory_cache_file(src, cache_dir):
+    """
+    Method to return the inventory cache file for the given source directory
+    :param src: Source directory
+    :param cache_dir: Cache directory
+    :return: Path to the json cache file
+    """
+    src_hash = hashlib.sha1(os.path.abspath(src).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"inventory-{src_hash[:16]}.json")
+
+
+def load_inventory_listings(cache_file):
+    """
+    Method to load the cached directory listings
+    :param cache_file: Inventory cache file
+    :return: Dict of directory listings keyed by path
+    """
+    try:
+        with open(cache_file, encoding="utf-8") as fp:
+            cache_data = json.load(fp)
+        if cache_data.get("version") == INVENTORY_CACHE_VERSION:
+            return cache_data.get("dirs", {})
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {}
+
+
+def save_inventory_listings(cache_file, src, listings):
+    """
+    Method to persist the directory listings atomically
+    :param cache_file: Inventory cache file
+    :param src: Source directory
+    :param listings: Dict of directory listings keyed by path
+    """
+    cache_dir = os.path.dirname(cache_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=cache_dir, suffix=".tmp", encoding="utf-8", delete=False
+        ) as fp:
+            json.dump(
+                {
+                    "version": INVENTORY_CACHE_VERSION,
+                    "src": os.path.abspath(src),
+                    "dirs": listings,
+                },
+                fp,
+            )
+        os.replace(fp.name, cache_file)
+    except OSError as e:
+        LOG.debug("Unable to save the inventory cache %s: %s", cache_file, e)
+
+
+def get_git_index_stamp(src):
+    """
+    Method to return the stamp of the git index of a checkout
+    :param src: Source directory
+    :return: List of the mtime and inode or None
+    """
+    try:
+        st = os.stat(os.path.join(src, ".git", "index"))
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_ino]
+
+
+def is_inventory_fresh(inventory):
+    """
+    Method to check whether the directories of an inventory are unchanged by
+    comparing the stamps recorded when they were listed. Only a stat per
+    directory is needed.
+    :param inventory: Inventory dict
+    :return: Boolean True if the inventory can be reused. False otherwise
+    """
+    if inventory["backend"] == "git":
+        stamp = inventory.get("git_index_stamp")
+        return stamp is not None and stamp == get_git_index_stamp(inventory["src"])
+    listings = inventory.get("listings")
+    if not listings:
+        return False
+    for path, listing in listings.items():
+        if listing.get("stamp") is None:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if [st.st_mtime_ns, st.st_ino] != listing["stamp"]:
+            return False
+    return True
+
+
+def get_inventory(src, refresh=False, cache_dir=None, validate=False):
+    """
+    Method to return the inventory for the given source directory.
+    Inventories are built once per process and reused by the find methods.
+    When a cache directory is available, the directory listings are persisted
+    so that later runs only list the directories that have changed.
+    :param src: Source directory
+    :param refresh: Boolean to rebuild the inventory
+    :param cache_dir: Optional cache directory. Defaults to CPGGEN_CACHE_DIR
+    :param validate: Boolean to rebuild the inventory only when the stamp of
+        one of its directories changed
+    :return: Inventory dict
+    """
+    key = os.path.abspath(src)
+    cached = inventory_cache.get(key)
+    if cached and not refresh and (not validate or is_inventory_fresh(cached)):
+        return cached
+    if not cache_dir:
+        cache_dir = get_cache_dir(None)
+    # Unchanged directories are not listed again
+    listings = (cached or {}).get("listings") or {}
+    cache_file = None
+    if cache_dir and os.path.isdir(src) and not is_scratch_path(src):
+        cache_file = get_inventory_cache_file(src, cache_dir)
+        if not listings:
+            listings = {
+                os.path.join(src, path) if path != "." else src: listing
+                for path, listing in load_inventory_listings(cache_file).items()
+            }
+    new_listings = {}
+    inventory = build_inventory(src, listings, new_listings)
+    if inventory["backend"] == "git":
+        inventory["git_index_stamp"] = get_git_index_stamp(src)
+    else:
+        inventory["listings"] = new_listings
+        # Directories that no longer exist are dropped from the cache
+        if cache_file and new_listings != listings:
+            save_inventory_listings(
+                cache_file,
+                src,
+                {os.path.relpath(path, src): v for path, v in new_listings.items()},
+            )
+    inventory_cache[key] = inventory
+    return inventory
+
+
+def clear_inventory_cache():
+    """Method to discard all the inventories built by this process"""
+    inventory_cache.clear()
+
+
 def find_java_artifacts(search_dir):
     """
     Method to find java artifacts in the given directory
@@ -196,24 +893,102 @@ def find_java_artifacts(search_dir):
     :return: List of war or ear or jar files
     """
     jlist = []
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".jar", encoding="utf-8", delete=False
-    ) as zfile:
-        with zipfile.ZipFile(zfile.name, "w") as zf:
-            for dirname, subdirs, files in os.walk(search_dir):
-                filter_ignored_dirs(subdirs)
-                if not is_ignored_dir(search_dir, dirname):
-                    for filename in files:
-                        if (
-                            filename.endswith(".jar")
-                            or filename.endswith(".war")
-                            or filename.endswith(".ear")
-                        ):
-                            jlist.append(
-                                os.path.abspath(os.path.join(dirname, filename))
-                            )
-                            zf.write(os.path.join(dirname, filename))
-    return jlist if len(jlist) == 1 else [os.path.abspath(zfile.name)]
+    for dirname, subdirs, files in walk_tree(search_dir):
+        if not is_ignored_dir(search_dir, dirname):
+            for filename in files:
+                if (
+                    filename.endswith(".jar")
+                    or filename.endswith(".war")
+                    or filename.endswith(".ear")
+                ):
+                    # Skip archives that are known to have no bytecode
+                    summary = inspect_archive(os.path.join(dirname, filename))
+                    if summary and get_archive_project_type(summary) != "jimple":
+                        continue
+                    jlist.append(os.path.abspath(os.path.join(dirname, filename)))
+    return jlist
+
+
+def link_artifacts(artifacts, link_dir=None):
+    """
+    Method to collect the artifacts in a directory of symlinks without copying
+    them. Frontends such as jimple2cpg accept the directory as their input.
+    :param artifacts: List of artifact paths
+    :param link_dir: Optional directory. Defaults to a temp directory
+    :return: Path of the directory
+    """
+    if not link_dir:
+        link_dir = tempfile.mkdtemp(prefix="cpggen_artifacts_")
+    os.makedirs(link_dir, exist_ok=True)
+    names = set()
+    for i, artifact in enumerate(artifacts):
+        name = os.path.basename(artifact)
+        if name in names:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}-{i}{ext}"
+        names.add(name)
+        os.symlink(os.path.abspath(artifact), os.path.join(link_dir, name))
+    return link_dir
+
+
+def build_uber_jar(artifacts, jar_file=None):
+    """
+    Method to bundle the artifacts in a single archive for the tools that
+    need one. The archives are stored without compression since they are
+    already compressed.
+    :param artifacts: List of artifact paths
+    :param jar_file: Optional path of the archive. Defaults to a temp file
+    :return: Path of the archive
+    """
+    if not jar_file:
+        fd, jar_file = tempfile.mkstemp(prefix="cpggen_uber_", suffix=".jar")
+        os.close(fd)
+    with zipfile.ZipFile(jar_file, "w", compression=zipfile.ZIP_STORED) as zf:
+        names = set()
+        for i, artifact in enumerate(artifacts):
+            name = os.path.basename(artifact)
+            if name in names:
+                stem, ext = os.path.splitext(name)
+                name = f"{stem}-{i}{ext}"
+            names.add(name)
+            zf.write(artifact, name)
+    return jar_file
+
+
+def bundle_java_artifacts(search_dir, mode=None):
+    """
+    Method to find the java artifacts and bundle them for a frontend.
+    A single artifact is used as-is. Many artifacts are collected in a
+    directory of symlinks or, with the archive mode, in a stored uber jar.
+    :param search_dir: Directory to search
+    :param mode: symlink or archive. Defaults to CPGGEN_ARTIFACTS_MODE
+        or symlink
+    :return: Tuple of the bundle path and a boolean that is True when the
+        bundle is a temporary file or directory that should be removed
+    """
+    if mode is None:
+        mode = os.getenv("CPGGEN_ARTIFACTS_MODE", "symlink")
+    artifacts = find_java_artifacts(search_dir)
+    if not artifacts:
+        return "", False
+    if len(artifacts) == 1:
+        return artifacts[0], False
+    if mode == "archive":
+        return build_uber_jar(artifacts), True
+    return link_artifacts(artifacts), True
+
+
+def remove_bundle(bundle):
+    """
+    Method to remove a temporary bundle created by bundle_java_artifacts
+    :param bundle: Path of the file or directory
+    """
+    if not bundle or not os.path.exists(bundle):
+        return
+    if os.path.isdir(bundle):
+        shutil.rmtree(bundle, ignore_errors=True)
+    else:
+        os.remove(bundle)
 
 
 def find_csharp_artifacts(search_dir):
@@ -222,30 +997,46 @@ def find_csharp_artifacts(search_dir):
     :param search_dir: Directory to search
     :return: List of .sln or .csharp files
     """
-    result = [p.as_posix() for p in Path(search_dir).absolute().rglob("*.sln")]
-    if not result:
-        result = [p.as_posix() for p in Path(search_dir).absolute().rglob("*.csproj")]
-    return result
+    sln_files = []
+    csproj_files = []
+    # Every directory is searched including the ignored ones like rglob did
+    for root, _, files in os.walk(search_dir):
+        for file in files:
+            if file.endswith(".sln"):
+                sln_files.append(Path(root, file).absolute().as_posix())
+            elif file.endswith(".csproj"):
+                csproj_files.append(Path(root, file).absolute().as_posix())
+    return sln_files if sln_files else csproj_files
 
 
 def find_go_mods(search_dir):
-    return find_files(search_dir, "go.mod", False, False)
+    return find_files(
+        search_dir, "go.mod", False, False, inventory=get_inventory(search_dir)
+    )
 
 
 def find_makefiles(search_dir):
-    return find_files(search_dir, "Makefile", False, False)
+    return find_files(
+        search_dir, "Makefile", False, False, inventory=get_inventory(search_dir)
+    )
 
 
 def find_gradle_files(search_dir):
-    return find_files(search_dir, "build.gradle", False, False)
+    return find_files(
+        search_dir, "build.gradle", False, False, inventory=get_inventory(search_dir)
+    )
 
 
 def find_pom_files(search_dir):
-    return find_files(search_dir, "pom.xml", False, False)
+    return find_files(
+        search_dir, "pom.xml", False, False, inventory=get_inventory(search_dir)
+    )
 
 
 def find_sbt_files(search_dir):
-    return find_files(search_dir, "build.sbt", False, False)
+    return find_files(
+        search_dir, "build.sbt", False, False, inventory=get_inventory(search_dir)
+    )
 
 
 def check_command(cmd):
@@ -261,8 +1052,92 @@ def is_binary_string(content):
     """
     Method to check if the given content is a binary string
     """
-    textchars = bytearray({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7F})
-    return bool(content.translate(None, textchars))
+    return bool(content.translate(None, TEXT_CHARS))
+
+
+def read_at(fp, offset, size):
+    """
+    Method to read a few bytes at the given offset using a positional read
+    :param fp: File opened in binary mode
+    :param offset: Offset to read from
+    :param size: Number of bytes to read
+    :return: Bytes read
+    """
+    if hasattr(os, "pread"):
+        return os.pread(fp.fileno(), size, offset)
+    fp.seek(offset)
+    return fp.read(size)
+
+
+def classify_binary_header(header, read_more=None):
+    """
+    Method to identify the binary format from the magic number in the header
+    :param header: First bytes of the file
+    :param read_more: Optional function taking an offset and size to read more bytes
+    :return: One of elf, pe, macho, class or dex. None for other files
+    """
+    magic = header[:4]
+    if magic == b"\x7fELF":
+        return "elf"
+    if header[:2] == b"MZ" and len(header) >= 64 and read_more:
+        # The offset of the PE header is stored at 0x3c in the DOS header
+        pe_offset = int.from_bytes(header[60:64], "little")
+        if read_more(pe_offset, 4) == b"PE\0\0":
+            return "pe"
+        return None
+    if magic in MACHO_MAGIC_NUMBERS:
+        return "macho"
+    if magic == b"\xca\xfe\xba\xbe" and len(header) >= 8:
+        # Java class files and fat Mach-O binaries share the magic number.
+        # Class files have a major version of 45 or above at offset 6
+        if int.from_bytes(header[6:8], "big") >= 45:
+            return "class"
+        return "macho"
+    if magic == b"dex\n":
+        return "dex"
+    return None
+
+
+def classify_binary(path):
+    """
+    Method to identify the binary format of a file with small positional reads.
+    Results are cached by inode, mtime and size.
+    :param path: File path
+    :return: One of elf, pe, macho, class or dex. None for other files
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = binary_kind_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    kind = None
+    if st.st_size >= 4:
+        try:
+            with open(path, "rb", buffering=0) as fp:
+                kind = classify_binary_header(
+                    read_at(fp, 0, 64), lambda offset, size: read_at(fp, offset, size)
+                )
+        except OSError:
+            kind = None
+    binary_kind_cache[path] = (key, kind)
+    return kind
+
+
+def classify_binaries(paths):
+    """
+    Method to classify many files on a thread pool
+    :param paths: List of file paths
+    :return: List of binary kinds in the same order as paths
+    """
+    if len(paths) > 1 and get_walk_workers() > 1:
+        with ThreadPoolExecutor(max_workers=get_walk_workers()) as pool:
+            return list(pool.map(classify_binary, paths, chunksize=64))
+    return [classify_binary(p) for p in paths]
 
 
 def is_exe(src):
@@ -271,8 +1146,11 @@ def is_exe(src):
     :return True if binary file. False otherwise.
     """
     if os.path.isfile(src):
+        if classify_binary(src):
+            return True
         try:
-            return is_binary_string(open(src, "rb").read(1024))
+            with open(src, "rb") as fp:
+                return is_binary_string(fp.read(1024))
         except OSError:
             return False
     return False
@@ -280,18 +1158,21 @@ def is_exe(src):
 
 def find_exe_files(src):
     """
-    Method to find files with given extenstion
+    Method to find the ELF, PE and Mach-O executables in the given directory
+    :param src: Directory to search
+    :return: List of executable files
     """
-    result = []
-    for root, dirs, files in os.walk(src):
-        filter_ignored_dirs(dirs)
+    candidates = []
+    for root, _, files in walk_tree(src):
         for file in files:
             if is_ignored_file(file):
                 continue
-            full_path = os.path.join(root, file)
-            if is_exe(full_path):
-                result.append(full_path)
-    return result
+            candidates.append(os.path.join(root, file))
+    return [
+        path
+        for path, kind in zip(candidates, classify_binaries(candidates))
+        if kind in executable_binary_kinds
+    ]
 
 
 def bomstrip(manifest):
@@ -313,20 +1194,19 @@ def find_python_reqfiles(path):
     Returns:
       List of python requirement files
     """
-    result = []
     req_files = ["requirements.txt", "Pipfile", "Pipfile.lock", "conda.yml"]
-    for root, dirs, files in os.walk(path):
-        filter_ignored_dirs(dirs)
-        if not is_ignored_dir(path, root):
-            for name in req_files:
-                if name in files:
-                    result.append(os.path.join(root, name))
-    return result
+    inventory = get_inventory(path)
+    # Only exact names match unlike the suffix search of find_files
+    indexes = []
+    for name in req_files:
+        indexes += inventory["names"].get(name, [])
+    return [inventory["files"][i] for i in sorted(indexes)]
 
 
-def detect_project_type(src_dir):
+def detect_project_type(src_dir, cache_dir=None):
     """Detect project type by looking for certain files
     :param src_dir: Source directory
+    :param cache_dir: Optional inventory cache directory
     :return List of detected types
     """
     is_java_like = False
@@ -341,26 +1221,28 @@ def detect_project_type(src_dir):
         purl_data = PackageURL.from_string(src_dir)
         if purl_data and purl_data.type:
             return [purl_data.type]
-    if find_python_reqfiles(src_dir) or find_files(src_dir, ".py", False, True):
+    # The language of an archive comes from its central directory
+    if os.path.isfile(src_dir) and is_archive(src_dir):
+        archive_type = get_archive_project_type(inspect_archive(src_dir))
+        return [archive_type] if archive_type else []
+    # Walk the tree once and answer all the checks from the inventory
+    inventory = get_inventory(src_dir, cache_dir=cache_dir, validate=True)
+
+    def has_file(src_ext_name):
+        return search_inventory(inventory, src_ext_name, quick=True)
+
+    if find_python_reqfiles(src_dir) or has_file(".py"):
         project_types.append("python")
-    if find_files(src_dir, "composer.json", False, True) or find_files(
-        src_dir, ".php", False, True
-    ):
+    if has_file("composer.json") or has_file(".php"):
         project_types.append("php")
-    if find_files(src_dir, ".sbt", False, True) or find_files(
-        src_dir, ".scala", False, True
-    ):
+    if has_file(".sbt") or has_file(".scala"):
         project_types.append("scala")
-    if find_files(src_dir, ".kt", False, True):
+    if has_file(".kt"):
         if maven_cache_exists or gradle_cache_exists:
             project_types.append("kotlin-with-classpath")
         else:
             project_types.append("kotlin")
-    if (
-        find_files(src_dir, "pom.xml", False, True)
-        or find_files(src_dir, ".gradle", False, True)
-        or find_files(src_dir, ".java", False, True)
-    ):
+    if has_file("pom.xml") or has_file(".gradle") or has_file(".java"):
         is_java_like = True
         if os.path.exists(str(Path.home() / ".m2")):
             project_types.append("java-with-deps")
@@ -370,53 +1252,433 @@ def detect_project_type(src_dir):
             project_types.append("java-with-gradle-deps")
         else:
             project_types.append("java")
-    if find_files(src_dir, ".bzl", False, True) or find_files(
-        src_dir, "BUILD", False, True
-    ):
+    if has_file(".bzl") or has_file("BUILD"):
         project_types.append("java")
     if (
-        find_files(src_dir, "package.json", False, True)
-        or find_files(src_dir, "yarn.lock", False, True)
-        or find_files(src_dir, ".js", False, True)
-        or find_files(src_dir, ".ts", False, True)
+        has_file("package.json")
+        or has_file("yarn.lock")
+        or has_file(".js")
+        or has_file(".ts")
     ):
         project_types.append("js")
     if (
-        find_files(src_dir, "conan.lock", False, True)
-        or find_files(src_dir, "conanfile.txt", False, True)
-        or find_files(src_dir, ".c", False, True)
-        or find_files(src_dir, ".cpp", False, True)
-        or find_files(src_dir, ".cc", False, True)
-        or find_files(src_dir, ".h", False, True)
-        or find_files(src_dir, ".hpp", False, True)
-        or find_files(src_dir, ".hh", False, True)
+        has_file("conan.lock")
+        or has_file("conanfile.txt")
+        or has_file(".c")
+        or has_file(".cpp")
+        or has_file(".cc")
+        or has_file(".h")
+        or has_file(".hpp")
+        or has_file(".hh")
     ):
         project_types.append("c")
-    if find_files(src_dir, ".bc", False, True) or find_files(
-        src_dir, ".ll", False, True
-    ):
+    if has_file(".bc") or has_file(".ll"):
         project_types.append("llvm")
+    return project_types + detect_binary_project_types(src_dir, inventory, is_java_like)
+
+
+def detect_binary_project_types(src_dir, inventory, is_java_like=False):
+    """Detect the project types of executables, bytecode and archives
+    :param src_dir: Source directory
+    :param inventory: Inventory of src_dir
+    :param is_java_like: Boolean to skip jimple for java source projects
+    :return List of detected types
+    """
+    project_types = []
     if is_exe(src_dir):
         project_types.append("binary")
     # Directory contains just a bunch of jar then try jimple
-    if not is_java_like:
-        if find_files(src_dir, ".jar", False, True):
-            project_types.append("jimple")
-        elif (
-            find_files(src_dir, ".apk", False, True)
-            or find_files(src_dir, ".zip", False, True)
-            or find_files(src_dir, ".dex", False, True)
-            or find_files(src_dir, ".class", False, True)
-            or find_files(src_dir, ".jimple", False, True)
+    if is_java_like:
+        return project_types
+    if any(
+        search_inventory(inventory, ext, quick=True)
+        for ext in (".dex", ".class", ".jimple")
+    ):
+        return project_types + ["jimple"]
+    # Only archives containing bytecode are worth a jimple run
+    for ext in archive_extensions:
+        if any(
+            get_archive_project_type(inspect_archive(f)) == "jimple"
+            for f in search_inventory(inventory, ext)
         ):
-            project_types.append("jimple")
+            return project_types + ["jimple"]
     return project_types
 
 
+def get_file_sizes(paths, inventory=None):
+    """
+    Method to return the size of the given files. The files are stat-ed in
+    parallel and the sizes are remembered in the inventory when available.
+    :param paths: List of file paths
+    :param inventory: Optional inventory dict used to cache the sizes
+    :return: List of sizes in bytes. Missing files have a size of 0
+    """
+    sizes = inventory.setdefault("sizes", {}) if inventory is not None else {}
+
+    def file_size(path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+
+    missing = [p for p in paths if p not in sizes]
+    if len(missing) > 1 and get_walk_workers() > 1:
+        with ThreadPoolExecutor(max_workers=get_walk_workers()) as pool:
+            sizes.update(zip(missing, pool.map(file_size, missing, chunksize=64)))
+    else:
+        sizes.update((p, file_size(p)) for p in missing)
+    return [sizes[p] for p in paths]
+
+
+def get_project_type_files(src_dir, project_type, inventory=None):
+    """
+    Method to return the files that belong to a project type
+    :param src_dir: Source directory or file
+    :param project_type: Project type such as python or java-with-deps
+    :param inventory: Optional inventory of src_dir
+    :return: List of files with full path
+    """
+    if project_type == "binary" or os.path.isfile(src_dir):
+        return [os.path.abspath(src_dir)] if os.path.isfile(src_dir) else []
+    if inventory is None:
+        inventory = get_inventory(src_dir)
+    extensions = project_type_extensions.get(
+        project_type, project_type_extensions.get(project_type.split("-")[0], ())
+    )
+    files = []
+    for ext in extensions:
+        files += search_inventory(inventory, ext)
+    return files
+
+
+def get_language_stats(src_dir, project_types, inventory=None):
+    """
+    Method to compute the number of files and bytes of each project type
+    :param src_dir: Source directory
+    :param project_types: List of project types
+    :param inventory: Optional inventory of src_dir
+    :return: Dict of project type to a dict with the files and bytes
+    """
+    stats = {}
+    if not src_dir or not os.path.exists(src_dir):
+        return stats
+    if inventory is None and os.path.isdir(src_dir):
+        inventory = get_inventory(src_dir)
+    for project_type in project_types:
+        if project_type in stats:
+            continue
+        files = get_project_type_files(src_dir, project_type, inventory)
+        stats[project_type] = {
+            "files": len(files),
+            "bytes": sum(get_file_sizes(files, inventory)),
+        }
+        archives = [f for f in files if is_archive(f)]
+        if archives:
+            summaries = [inspect_archive(f) for f in archives]
+            stats[project_type]["archives"] = len(archives)
+            stats[project_type]["archive_bytes"] = sum(
+                get_file_sizes(archives, inventory)
+            )
+            for k in ("uncompressed_bytes", "classes", "dex", "nested_archives"):
+                stats[project_type][k] = sum(a[k] for a in summaries if a)
+    return stats
+
+
+def filter_project_types(
+    project_types, stats, min_files=0, min_bytes=0, max_languages=0
+):
+    """
+    Method to skip the project types that are too small to be worth a frontend
+    invocation. At least the largest project type is always kept.
+    :param project_types: List of detected project types
+    :param stats: Language statistics from get_language_stats
+    :param min_files: Minimum number of files required for a project type
+    :param min_bytes: Minimum number of bytes required for a project type
+    :param max_languages: Optional number of the largest project types to keep
+    :return: Filtered list of project types
+    """
+    project_types = list(dict.fromkeys(project_types))
+    kept = []
+    for project_type in project_types:
+        lang_stats = stats.get(project_type)
+        if lang_stats and (
+            lang_stats["files"] < min_files or lang_stats["bytes"] < min_bytes
+        ):
+            LOG.info(
+                "Skipping %s since it has only %d files and %d bytes",
+                project_type,
+                lang_stats["files"],
+                lang_stats["bytes"],
+            )
+            continue
+        kept.append(project_type)
+    if max_languages and len(kept) > max_languages:
+        largest = sorted(
+            kept,
+            key=lambda p: stats.get(p, {}).get("bytes", 0),
+            reverse=True,
+        )[:max_languages]
+        LOG.info(
+            "Skipping %s to keep only the %d largest languages",
+            ", ".join(p for p in kept if p not in largest),
+            max_languages,
+        )
+        kept = [p for p in kept if p in largest]
+    if not kept and project_types:
+        kept = [max(project_types, key=lambda p: stats.get(p, {}).get("bytes", 0))]
+    return kept
+
+
+def is_archive(path):
+    """
+    Method to check if the file is a zip based archive by its extension
+    :param path: File path
+    :return: True if the file is a jar, war, apk, zip or wheel
+    """
+    return path.lower().endswith(archive_extensions)
+
+
+def inspect_archive(path):
+    """
+    Method to summarize the contents of a zip based archive by reading only
+    its central directory. Nothing is extracted.
+    :param path: Archive path
+    :return: Dict with the entry counts and sizes or None for invalid archives
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = archive_summary_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    summary = {
+        "entries": 0,
+        "compressed_bytes": 0,
+        "uncompressed_bytes": 0,
+        "classes": 0,
+        "dex": 0,
+        "nested_archives": 0,
+        "sources": {},
+    }
+    source_types = {}
+    for project_type, extensions in project_type_extensions.items():
+        if project_type in ("jimple", "llvm"):
+            continue
+        for ext in extensions:
+            source_types[ext] = project_type
+    try:
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                name = info.filename.lower()
+                summary["entries"] += 1
+                summary["compressed_bytes"] += info.compress_size
+                summary["uncompressed_bytes"] += info.file_size
+                ext = get_file_extension(name)
+                if ext == ".class":
+                    summary["classes"] += 1
+                elif ext == ".dex":
+                    summary["dex"] += 1
+                elif ext in archive_extensions:
+                    summary["nested_archives"] += 1
+                elif ext in source_types and not is_ignored_file(name):
+                    source_type = source_types[ext]
+                    summary["sources"][source_type] = (
+                        summary["sources"].get(source_type, 0) + 1
+                    )
+    except (OSError, zipfile.BadZipFile, ValueError) as e:
+        LOG.debug("Unable to inspect the archive %s: %s", path, e)
+        summary = None
+    archive_summary_cache[path] = (key, summary)
+    return summary
+
+
+def get_archive_project_type(summary):
+    """
+    Method to choose the project type of an archive from its summary.
+    Archives with bytecode use jimple while source archives use the language
+    with the most source files.
+    :param summary: Archive summary from inspect_archive
+    :return: Project type or None if the archive has nothing to analyze
+    """
+    if not summary:
+        return None
+    if summary["classes"] or summary["dex"] or summary["nested_archives"]:
+        return "jimple"
+    if summary["sources"]:
+        return max(summary["sources"].items(), key=lambda kv: kv[1])[0]
+    return None
+
+
+def expand_source_archive(src):
+    """
+    Method to extract archives containing only source files since the source
+    frontends cannot read archives. Bytecode archives are left as-is for jimple.
+    The caller removes the extracted directory once its jobs are done.
+    :param src: Source path
+    :return: Directory with the extracted sources or the original path
+    """
+    if not os.path.isfile(src) or not is_archive(src):
+        return src
+    archive_type = get_archive_project_type(inspect_archive(src))
+    if not archive_type or archive_type == "jimple":
+        return src
+    extract_dir = tempfile.mkdtemp(prefix="cpggen")
+    LOG.debug("Extracting the %s sources in %s to %s", archive_type, src, extract_dir)
+    with zipfile.ZipFile(src) as zf:
+        zf.extractall(extract_dir)
+    return extract_dir
+
+
+def get_git_cache_dir():
+    """
+    Method to return the directory of the git mirror cache
+    :return: Cache directory or None if caching is disabled
+    """
+    if os.getenv("CPGGEN_NO_CACHE") in ("true", "1") or not GIT_CACHE_DIR:
+        return None
+    return GIT_CACHE_DIR
+
+
+def init_mirror(repo_url, mirror_dir):
+    """
+    Method to create a bare repo that only fetches the branches and tags of a
+    remote. Other refs such as the refs/pull/* of GitHub are left out.
+    :param repo_url: Repo url
+    :param mirror_dir: Directory of the bare repo
+    :return: git.Repo
+    """
+    repo = git.Repo.init(mirror_dir, bare=True)
+    repo.create_remote("origin", repo_url)
+    repo.git.config(
+        "--replace-all", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"
+    )
+    repo.git.config("--add", "remote.origin.fetch", "+refs/tags/*:refs/tags/*")
+    repo.git.fetch("origin")
+    # Clones check out the default branch of the remote
+    for line in repo.git.ls_remote("--symref", "origin", "HEAD").splitlines():
+        if line.startswith("ref: ") and line.endswith("\tHEAD"):
+            repo.git.symbolic_ref("HEAD", line[len("ref: ") :].split("\t")[0])
+    return repo
+
+
+def update_mirror(repo_url, mirror_root):
+    """
+    Method to create or update the bare mirror of a git repo. Existing mirrors
+    are updated with an incremental fetch. A stale mirror is still used when
+    the remote cannot be reached. The caller must hold the lock of mirror_root.
+    :param repo_url: Repo url
+    :param mirror_root: Directory of the mirror in the git cache
+    :return: Mirror directory or None if it could not be created
+    """
+    mirror_dir = os.path.join(mirror_root, "mirror.git")
+    if os.path.exists(mirror_dir):
+        try:
+            git.Repo(mirror_dir).git.fetch("--prune", "origin")
+        except git.GitCommandError as e:
+            LOG.warning("Unable to update the mirror of %s: %s", repo_url, e)
+        return mirror_dir
+    tmp_dir = tempfile.mkdtemp(prefix="mirror-", dir=mirror_root)
+    try:
+        init_mirror(repo_url, tmp_dir)
+        os.replace(tmp_dir, mirror_dir)
+    except (git.GitCommandError, OSError) as e:
+        LOG.debug("Unable to mirror %s: %s", repo_url, e)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+    return mirror_dir
+
+
+def get_tree_size(path):
+    """
+    Method to compute the size of the files in a directory tree
+    :param path: Directory
+    :return: Size in bytes
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                continue
+    return size
+
+
+def evict_mirrors(cache_dir, quota=None, keep=None):
+    """
+    Method to remove the least recently used mirrors until the git cache fits
+    in the quota. Mirrors that another worker is using are skipped.
+    :param cache_dir: Git cache directory
+    :param quota: Optional size in bytes. Defaults to GIT_CACHE_BYTES
+    :param keep: Optional mirror root that must not be evicted
+    :return: List of the removed mirror directories
+    """
+    if quota is None:
+        quota = GIT_CACHE_BYTES
+    mirrors = []
+    try:
+        entries = os.listdir(cache_dir)
+    except OSError:
+        return []
+    for entry in entries:
+        mirror_dir = os.path.join(cache_dir, entry, "mirror.git")
+        try:
+            used = os.stat(mirror_dir).st_mtime_ns
+        except OSError:
+            continue
+        mirrors.append((used, mirror_dir, get_tree_size(mirror_dir)))
+    total = sum(m[2] for m in mirrors)
+    removed = []
+    for _, mirror_dir, size in sorted(mirrors):
+        if total <= quota:
+            break
+        mirror_root = os.path.dirname(mirror_dir)
+        if mirror_root == keep:
+            continue
+        try:
+            with download.cache_lock(mirror_root, blocking=False):
+                shutil.rmtree(mirror_dir)
+        except OSError:
+            continue
+        total -= size
+        removed.append(mirror_dir)
+    if removed:
+        LOG.debug("Evicted %d git mirrors from the cache", len(removed))
+    return removed
+
+
 def clone_repo(repo_url, clone_dir, depth=1):
-    """Method to clone a git repo"""
+    """Method to clone a git repo. Repos are cloned from a local bare mirror
+    that shares its objects with the clone using hardlinks. The shallow network
+    clone is used when the cache is disabled"""
     if not GIT_AVAILABLE:
         return None
+    cache_dir = get_git_cache_dir()
+    if cache_dir:
+        mirror_root = os.path.join(
+            cache_dir, hashlib.sha256(repo_url.encode("utf-8")).hexdigest()
+        )
+        cloned = False
+        # The lock also keeps the mirror from being evicted while it is cloned
+        with download.cache_lock(mirror_root):
+            mirror_dir = update_mirror(repo_url, mirror_root)
+            if mirror_dir:
+                try:
+                    repo = git.Repo.clone_from(mirror_dir, clone_dir, local=True)
+                    repo.remotes.origin.set_url(repo_url)
+                    os.utime(mirror_dir)
+                    cloned = True
+                except git.GitCommandError as e:
+                    LOG.debug("Unable to clone %s from its mirror: %s", repo_url, e)
+                    shutil.rmtree(clone_dir, ignore_errors=True)
+                    os.makedirs(clone_dir, exist_ok=True)
+        evict_mirrors(cache_dir, keep=mirror_root)
+        if cloned:
+            return clone_dir
     git.Repo.clone_from(repo_url, clone_dir, depth=depth)
     return clone_dir
 
@@ -443,7 +1705,7 @@ def build_pypi_download_url(purl):
     """
     Return a PyPI download URL from the `purl` string.
     """
-    url_prefix = "https://pypi.io/packages/source/"
+    url_prefix = PYPI_SOURCE_URL
     purl_data = PackageURL.from_string(purl)
     name = purl_data.name
     version = purl_data.version
@@ -495,21 +1757,241 @@ def unzip_unsafe(zf, to_dir):
     shutil.rmtree(zf, ignore_errors=True)
 
 
-def untar_unsafe(tf, to_dir):
+def untar_unsafe(tf, to_dir, name=None):
     """Method to untar .tar or .tar.gz files in an unsafe manner"""
-    if tf.endswith("tar.gz") or tf.endswith(".tgz"):
+    name = name or tf
+    if name.endswith("tar.gz") or name.endswith(".tgz"):
         tar = tarfile.open(tf, "r:gz")
         tar.extractall(to_dir)
         tar.close()
-    elif tf.endswith(".tar"):
+    elif name.endswith(".tar"):
         tar = tarfile.open(tf, "r:")
         tar.extractall(to_dir)
         tar.close()
     shutil.rmtree(tf, ignore_errors=True)
 
 
+def get_published_checksum(url):
+    """
+    Method to fetch the checksum that the registry publishes for a download.
+    Maven repositories serve a .sha1 file next to each artifact and pypi lists
+    the sha256 digest of every release file in its json api.
+    :param url: Download url
+    :return: Tuple of the hash algorithm and the hex digest or None
+    """
+    if not VERIFY_DOWNLOADS:
+        return None
+    try:
+        if url.startswith((MAVEN_CENTRAL_URL, ANDROID_MAVEN)) and url.endswith(".jar"):
+            response = httpx.get(f"{url}.sha1", follow_redirects=True)
+            if response.status_code != 200:
+                return None
+            digest = response.text.split()[0].lower() if response.text else ""
+            if len(digest) == 40 and all(c in "0123456789abcdef" for c in digest):
+                return "sha1", digest
+        elif url.startswith(PYPI_SOURCE_URL) and url.endswith(".tar.gz"):
+            name, filename = url[len(PYPI_SOURCE_URL) :].split("/")[1:3]
+            version = filename[len(name) + 1 : -len(".tar.gz")]
+            response = httpx.get(
+                f"https://pypi.org/pypi/{name}/{version}/json", follow_redirects=True
+            )
+            if response.status_code != 200:
+                return None
+            for release_file in response.json().get("urls", []):
+                if release_file.get("filename") == filename:
+                    return "sha256", release_file["digests"]["sha256"]
+    except (httpx.HTTPError, ValueError, KeyError, IndexError) as e:
+        LOG.debug("Unable to get the published checksum of %s: %s", url, e)
+    return None
+
+
+def get_published_checksums(urls):
+    """
+    Method to fetch the published checksums of many downloads at the same time
+    so that they cost a single round trip before the downloads start
+    :param urls: List of download urls
+    :return: Dict of url to the tuple of the hash algorithm and the hex digest
+        or None
+    """
+    if len(urls) <= 1:
+        return {url: get_published_checksum(url) for url in urls}
+    with ThreadPoolExecutor(
+        max_workers=min(len(urls), max(1, download.DOWNLOAD_CONCURRENCY))
+    ) as pool:
+        return dict(zip(urls, pool.map(get_published_checksum, urls)))
+
+
+def iter_url(transfer):
+    """
+    Method to download a transfer as a stream of chunks with a progress bar.
+    Interrupted downloads are resumed and the content is verified at the end.
+    :param transfer: Transfer from download.open_transfer
+    :return: Generator of bytes
+    """
+    with Progress(
+        "[progress.percentage]{task.percentage:>3.0f}%",
+        rich.progress.BarColumn(bar_width=None),
+        rich.progress.DownloadColumn(),
+        rich.progress.TransferSpeedColumn(),
+    ) as progress:
+        download_task = progress.add_task("Download", total=None)
+
+        def report(completed, total):
+            # Servers may stream the body without a Content-Length
+            progress.update(download_task, completed=completed, total=total)
+
+        yield from download.fetch_chunks(transfer, report)
+
+
+def untar_stream(reader, name, to_dir):
+    """
+    Method to extract a tar archive from a stream as it is read in an unsafe manner
+    :param reader: Binary file object read sequentially
+    :param name: File name of the download
+    :param to_dir: Directory to extract to
+    """
+    mode = "r|gz" if name.endswith(".tar.gz") or name.endswith(".tgz") else "r|"
+    try:
+        with tarfile.open(fileobj=reader, mode=mode) as tar:
+            tar.extractall(to_dir)
+    finally:
+        # Keep reading the padding after the archive so the writer never blocks
+        while reader.read(STREAM_CHUNK_SIZE):
+            pass
+
+
+def stream_untar(chunks, name, to_dir):
+    """
+    Method to extract a tar download while it is still arriving. The chunks are
+    piped to a reader thread.
+    :param chunks: Iterator of bytes
+    :param name: File name of the download
+    :param to_dir: Directory to extract to
+    """
+    reader_fd, writer_fd = os.pipe()
+    with os.fdopen(reader_fd, "rb") as reader, ThreadPoolExecutor(
+        max_workers=1
+    ) as pool:
+        extraction = pool.submit(untar_stream, reader, name, to_dir)
+        with os.fdopen(writer_fd, "wb") as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        extraction.result()
+
+
+def move_tree(src_dir, dest_dir):
+    """
+    Method to move the contents of a directory into another one, merging
+    directories that already exist
+    :param src_dir: Source directory
+    :param dest_dir: Destination directory
+    """
+    for entry in os.listdir(src_dir):
+        src = os.path.join(src_dir, entry)
+        dest = os.path.join(dest_dir, entry)
+        if os.path.isdir(src) and os.path.isdir(dest) and not os.path.islink(dest):
+            move_tree(src, dest)
+        else:
+            if os.path.isdir(dest) and not os.path.islink(dest):
+                shutil.rmtree(dest)
+            os.replace(src, dest)
+
+
+def stream_download(transfer, chunks, download_dir, expand_archive=True):
+    """
+    Method to save or extract a download from its chunks. Tar archives are
+    extracted while they arrive. Zip archives need their central directory at
+    the end and hence are spooled first, in memory when small. The files are
+    staged and only moved to download_dir once the download is verified.
+    :param transfer: Transfer from download.open_transfer
+    :param chunks: Iterator of bytes
+    :param download_dir: Directory to save or extract to
+    :param expand_archive: Boolean to extract archives
+    :return: download_dir
+    """
+    name = transfer["name"]
+    blob = transfer["blob"]
+    stream = expand_archive and STREAM_DOWNLOADS
+    staging_dir = tempfile.mkdtemp(prefix=".cpggen-download-", dir=download_dir)
+    try:
+        if stream and (
+            name.endswith(".tar") or name.endswith(".tar.gz") or name.endswith(".tgz")
+        ):
+            stream_untar(chunks, name, staging_dir)
+        elif stream and name.endswith(".zip"):
+            with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES) as spool:
+                for chunk in chunks:
+                    # The cache blob is already on disk and doubles as the spool
+                    if not blob:
+                        spool.write(chunk)
+                if blob:
+                    blob["fp"].flush()
+                spool.seek(0)
+                with zipfile.ZipFile(blob["path"] if blob else spool) as zip_ref:
+                    zip_ref.extractall(staging_dir)
+        else:
+            archive = os.path.join(staging_dir, name)
+            with open(archive, mode="wb") as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+            if expand_archive:
+                expand_download(archive, name, staging_dir)
+        move_tree(staging_dir, download_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return download_dir
+
+
+def expand_download(archive, name, download_dir):
+    """
+    Method to extract a downloaded archive in an unsafe manner. The kind of
+    archive is taken from the name since cached blobs have no extension. The
+    archive is only read so that cached blobs can be extracted directly.
+    :param archive: Archive path
+    :param name: File name of the download
+    :param download_dir: Directory to extract to
+    """
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(archive, "r") as zip_ref:
+            zip_ref.extractall(download_dir)
+    elif name.endswith(".tar") or name.endswith(".tar.gz") or name.endswith(".tgz"):
+        mode = "r:" if name.endswith(".tar") else "r:gz"
+        with tarfile.open(archive, mode) as tar:
+            tar.extractall(download_dir)
+
+
+def place_cached_download(cached, name, download_dir, expand_archive=True):
+    """
+    Method to extract or copy a cached download. The files are staged and only
+    moved to download_dir once the blob was read completely. A corrupt blob or
+    one evicted by another worker since the lookup is dropped from the cache.
+    :param cached: Cache entry from download.lookup
+    :param name: File name of the download
+    :param download_dir: Directory to save or extract to
+    :param expand_archive: Boolean to extract archives
+    :return: True if the download was placed. False if it has to be downloaded
+    """
+    staging_dir = tempfile.mkdtemp(prefix=".cpggen-download-", dir=download_dir)
+    try:
+        # Files such as jars are placed as they are like fresh downloads
+        if expand_archive and name.endswith(download_archive_extensions):
+            expand_download(cached["blob"], name, staging_dir)
+        else:
+            shutil.copyfile(cached["blob"], os.path.join(staging_dir, name))
+        move_tree(staging_dir, download_dir)
+    except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+        LOG.warning("Unable to use the cached download of %s: %s", cached["url"], e)
+        download.discard(cached["url"])
+        return False
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return True
+
+
 def download_package_unsafe(purl_str, download_dir, expand_archive=True):
-    """Method to download the package from the given purl or CVE id"""
+    """Method to download the package from the given purl or CVE id.
+    Downloads are served from the download cache when possible and the
+    packages of a CVE are downloaded concurrently"""
     if not purl_str:
         return
     durl = get_download_url(purl_str)
@@ -517,36 +1999,55 @@ def download_package_unsafe(purl_str, download_dir, expand_archive=True):
         return
     if isinstance(durl, str):
         durl = [durl]
+    names = {}
     for aurl in durl:
         if isinstance(aurl, dict) and aurl.get("purl"):
             aurl = get_download_url(aurl.get("purl"))
-        with open(
-            os.path.join(download_dir, os.path.basename(aurl)), mode="wb"
-        ) as download_file:
-            with httpx.stream("GET", aurl, follow_redirects=True) as response:
-                total = int(response.headers["Content-Length"])
-                with Progress(
-                    "[progress.percentage]{task.percentage:>3.0f}%",
-                    rich.progress.BarColumn(bar_width=None),
-                    rich.progress.DownloadColumn(),
-                    rich.progress.TransferSpeedColumn(),
-                ) as progress:
-                    download_task = progress.add_task("Download", total=total)
-                    for chunk in response.iter_bytes():
-                        download_file.write(chunk)
-                        progress.update(
-                            download_task, completed=response.num_bytes_downloaded
-                        )
-            download_file.close()
-            if expand_archive:
-                if download_file.name.endswith(".zip"):
-                    unzip_unsafe(download_file.name, download_dir)
-                elif (
-                    download_file.name.endswith(".tar")
-                    or download_file.name.endswith(".tar.gz")
-                    or download_file.name.endswith(".tgz")
-                ):
-                    untar_unsafe(download_file.name, download_dir)
+        # A CVE often lists the same package for several version ranges
+        if not isinstance(aurl, str) or aurl in names:
+            continue
+        name = os.path.basename(aurl)
+        if name in names.values():
+            name = f"{len(names)}-{name}"
+        names[aurl] = name
+    missing = []
+    for aurl, name in names.items():
+        cached = download.lookup(aurl)
+        if cached:
+            LOG.debug("Using the cached download of %s", aurl)
+        if not cached or not place_cached_download(
+            cached, name, download_dir, expand_archive
+        ):
+            missing.append(aurl)
+
+    checksums = get_published_checksums(missing)
+    pending = [
+        download.open_transfer(aurl, names[aurl], checksums[aurl]) for aurl in missing
+    ]
+
+    def consume(transfer, chunks):
+        return stream_download(transfer, chunks, download_dir, expand_archive)
+
+    if len(pending) == 1:
+        transfer = pending[0]
+        chunks = iter_url(transfer)
+        try:
+            consume(transfer, chunks)
+        except (
+            httpx.HTTPError,
+            OSError,
+            ValueError,
+            tarfile.TarError,
+            zipfile.BadZipFile,
+        ) as e:
+            download.close_transfer(transfer, e)
+            LOG.warning("Unable to download %s: %s", transfer["url"], e)
+        else:
+            download.close_transfer(transfer)
+        finally:
+            chunks.close()
+    elif pending:
+        download.fetch_all(pending, consume)
     return download_dir
 
 
@@ -584,3 +2085,14 @@ def get_boolean_attr(name, src1, src2, default_ret=False):
         if src_to_use.get(name) in ("True", "true", "1"):
             return True
     return default_ret
+
+
+def get_int_attr(name, src1, src2, default_ret=0):
+    """Method to retrieve integer attributes from two different dict like objects"""
+    for src_to_use in (src1, src2):
+        if src_to_use and src_to_use.get(name) not in (None, ""):
+            try:
+                return int(src_to_use.get(name))
+            except (TypeError, ValueError):
+                return default_ret
+    return default_ret
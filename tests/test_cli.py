@@ -0,0 +1,58 @@
+import os
+
+from cpggen import cli, utils
+
+
+def write_file(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w", encoding="utf-8") as fp:
+        fp.write(content)
+
+
+# Test that small languages are skipped or generated through the cheap path
+def test_plan_languages(tmp_path, monkeypatch):
+    monkeypatch.setenv("CPGGEN_NO_CACHE", "true")
+    utils.clear_inventory_cache()
+    src = str(tmp_path / "app")
+    write_file(os.path.join(src, "tool.py"), "print(1)\n")
+    for name in ("a", "b", "c"):
+        write_file(os.path.join(src, "web", f"{name}.js"), "console.log(1);\n")
+    write_file(os.path.join(src, "web", "package.json"), "{}")
+    languages, _, _ = cli.plan_languages(src, None, min_files=2)
+    assert "python" not in languages
+    languages, stats, estimates = cli.plan_languages(
+        src, None, min_files=2, small_languages="cheap"
+    )
+    assert "python" in languages
+    assert stats["python"]["cheap"]
+    jobs = cli.plan_jobs(src, str(tmp_path / "out"), languages, stats, estimates)
+    python_job = next(job for job in jobs if job["tool_lang"] == "python")
+    assert python_job["extra_args"]["skip_build"]
+    assert python_job["extra_args"]["job_memory"].endswith("M")
+    js_job = next(job for job in jobs if job["tool_lang"] == "js")
+    assert "skip_build" not in js_job["extra_args"]
+    # Explicit languages skip the statistics unless they are needed
+    languages, stats, estimates = cli.plan_languages(src, "python,js")
+    assert languages == ["python", "js"]
+    assert stats == {}
+    assert set(estimates) == {"python", "js"}
+    _, stats, _ = cli.plan_languages(src, "python", need_stats=True)
+    assert stats["python"]["files"] == 1
+    monkeypatch.setenv("CPGGEN_MIN_FILES", "many")
+    assert utils.get_int_attr("CPGGEN_MIN_FILES", os.environ, None) == 0
+
+
+# Test that js workspaces are only split on request
+def test_split_workspaces(tmp_path, monkeypatch):
+    monkeypatch.setenv("CPGGEN_NO_CACHE", "true")
+    utils.clear_inventory_cache()
+    src = str(tmp_path / "web")
+    write_file(os.path.join(src, "package.json"), '{"workspaces": ["packages/*"]}')
+    for name in ("ui", "api"):
+        pkg = os.path.join(src, "packages", name)
+        write_file(os.path.join(pkg, "package.json"), "{}")
+        write_file(os.path.join(pkg, "index.js"), "let a;\n")
+    out_dir = str(tmp_path / "out")
+    assert len(cli.plan_jobs(src, out_dir, ["js"], {}, {})) == 1
+    jobs = cli.plan_jobs(src, out_dir, ["js"], {}, {}, split_workspaces=True)
+    assert sorted(job["extra_args"]["workspace"] for job in jobs) == ["api", "ui"]
@@ -0,0 +1,119 @@
+import json
+import os
+import zipfile
+
+from cpggen import corpus
+
+
+def write_jar(path, classes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, content in classes.items():
+            zf.writestr(name, b"\xca\xfe\xba\xbe" + content)
+
+
+# Test that duplicates and shaded copies of jars are analyzed once
+def test_plan_jar_corpus(tmp_path, monkeypatch):
+    src = str(tmp_path / "jars")
+    util = {"com/util/A.class": b"a" * 100, "com/util/B.class": b"b" * 100}
+    write_jar(os.path.join(src, "util-1.0.jar"), util)
+    write_jar(os.path.join(src, "copy", "util-1.0.jar"), util)
+    write_jar(
+        os.path.join(src, "app-all.jar"),
+        {**util, "com/app/Main.class": b"m" * 5000},
+    )
+    write_jar(os.path.join(src, "log.jar"), {"com/log/L.class": b"l" * 100})
+    write_jar(os.path.join(src, "json.jar"), {"com/json/J.class": b"j" * 100})
+    jobs, skipped = corpus.plan_jar_corpus(src)
+    assert {(os.path.basename(s["file"]), s["reason"]) for s in skipped} == {
+        ("util-1.0.jar", "shaded"),
+        ("util-1.0.jar", "duplicate"),
+    }
+    assert [len(job["files"]) for job in jobs] == [3]
+    monkeypatch.setattr(corpus, "CORPUS_BATCH_BYTES", 500)
+    jobs, _ = corpus.plan_jar_corpus(src)
+    assert [len(job["files"]) for job in jobs] == [1, 2]
+    assert jobs[0]["src"] == os.path.join(src, "app-all.jar")
+    assert jobs[0]["extra_args"]["module_name"].startswith("app-all-")
+    assert jobs[1]["src"] is None
+    corpus.prepare_job(jobs[1])
+    assert sorted(os.listdir(jobs[1]["src"])) == ["json.jar", "log.jar"]
+    corpus.cleanup_job(jobs[1])
+    assert not os.path.exists(jobs[1]["src"])
+    workers, heap_mb = corpus.get_corpus_workers(jobs, memory_mb=8192, cpus=8)
+    assert workers == 2
+    assert heap_mb == 4096
+    assert corpus.get_corpus_workers(jobs, memory_mb=1024, cpus=8)[0] == 1
+
+
+# Test that every distinct executable in a directory gets its own job
+def test_plan_binary_corpus(tmp_path, monkeypatch):
+    src = str(tmp_path / "firmware")
+    os.makedirs(os.path.join(src, "bin"))
+    os.makedirs(os.path.join(src, "usr", "bin"))
+    for path, content in (
+        (os.path.join("bin", "busybox"), b"\x7fELF" + b"b" * 2000),
+        (os.path.join("usr", "bin", "busybox"), b"\x7fELF" + b"b" * 2000),
+        (os.path.join("bin", "httpd"), b"\x7fELF" + b"h" * 1000),
+        ("README", b"not a binary"),
+    ):
+        with open(os.path.join(src, path), mode="wb") as fp:
+            fp.write(content)
+    write_jar(os.path.join(src, "lib", "app.jar"), {"com/app/A.class": b"a"})
+    jobs, skipped = corpus.plan_binary_corpus(src)
+    assert [job["extra_args"]["module_name"].split("-")[0] for job in jobs] == [
+        "busybox",
+        "httpd",
+    ]
+    assert jobs[0]["tool_lang"] == "binary"
+    assert jobs[0]["src"] == os.path.join(src, "bin", "busybox")
+    assert skipped == [
+        {
+            "file": os.path.join(src, "usr", "bin", "busybox"),
+            "reason": "duplicate",
+            "of": os.path.join(src, "bin", "busybox"),
+        }
+    ]
+    jobs, _ = corpus.plan_corpus(src)
+    assert sorted(job["tool_lang"] for job in jobs) == ["binary", "binary", "jimple"]
+    jobs, _ = corpus.plan_corpus(src, ["binary"])
+    assert len(jobs) == 2
+    assert corpus.get_job_timeout(jobs[0]) == corpus.CORPUS_MIN_TIMEOUT
+    monkeypatch.setattr(corpus, "CORPUS_TIMEOUT", 30)
+    assert corpus.get_job_timeout(jobs[0]) == 30
+
+
+# Test that the cpg of unchanged jars is reused from the cache
+def test_corpus_cache(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    cpg_out_dir = str(tmp_path / "cpg_out")
+    os.makedirs(cpg_out_dir)
+    job = {"key": "abc123", "tool_lang": "jimple"}
+    frontend = {"frontend": "cpg", "command": "jimple2cpg", "stamp": [1, 2]}
+    job["cache_key"] = corpus.get_cache_key(job, frontend, {"slice_mode": "usages"})
+    assert corpus.restore_cached(job, cpg_out_dir, cache_dir) is None
+    cpg = os.path.join(cpg_out_dir, "app-abc-jimple.cpg.bin")
+    with open(cpg, mode="w", encoding="utf-8") as fp:
+        fp.write("cpg")
+    corpus.store_cached(job, {"cpg": cpg, "app": "app-abc-jimple"}, cache_dir)
+    os.remove(cpg)
+    manifest = corpus.restore_cached(job, cpg_out_dir, cache_dir)
+    assert manifest["cached"]
+    assert manifest["cpg"] == cpg
+    # A different frontend, version or option does not reuse the cpg
+    for changed_frontend, options in (
+        ({**frontend, "frontend": "atom"}, {"slice_mode": "usages"}),
+        ({**frontend, "stamp": [1, 3]}, {"slice_mode": "usages"}),
+        (frontend, {"slice_mode": "reachables"}),
+    ):
+        other = {
+            **job,
+            "cache_key": corpus.get_cache_key(job, changed_frontend, options),
+        }
+        assert corpus.restore_cached(other, cpg_out_dir, cache_dir) is None
+    with open(cpg, encoding="utf-8") as fp:
+        assert fp.read() == "cpg"
+    with open(
+        os.path.join(cpg_out_dir, "app-abc-jimple.manifest.json"), encoding="utf-8"
+    ) as fp:
+        assert json.load(fp)["app"] == "app-abc-jimple"
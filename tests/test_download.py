@@ -0,0 +1,333 @@
+import functools
+import hashlib
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from http.server import (
+    BaseHTTPRequestHandler,
+    SimpleHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+
+import httpx
+import pytest
+
+from cpggen import download, utils
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="wb") as fp:
+        fp.write(content)
+
+
+# Test that downloads are stored by checksum and evicted least recently used first
+def test_download_cache(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    assert download.lookup("https://example.com/a.jar", cache_dir) is None
+    afile = str(tmp_path / "a.jar")
+    write_file(afile, b"a" * 100)
+    entry = download.store("https://example.com/a.jar", afile, cache_dir)
+    assert entry["name"] == "a.jar"
+    assert os.path.basename(entry["blob"]) == entry["checksum"]
+    # The same content from another url shares the blob
+    mirror = download.store("https://mirror.com/a.jar", afile, cache_dir)
+    assert mirror["blob"] == entry["blob"]
+    hit = download.lookup("https://example.com/a.jar", cache_dir)
+    assert hit["size"] == 100
+    assert hit["mtime_ns"] == os.stat(entry["blob"]).st_mtime_ns
+    bfile = str(tmp_path / "b.jar")
+    write_file(bfile, b"b" * 100)
+    download.store("https://example.com/b.jar", bfile, cache_dir)
+    old = time.time() - 60
+    os.utime(entry["blob"], (old, old))
+    # a.jar was used less recently than b.jar
+    removed = download.evict(cache_dir, quota=150)
+    assert removed == [entry["blob"]]
+    assert download.lookup("https://example.com/a.jar", cache_dir) is None
+    assert download.lookup("https://example.com/b.jar", cache_dir)
+    # Blobs changed after they were verified are dropped
+    c_entry = download.store("https://example.com/c.jar", afile, cache_dir)
+    write_file(c_entry["blob"], b"c" * 100)
+    os.utime(c_entry["blob"], ns=(0, c_entry["mtime_ns"] + 1))
+    assert download.lookup("https://example.com/c.jar", cache_dir) is None
+    assert not os.path.exists(c_entry["blob"])
+
+
+# Test that a repeated download is extracted from the cache without the network
+def test_download_package_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "DOWNLOAD_CACHE_DIR", str(tmp_path / "cache"))
+    url = "https://example.com/pkg-1.0.zip"
+    monkeypatch.setattr(utils, "get_download_url", lambda purl: url)
+    fetched = []
+
+    def iter_url(transfer):
+        fetched.append(transfer["url"])
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            zf.writestr("pkg/main.py", "print(1)\n")
+        download.write_blob(transfer["blob"], buffer.getvalue())
+        yield buffer.getvalue()
+
+    monkeypatch.setattr(utils, "iter_url", iter_url)
+    for i in range(2):
+        download_dir = str(tmp_path / f"run{i}")
+        os.makedirs(download_dir)
+        utils.download_package_unsafe("pkg:pypi/pkg@1.0", download_dir)
+        assert os.path.exists(os.path.join(download_dir, "pkg", "main.py"))
+    assert fetched == [url]
+    download_dir = str(tmp_path / "raw")
+    os.makedirs(download_dir)
+    utils.download_package_unsafe("pkg:pypi/pkg@1.0", download_dir, False)
+    assert os.listdir(download_dir) == ["pkg-1.0.zip"]
+    assert fetched == [url]
+    # Cached files that are not archives are placed as they are
+    url = "https://example.com/lib-1.0.jar"
+    for i in range(2):
+        download_dir = str(tmp_path / f"jar{i}")
+        os.makedirs(download_dir)
+        utils.download_package_unsafe("pkg:maven/org/lib@1.0", download_dir)
+        assert os.listdir(download_dir) == ["lib-1.0.jar"]
+    assert fetched == [fetched[0], url]
+    # A corrupt blob is dropped and downloaded again
+    jar_url, url = url, fetched[0]
+    cached = download.lookup(url)
+    with open(cached["blob"], mode="r+b") as fp:
+        fp.write(b"x" * cached["size"])
+    os.utime(cached["blob"], ns=(0, cached["mtime_ns"]))
+    download_dir = str(tmp_path / "corrupt")
+    os.makedirs(download_dir)
+    utils.download_package_unsafe("pkg:pypi/pkg@1.0", download_dir)
+    assert os.listdir(download_dir) == ["pkg"]
+    assert fetched == [url, jar_url, url]
+    # A blob evicted after the lookup is downloaded again
+    lookup = download.lookup
+    monkeypatch.setattr(
+        download, "lookup", lambda u: {**lookup(u), "blob": str(tmp_path / "gone")}
+    )
+    download_dir = str(tmp_path / "evicted")
+    os.makedirs(download_dir)
+    utils.download_package_unsafe("pkg:pypi/pkg@1.0", download_dir)
+    assert os.listdir(download_dir) == ["pkg"]
+    assert fetched == [url, jar_url, url, url]
+
+
+# Test that the packages of a CVE are downloaded concurrently and only once
+def test_download_package_concurrent(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "DOWNLOAD_CACHE_DIR", str(tmp_path / "cache"))
+    served = str(tmp_path / "served")
+    os.makedirs(served)
+    for name in ("a", "b"):
+        with zipfile.ZipFile(os.path.join(served, f"{name}.zip"), "w") as zf:
+            zf.writestr(f"{name}/main.py", "print(1)\n")
+    requested = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(Handler, directory=served)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/a.zip", f"{base}/b.zip", f"{base}/a.zip", f"{base}/missing.zip"]
+    monkeypatch.setattr(utils, "get_download_url", lambda purl: urls)
+    try:
+        download_dir = str(tmp_path / "out")
+        os.makedirs(download_dir)
+        utils.download_package_unsafe("CVE-2023-0001", download_dir)
+        assert os.path.exists(os.path.join(download_dir, "a", "main.py"))
+        assert os.path.exists(os.path.join(download_dir, "b", "main.py"))
+        assert sorted(requested) == ["/a.zip", "/b.zip", "/missing.zip"]
+        assert download.lookup(f"{base}/b.zip")
+        assert download.lookup(f"{base}/missing.zip") is None
+        # The second run only retries the download that failed
+        utils.download_package_unsafe("CVE-2023-0001", str(tmp_path))
+        assert len(requested) == 4
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Test that the published checksums of a CVE are fetched at the same time
+def test_published_checksums(monkeypatch):
+    urls = [f"https://repo1.maven.org/maven2/{name}.jar" for name in "abc"]
+    barrier = threading.Barrier(len(urls), timeout=5)
+
+    def get_published_checksum(url):
+        barrier.wait()
+        return "sha1", url[-5]
+
+    monkeypatch.setattr(utils, "get_published_checksum", get_published_checksum)
+    assert utils.get_published_checksums(urls) == {
+        url: ("sha1", url[-5]) for url in urls
+    }
+
+
+# Test that the consumer of a download is released when the download fails
+# with an unexpected error
+def test_fetch_all_unexpected_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "DOWNLOAD_CACHE_DIR", str(tmp_path / "cache"))
+
+    async def fetch_transfer_async(client, transfer, chunks, progress=None):
+        for _ in range(download.QUEUE_CHUNKS):
+            await chunks.put(b"chunk")
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(download, "fetch_transfer_async", fetch_transfer_async)
+    errors = []
+
+    def consume(transfer, chunks):
+        # The queue fills up before the chunks are read
+        time.sleep(0.1)
+        return list(chunks)
+
+    def run():
+        try:
+            download.fetch_all([transfer], consume)
+        except RuntimeError as e:
+            errors.append(e)
+
+    transfer = download.open_transfer("http://127.0.0.1:1/a.zip", "a.zip")
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    runner.join(10)
+    assert not runner.is_alive()
+    assert str(errors[0]) == "unexpected"
+
+
+# Test that archives are extracted from the stream without saving them first
+def test_stream_download(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "DOWNLOAD_CACHE_DIR", str(tmp_path / "cache"))
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        content = b"print(1)\n" * 10000
+        info = tarfile.TarInfo("pkg-1.0/setup.py")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    tgz = buffer.getvalue()
+
+    class Handler(BaseHTTPRequestHandler):
+        # Stream the body without a Content-Length until the connection closes
+        def do_GET(self):
+            self.send_response(200)
+            self.end_headers()
+            for i in range(0, len(tgz), 1000):
+                self.wfile.write(tgz[i : i + 1000])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/pkg-1.0.tar.gz"
+    try:
+        download_dir = str(tmp_path / "out")
+        os.makedirs(download_dir)
+        transfer = download.open_transfer(url, "pkg-1.0.tar.gz")
+        utils.stream_download(transfer, utils.iter_url(transfer), download_dir)
+        download.close_transfer(transfer)
+        assert os.listdir(download_dir) == ["pkg-1.0"]
+        with open(os.path.join(download_dir, "pkg-1.0", "setup.py"), "rb") as fp:
+            assert fp.read() == content
+        assert download.lookup(url)["size"] == len(tgz)
+        # A download that does not match the published checksum is dropped
+        bad_url = f"{url}?bad"
+        transfer = download.open_transfer(bad_url, "pkg-1.0.tar.gz", ("sha1", "0"))
+        bad_dir = str(tmp_path / "bad")
+        os.makedirs(bad_dir)
+        with pytest.raises(ValueError):
+            utils.stream_download(transfer, utils.iter_url(transfer), bad_dir)
+        download.close_transfer(transfer, ValueError())
+        assert os.listdir(bad_dir) == []
+        assert download.lookup(bad_url) is None
+        assert os.listdir(os.path.join(str(tmp_path / "cache"), "tmp")) == []
+    finally:
+        server.shutdown()
+        server.server_close()
+    # Zips are spooled when there is no cache to extract from
+    monkeypatch.setenv("CPGGEN_NO_CACHE", "true")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("lib/main.go", "package main\n")
+    data = buffer.getvalue()
+    download_dir = str(tmp_path / "zip")
+    os.makedirs(download_dir)
+    chunks = [data[i : i + 10] for i in range(0, len(data), 10)]
+    transfer = download.open_transfer("https://example.com/lib.zip", "lib.zip")
+    assert transfer["blob"] is None
+    utils.stream_download(transfer, chunks, download_dir)
+    assert os.listdir(download_dir) == ["lib"]
+
+
+# Test that an interrupted download is resumed with a range request
+def test_resume_download(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "DOWNLOAD_CACHE_DIR", str(tmp_path / "cache"))
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        content = os.urandom(200000)
+        info = tarfile.TarInfo("pkg-1.0/data.bin")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    tgz = buffer.getvalue()
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        # The first response is cut off halfway
+        def do_GET(self):
+            requests.append(self.headers.get("Range"))
+            start = 0
+            if self.headers.get("Range") and self.headers.get("If-Range") == '"v1"':
+                start = int(self.headers["Range"][len("bytes=") : -1])
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(tgz) - 1}/{len(tgz)}"
+                )
+            else:
+                self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(tgz) - start))
+            self.end_headers()
+            end = len(tgz) // 2 if len(requests) == 1 else len(tgz)
+            self.wfile.write(tgz[start:end])
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/pkg-1.0.tar.gz"
+    checksum = ("sha256", hashlib.sha256(tgz).hexdigest())
+    download_dir = str(tmp_path / "out")
+    os.makedirs(download_dir)
+    try:
+        # The partial file is kept when the retries are exhausted
+        monkeypatch.setattr(download, "DOWNLOAD_RETRIES", 0)
+        transfer = download.open_transfer(url, "pkg-1.0.tar.gz", checksum)
+        with pytest.raises(httpx.TransportError) as error:
+            utils.stream_download(transfer, utils.iter_url(transfer), download_dir)
+        download.close_transfer(transfer, error.value)
+        assert os.listdir(download_dir) == []
+        assert download.lookup(url) is None
+        # The next run only requests the missing bytes
+        transfer = download.open_transfer(url, "pkg-1.0.tar.gz", checksum)
+        assert transfer["blob"]["partial"] == len(tgz) // 2
+        utils.stream_download(transfer, utils.iter_url(transfer), download_dir)
+        download.close_transfer(transfer)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert requests == [None, f"bytes={len(tgz) // 2}-"]
+    with open(os.path.join(download_dir, "pkg-1.0", "data.bin"), "rb") as fp:
+        assert fp.read() == content
+    assert download.lookup(url)["checksums"] == {"sha256": checksum[1]}
+    assert os.listdir(os.path.join(str(tmp_path / "cache"), "tmp")) == []
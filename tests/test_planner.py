@@ -0,0 +1,315 @@
+import json
+import os
+
+from cpggen import planner, utils
+
+
+def write_file(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w", encoding="utf-8") as fp:
+        fp.write(content)
+
+
+# Test the bulk line counter
+def test_count_lines(tmp_path, monkeypatch):
+    afile = str(tmp_path / "a.py")
+    write_file(afile, "a\nb\nc")
+    assert planner.count_lines(afile) == 3
+    write_file(afile, "a\nb\n")
+    assert planner.count_lines(afile) == 2
+    write_file(afile, "")
+    assert planner.count_lines(afile) == 0
+    assert planner.count_lines(str(tmp_path / "missing.py")) == 0
+    monkeypatch.setattr(planner, "LINE_COUNT_CHUNK_SIZE", 4)
+    write_file(afile, "line\n" * 10 + "tail")
+    assert planner.count_lines(afile) == 11
+
+
+# Test the code statistics and the cost model
+def test_code_stats_and_estimates(tmp_path):
+    src = str(tmp_path / "app")
+    for i in range(5):
+        write_file(os.path.join(src, f"mod{i}.py"), "x = 1\n" * 10000)
+    write_file(os.path.join(src, "index.js"), "let a;\n")
+    stats = planner.get_code_stats(src, ["python", "js"], count_loc=True)
+    assert stats["python"] == {"files": 5, "bytes": 300000, "lines": 50000}
+    assert stats["js"]["lines"] == 1
+    assert "lines" not in planner.get_code_stats(src, ["js"])["js"]
+    # Statistics computed during detection are reused
+    reused = planner.get_code_stats(src, ["js"], stats={"js": {"files": 7}})
+    assert reused == {"js": {"files": 7}}
+    estimates = planner.estimate_costs(["js", "python"], stats)
+    assert estimates["python"]["seconds"] > estimates["js"]["seconds"]
+    assert estimates["python"]["heap_mb"] > 0
+    assert planner.order_by_cost(["js", "python"], estimates)[0] == "python"
+    small = planner.estimate_cost("java-with-deps", {"bytes": 1000, "lines": 10})
+    big = planner.estimate_cost("java-with-deps", {"bytes": 10**8, "lines": 10**6})
+    assert big["seconds"] > small["seconds"]
+    assert big["heap_mb"] > small["heap_mb"]
+    assert planner.estimate_cost("jar", {"bytes": 10 * 1024 * 1024})["heap_mb"] > (
+        planner.estimate_cost("jar", {"bytes": 0})["heap_mb"]
+    )
+
+
+# Test that a cost model file only overrides the keys it sets
+def test_load_cost_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        planner,
+        "frontend_cost_model",
+        {k: dict(v) for k, v in planner.frontend_cost_model.items()},
+    )
+    model_file = str(tmp_path / "model.json")
+    write_file(
+        model_file,
+        json.dumps(
+            {"python": {"startup_seconds": 99}, "java-with-deps": {"base_heap_mb": 1}}
+        ),
+    )
+    defaults = dict(planner.frontend_cost_model["java"])
+    planner.load_cost_model(model_file)
+    assert planner.frontend_cost_model["python"]["startup_seconds"] == 99
+    assert planner.estimate_cost("python", {"bytes": 100})["seconds"] >= 99
+    assert planner.get_cost_model("java-with-deps") == {
+        **defaults,
+        "base_heap_mb": 1,
+    }
+    write_file(model_file, "[]")
+    planner.load_cost_model(model_file)
+    assert planner.frontend_cost_model["python"]["startup_seconds"] == 99
+
+
+# Test the module graph of a monorepo and the per-module jobs
+def test_module_graph(tmp_path):
+    src = str(tmp_path / "mono")
+    write_file(os.path.join(src, "package.json"), "{}")
+    write_file(os.path.join(src, "services", "api", "package.json"), "{}")
+    write_file(os.path.join(src, "services", "api", "index.js"), "let a;\n" * 100)
+    write_file(os.path.join(src, "services", "web", "package.json"), "{}")
+    write_file(os.path.join(src, "services", "web", "app.js"), "let b;\n")
+    write_file(os.path.join(src, "services", "web", "lib", "util.js"), "let c;\n")
+    write_file(os.path.join(src, "tools", "pyproject.toml"), "")
+    write_file(os.path.join(src, "tools", "cli.py"), "print(1)\n")
+    graph = planner.find_modules(src)
+    modules = {m["path"]: m for m in graph["modules"]}
+    assert sorted(modules) == [
+        ".",
+        os.path.join("services", "api"),
+        os.path.join("services", "web"),
+        "tools",
+    ]
+    assert modules["."]["children"] == sorted(modules)[1:]
+    assert modules["tools"]["types"] == ["python"]
+    assert modules[os.path.join("services", "api")]["parent"] == "."
+    jobs = planner.get_module_jobs(graph, "js")
+    assert [j["path"] for j in jobs] == [
+        os.path.join("services", "api"),
+        os.path.join("services", "web"),
+    ]
+    assert jobs[1]["files"] == 2
+    # A single python module is not worth splitting
+    assert planner.get_module_jobs(graph, "python") == []
+    assert planner.get_module_jobs(graph, "binary") == []
+    jobs, graph = planner.plan_jobs(src, ["js"], {}, {}, split_modules=True)
+    assert jobs[0]["src"] == os.path.join(src, "services", "api")
+    assert jobs[0]["extra_args"]["module_name"] == "mono-services-api"
+    assert jobs[0]["extra_args"]["cost_estimate"]["seconds"] > 0
+    assert planner.plan_jobs(src, ["js"], {}, {})[1] is None
+    # Files owned by the root module prevent the split
+    write_file(os.path.join(src, "index.js"), "let d;\n")
+    utils.clear_inventory_cache()
+    jobs, graph = planner.plan_jobs(src, ["js", "python"], {}, {}, split_modules=True)
+    assert [j["src"] for j in jobs] == [src, src]
+
+
+# Test the shard count and the size-balanced split of a large module
+def test_shards(tmp_path, monkeypatch):
+    src = str(tmp_path / "big")
+    for d in ("core", "net", "ui"):
+        for i in range(4):
+            write_file(os.path.join(src, d, f"f{i}.c"), "int a;\n" * 1000)
+    write_file(os.path.join(src, "include", "api.h"), "int api();\n")
+    write_file(os.path.join(src, "Makefile"), "all:\n")
+    estimate = {"seconds": 60, "heap_mb": 3000}
+    assert planner.get_shard_count("c", estimate, memory_mb=8000, cpus=8) == 1
+    assert planner.get_shard_count("c", estimate, memory_mb=2000, cpus=8) == 3
+    estimate = {"seconds": 3600, "heap_mb": 3000}
+    assert planner.get_shard_count("c", estimate, memory_mb=8000, cpus=4) == 4
+    assert planner.get_shard_count("c", estimate, memory_mb=5000, cpus=4) == 2
+    files = utils.get_project_type_files(src, "c")
+    files = [f for f in files if f.endswith(".c")]
+    shards = planner.split_shards(src, files, [7000] * len(files), 3)
+    assert [
+        sorted({os.path.basename(os.path.dirname(f)) for f in s}) for s in shards
+    ] == [
+        ["core"],
+        ["net"],
+        ["ui"],
+    ]
+    shards = planner.split_shards(src, files, [7000] * len(files), 2)
+    assert [len(s) for s in shards] == [6, 6]
+    job = {"tool_lang": "c", "src": src, "extra_args": {"cost_estimate": estimate}}
+    monkeypatch.setenv("CPGGEN_MEMORY", "2G")
+    jobs = planner.shard_job(job, 3)
+    assert len(jobs) == 3
+    shard = jobs[1]["extra_args"]
+    assert shard["shard"] == {"index": 1, "count": 3, "files": 4, "bytes": 28000}
+    assert shard["module_name"] == "big-shard2"
+    # Each shard gets the headers and a heap sized for its own files
+    assert os.path.join(src, "include", "api.h") in shard["shard_files"]
+    assert os.path.join(src, "Makefile") not in shard["shard_files"]
+    assert os.path.join(src, "core", "f0.c") not in shard["shard_files"]
+    assert shard["job_memory"] == f"{shard['cost_estimate']['heap_mb']}M"
+    assert planner.get_job_memory({"seconds": 60, "heap_mb": 3000}) == "2048M"
+    stats = {"c": {"files": 12, "bytes": 84000, "lines": 10**6}}
+    estimates = planner.estimate_costs(["c"], stats)
+    jobs, _ = planner.plan_jobs(src, ["c"], stats, estimates, shard=True)
+    assert len(jobs) > 1
+    assert planner.plan_jobs(src, ["c"], stats, estimates)[0][0]["src"] == src
+
+
+# Test that c jobs are limited to the translation units of a compilation database
+def test_compile_commands(tmp_path, monkeypatch):
+    src = str(tmp_path / "native")
+    build = os.path.join(src, "build")
+    for name in ("core/a.c", "core/b.c", "net/c.c", "unused/d.c"):
+        write_file(os.path.join(src, name), "int a;\n" * 100)
+    write_file(os.path.join(src, "include", "api.h"), "int api();\n")
+    write_file(os.path.join(src, "README.md"), "native")
+    entries = [
+        {
+            "directory": build,
+            "file": "../core/a.c",
+            "command": "cc -I../include -DDEBUG=1 -c ../core/a.c",
+        },
+        {
+            "directory": build,
+            "file": os.path.join(src, "core", "b.c"),
+            "arguments": ["cc", "-I", "../include", "-isystem", "/opt/sdk", "-c"],
+        },
+        {
+            "directory": build,
+            "file": "../net/c.c",
+            "command": "cc -I../include -DNET -DDEBUG=1 -c ../net/c.c",
+        },
+        {"directory": "/usr/src", "file": "other.c", "command": "cc -c other.c"},
+    ]
+    write_file(os.path.join(build, "compile_commands.json"), json.dumps(entries))
+    db_file = planner.find_compile_commands(src)
+    assert db_file == os.path.join(build, "compile_commands.json")
+    units = planner.load_compile_commands(db_file, src)
+    assert [os.path.relpath(u["file"], src) for u in units] == [
+        os.path.join("core", "a.c"),
+        os.path.join("core", "b.c"),
+        os.path.join("net", "c.c"),
+    ]
+    assert units[1]["includes"] == [os.path.join(src, "include"), "/opt/sdk"]
+    assert planner.get_compile_args(units, src) == {
+        "includes": ["include", "/opt/sdk"],
+        "defines": ["DEBUG=1", "NET"],
+    }
+    jobs, _ = planner.plan_jobs(src, ["c-with-deps"], {}, {})
+    assert len(jobs) == 1
+    assert jobs[0]["tool_lang"] == "c-with-compile-commands"
+    shard_files = jobs[0]["extra_args"]["shard_files"]
+    assert os.path.join(src, "unused", "d.c") not in shard_files
+    assert os.path.join(src, "include", "api.h") in shard_files
+    assert planner.format_compile_args(
+        jobs[0]["extra_args"]["compile_commands"], "/my view"
+    ) == [
+        "--include",
+        "/my view/include",
+        "--include",
+        "/opt/sdk",
+        "--define",
+        "DEBUG=1",
+        "--define",
+        "NET",
+    ]
+    assert planner.format_compile_args(None, "/my view") == []
+    assert planner.get_frontend_args("c", jobs[0]["extra_args"], "/my view") == []
+    assert planner.get_frontend_args("atom", jobs[0]["extra_args"], "/my view") == []
+    assert planner.get_frontend_args(
+        "c-with-compile-commands", jobs[0]["extra_args"], "/my view"
+    ) == planner.format_compile_args(
+        jobs[0]["extra_args"]["compile_commands"], "/my view"
+    )
+    # Include directories missing from a view point to the original source
+    view = str(tmp_path / "view")
+    os.makedirs(os.path.join(view, "include"))
+    assert planner.format_compile_args(
+        {"includes": ["include", "vendor/zlib", "/opt/sdk"], "defines": []},
+        view,
+        src,
+    ) == [
+        "--include",
+        os.path.join(view, "include"),
+        "--include",
+        os.path.join(src, "vendor/zlib"),
+        "--include",
+        "/opt/sdk",
+    ]
+    assert list(planner.get_job_manifest(jobs[0]["extra_args"])) == [
+        "compile_commands",
+        "language_stats",
+        "cost_estimate",
+    ]
+    monkeypatch.setattr(planner, "get_shard_count", lambda *args, **kwargs: 2)
+    jobs, _ = planner.plan_jobs(src, ["c"], {}, {}, shard=True)
+    assert [j["extra_args"]["compile_commands"]["units"] for j in jobs] == [2, 1]
+    assert jobs[0]["extra_args"]["compile_commands"]["defines"] == ["DEBUG=1"]
+    assert jobs[1]["extra_args"]["module_name"] == "native-shard2"
+    monkeypatch.setenv("CPGGEN_COMPILE_COMMANDS", "false")
+    assert planner.plan_jobs(src, ["c"], {}, {})[0][0]["tool_lang"] == "c"
+
+
+# Test that js workspaces are split into one job per package
+def test_workspaces(tmp_path):
+    src = str(tmp_path / "web")
+    write_file(
+        os.path.join(src, "package.json"),
+        json.dumps({"workspaces": {"packages": ["packages/*", "!packages/legacy"]}}),
+    )
+    write_file(os.path.join(src, "pnpm-workspace.yaml"), "packages:\n  - 'apps/**'\n")
+    write_file(os.path.join(src, "jest.config.js"), "module.exports = {};\n")
+    for name, size in (("ui", 400), ("api", 100), ("legacy", 50)):
+        pkg = os.path.join(src, "packages", name)
+        write_file(
+            os.path.join(pkg, "package.json"), json.dumps({"name": f"@w/{name}"})
+        )
+        write_file(os.path.join(pkg, "src", "index.ts"), "let a;\n" * size)
+        write_file(
+            os.path.join(pkg, "node_modules", "dep", "index.js"), "let b;\n" * 1000
+        )
+    write_file(os.path.join(src, "apps", "site", "package.json"), "{}")
+    write_file(os.path.join(src, "apps", "site", "src", "main.js"), "let c;\n")
+    assert planner.read_pnpm_workspace(os.path.join(src, "pnpm-workspace.yaml")) == [
+        "apps/**"
+    ]
+    workspaces = planner.find_workspaces(src)
+    assert [p["path"] for p in workspaces["packages"]] == [
+        os.path.join("apps", "site"),
+        os.path.join("packages", "api"),
+        os.path.join("packages", "ui"),
+    ]
+    assert workspaces["packages"][2]["name"] == "@w/ui"
+    jobs, _ = planner.plan_jobs(src, ["ts"], {}, {}, split_workspaces=True)
+    names = {j["extra_args"]["module_name"]: j for j in jobs}
+    assert sorted(names) == [
+        "web",
+        "web-apps-site",
+        "web-packages-api",
+        "web-packages-ui",
+    ]
+    assert jobs[0]["extra_args"]["workspace"] == "@w/ui"
+    assert jobs[0]["src"] == os.path.join(src, "packages", "ui")
+    # The root job covers the files outside the packages
+    root_files = names["web"]["extra_args"]["shard_files"]
+    assert os.path.join(src, "jest.config.js") in root_files
+    assert os.path.join(src, "packages", "legacy", "src", "index.ts") in root_files
+    assert os.path.join(src, "packages", "ui", "src", "index.ts") not in root_files
+    for job in jobs:
+        assert not any("node_modules" in f for f in job["extra_args"]["shard_files"])
+    assert len(planner.plan_jobs(src, ["ts"], {}, {})[0]) == 1
+    assert (
+        len(planner.plan_jobs(src, ["python"], {}, {}, split_workspaces=True)[0]) == 1
+    )
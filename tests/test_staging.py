@@ -0,0 +1,269 @@
+import json
+import os
+
+from cpggen import staging
+
+
+def write_file(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w", encoding="utf-8") as fp:
+        fp.write(content)
+
+
+# Test that the source view only contains the analyzable files
+def test_source_view(tmp_path, monkeypatch):
+    src = str(tmp_path / "app")
+    write_file(os.path.join(src, "main.py"), "print(1)\n")
+    write_file(os.path.join(src, "pkg", "util.py"), "x = 1\n")
+    write_file(os.path.join(src, "web", "app.min.js"), "")
+    write_file(os.path.join(src, "node_modules", "lib", "index.js"), "")
+    write_file(os.path.join(src, "tests", "test_main.py"), "")
+    write_file(os.path.join(src, "reporting", "views.py"), "")
+    source_view = staging.build_source_view(src, view_dir=str(tmp_path))
+    view = source_view["view"]
+    assert os.path.basename(view) == "app"
+    assert source_view["files"] == 3
+    assert source_view["method"] == "hardlink"
+    assert os.path.exists(os.path.join(view, "pkg", "util.py"))
+    assert os.path.exists(os.path.join(view, "reporting", "views.py"))
+    assert not os.path.exists(os.path.join(view, "node_modules"))
+    assert not os.path.exists(os.path.join(view, "tests"))
+    assert not os.path.exists(os.path.join(view, "web", "app.min.js"))
+    assert staging.map_view_path(
+        os.path.join(view, "pkg", "util.py"), source_view
+    ) == os.path.join(src, "pkg", "util.py")
+    assert staging.map_view_path("/other/file.py", source_view) == "/other/file.py"
+    staging.remove_source_view(source_view)
+    assert not os.path.exists(view)
+    assert os.path.exists(os.path.join(src, "pkg", "util.py"))
+
+    # Symlinks are used when hardlinks are not possible
+    def no_hardlinks(*args):
+        raise OSError("Cross-device link")
+
+    monkeypatch.setattr(os, "link", no_hardlinks)
+    source_view = staging.build_source_view(src, view_dir=str(tmp_path))
+    assert source_view["method"] == "symlink"
+    assert os.path.islink(os.path.join(source_view["view"], "main.py"))
+    staging.remove_source_view(source_view)
+
+    # Files that cannot be placed are reported instead of silently dropped
+    def no_links(src_file, dest_file):
+        if src_file.endswith("util.py"):
+            raise OSError("Permission denied")
+        os.close(os.open(dest_file, os.O_CREAT | os.O_WRONLY))
+
+    monkeypatch.setattr(os, "symlink", no_links)
+    monkeypatch.setattr(staging.shutil, "copy2", no_links)
+    source_view = staging.build_source_view(src, view_dir=str(tmp_path))
+    assert source_view["files"] == 2
+    assert source_view["exclusions"] == [
+        {
+            "file": os.path.join("pkg", "util.py"),
+            "reason": "unlinkable",
+            "detail": "Permission denied",
+        }
+    ]
+    staging.remove_source_view(source_view)
+    assert not staging.use_source_view("python")
+    monkeypatch.setenv("CPGGEN_SOURCE_VIEW", "true")
+    assert staging.use_source_view("python")
+    assert not staging.use_source_view("jimple")
+    assert staging.use_source_view("c-with-compile-commands")
+    assert not staging.use_source_view("java-with-deps")
+    assert not staging.use_source_view("kotlin-with-classpath")
+    monkeypatch.setenv("CPGGEN_SOURCE_VIEW", "false")
+    assert not staging.use_source_view("python")
+
+
+# Test that slices point to the original source once the view is removed
+def test_rewrite_view_paths(tmp_path):
+    src = str(tmp_path / "app")
+    write_file(os.path.join(src, "main.py"), "import os\n")
+    source_view = staging.build_source_view(src, view_dir=str(tmp_path))
+    slice_out = str(tmp_path / "app.slices.json")
+    view_file = os.path.join(source_view["view"], "main.py")
+    write_file(slice_out, json.dumps({"objectSlices": [{"fileName": view_file}]}))
+    assert staging.rewrite_view_paths(slice_out, source_view)
+    staging.remove_source_view(source_view)
+    with open(slice_out, encoding="utf-8") as fp:
+        slices = json.load(fp)
+    assert slices["objectSlices"][0]["fileName"] == os.path.join(src, "main.py")
+    assert not staging.rewrite_view_paths(slice_out, source_view)
+    assert not staging.rewrite_view_paths(slice_out, None)
+
+
+# Test the view of a job and the manifest fields that map it back to the source
+def test_job_view(tmp_path, monkeypatch):
+    monkeypatch.setenv("CPGGEN_SOURCE_VIEW", "true")
+    src = str(tmp_path / "app")
+    write_file(os.path.join(src, "main.py"), "print(1)\n")
+    write_file(os.path.join(src, "pkg", "util.py"), "x = 1\n")
+    write_file(
+        os.path.join(src, "api_pb2.py"),
+        "# Generated by the protocol buffer compiler.  DO NOT EDIT!\n",
+    )
+    assert staging.build_job_view("slice", src, {}) == (None, None)
+    assert staging.get_view_manifest(src) == {}
+    report_file = str(tmp_path / "app.exclusions.json")
+    source_view, exclusion_report = staging.build_job_view(
+        "python", src, {}, report_file
+    )
+    assert source_view["files"] == 2
+    assert exclusion_report == report_file
+    fields = staging.get_view_manifest(src, source_view, None, exclusion_report)
+    assert fields["source_view"]["view"] == source_view["view"]
+    assert "exclusions" not in fields["source_view"]
+    assert fields["exclusion_report"] == report_file
+    staging.remove_source_view(source_view)
+
+
+# Test the heuristics for generated, minified and oversized files
+def test_exclusion_heuristics(tmp_path, monkeypatch):
+    src = str(tmp_path / "web")
+    write_file(os.path.join(src, "index.js"), "let a = 1;\n" * 200)
+    write_file(os.path.join(src, "bundle.js"), "var a=1;" * 500)
+    write_file(
+        os.path.join(src, "api_pb2.py"),
+        "# Generated by the protocol buffer compiler.  DO NOT EDIT!\n",
+    )
+    with open(os.path.join(src, "blob.js"), mode="wb") as fp:
+        for _ in range(40):
+            fp.write(os.urandom(100) + b"\n")
+    write_file(os.path.join(src, "huge.c"), "int a;\n" * 1000)
+    monkeypatch.setattr(staging, "MAX_SOURCE_FILE_BYTES", 5000)
+    reasons = {
+        os.path.basename(f): reason[0]
+        for f, reason in staging.find_excluded_files(
+            [os.path.join(src, f) for f in os.listdir(src)]
+        ).items()
+    }
+    assert reasons == {
+        "bundle.js": "minified",
+        "api_pb2.py": "generated",
+        "blob.js": "high entropy",
+        "huge.c": "oversized",
+    }
+    source_view = staging.build_source_view(src, view_dir=str(tmp_path))
+    assert source_view["files"] == 1
+    report = staging.write_exclusion_report(
+        source_view, str(tmp_path / "out" / "web.exclusions.json")
+    )
+    with open(report, encoding="utf-8") as fp:
+        exclusions = json.load(fp)
+    assert {"file": "huge.c", "reason": "oversized", "detail": "7000 bytes"} in (
+        exclusions
+    )
+    staging.remove_source_view(source_view)
+    # Only generator banners mark a file as generated
+    write_file(
+        os.path.join(src, "model.go"),
+        "// Code generated by mockgen. DO NOT EDIT.\npackage model\n",
+    )
+    write_file(
+        os.path.join(src, "notes.py"),
+        '"""Settings. Do not edit by hand, code generated values"""\n',
+    )
+    notes = [os.path.join(src, "model.go"), os.path.join(src, "notes.py")]
+    assert list(staging.find_excluded_files(notes)) == notes[:1]
+    # Results are shared through the cache and only refreshed on change
+    cache_dir = str(tmp_path / "cache")
+    staging.file_cache.clear()
+    assert staging.find_excluded_files(notes, cache_dir=cache_dir)
+    staging.file_cache.clear()
+    monkeypatch.setattr(staging, "get_exclusion_reason", lambda *args: None)
+    assert list(staging.find_excluded_files(notes, cache_dir=cache_dir)) == notes[:1]
+    write_file(notes[0], "package model\n")
+    assert staging.find_excluded_files(notes, cache_dir=cache_dir) == {}
+    monkeypatch.setenv("CPGGEN_EXCLUDE_GENERATED", "false")
+    assert staging.find_excluded_files([os.path.join(src, "bundle.js")]) == {}
+
+
+# Test that vendored copies are only staged once
+def test_dedupe_files(tmp_path, monkeypatch):
+    src = str(tmp_path / "mono")
+    for app in ("a", "b", "c"):
+        write_file(os.path.join(src, app, "lib", "left", "pad.js"), "pad();\n" * 400)
+        write_file(os.path.join(src, app, "lib", "left", "util.js"), "util();\n" * 400)
+        write_file(os.path.join(src, app, "__init__.py"), "")
+    write_file(os.path.join(src, "c", "lib", "extra.js"), "extra();\n")
+    write_file(os.path.join(src, "a", "big.js"), "x = 1;\n" * 1000)
+    write_file(os.path.join(src, "b", "copy.js"), "x = 1;\n" * 1000)
+    # Small identical packages still define distinct modules
+    for pkg in ("x", "y"):
+        write_file(os.path.join(src, "small", pkg, "__init__.py"), "")
+        write_file(os.path.join(src, "small", pkg, "mod.py"), "import os\n")
+    files = [
+        f for f in staging.get_view_files(src) if os.sep + "small" + os.sep not in f
+    ]
+    small_files = staging.get_view_files(os.path.join(src, "small"))
+    assert staging.dedupe_files(src, files, min_bytes=4096) == (files, {})
+    monkeypatch.setenv("CPGGEN_DEDUPE", "true")
+    assert staging.dedupe_files(src, small_files, min_bytes=4096)[1] == {}
+    cache_dir = str(tmp_path / "cache")
+    kept, aliases = staging.dedupe_files(
+        src, files, min_bytes=4096, cache_dir=cache_dir
+    )
+    assert aliases == {
+        os.path.join("b", "lib"): os.path.join("a", "lib"),
+        os.path.join("c", "lib", "left"): os.path.join("a", "lib", "left"),
+        os.path.join("b", "copy.js"): os.path.join("a", "big.js"),
+    }
+    assert sorted(os.path.relpath(f, src) for f in kept) == [
+        os.path.join("a", "__init__.py"),
+        os.path.join("a", "big.js"),
+        os.path.join("a", "lib", "left", "pad.js"),
+        os.path.join("a", "lib", "left", "util.js"),
+        os.path.join("b", "__init__.py"),
+        os.path.join("c", "__init__.py"),
+        os.path.join("c", "lib", "extra.js"),
+    ]
+    assert staging.expand_aliases(
+        os.path.join("a", "lib", "left", "pad.js"), aliases
+    ) == [
+        os.path.join("a", "lib", "left", "pad.js"),
+        os.path.join("b", "lib", "left", "pad.js"),
+        os.path.join("c", "lib", "left", "pad.js"),
+    ]
+    # The digests are computed once per tree
+    staging.file_cache.clear()
+    monkeypatch.setattr(staging, "hash_file", lambda path: None)
+    assert staging.dedupe_files(src, files, min_bytes=4096, cache_dir=cache_dir) == (
+        kept,
+        aliases,
+    )
+    monkeypatch.setattr(staging, "DEDUPE_MIN_BYTES", 4096)
+    source_view = staging.build_source_view(
+        src, view_dir=str(tmp_path), cache_dir=cache_dir
+    )
+    assert source_view["aliases"][os.path.join("b", "lib")] == os.path.join("a", "lib")
+    assert not os.path.exists(os.path.join(source_view["view"], "b", "lib"))
+    staging.remove_source_view(source_view)
+
+
+# Test that snapshots are private copies of the whole tree
+def test_snapshot(tmp_path):
+    src = str(tmp_path / "app")
+    write_file(os.path.join(src, "pom.xml"), "<project/>")
+    write_file(os.path.join(src, "src", "Main.java"), "class Main {}")
+    write_file(os.path.join(src, ".git", "HEAD"), "ref: refs/heads/main\n")
+    write_file(os.path.join(src, "node_modules", "lib", "index.js"), "")
+    os.makedirs(os.path.join(src, "empty"))
+    os.symlink("pom.xml", os.path.join(src, "link.xml"))
+    snapshot = staging.build_snapshot(src, snapshot_dir=str(tmp_path))
+    view = snapshot["view"]
+    assert snapshot["method"] in ("reflink", "hardlink", "copy")
+    assert snapshot["files"] == 3
+    assert os.path.exists(os.path.join(view, "node_modules", "lib", "index.js"))
+    assert os.path.isdir(os.path.join(view, "empty"))
+    assert os.path.islink(os.path.join(view, ".git"))
+    assert os.readlink(os.path.join(view, "link.xml")) == "pom.xml"
+    # Build outputs stay in the snapshot
+    write_file(os.path.join(view, "target", "Main.class"), "")
+    assert not os.path.exists(os.path.join(src, "target"))
+    assert staging.map_view_path(os.path.join(view, "src"), snapshot) == (
+        os.path.join(src, "src")
+    )
+    staging.remove_source_view(snapshot)
+    assert not os.path.exists(view)
+    assert os.path.exists(os.path.join(src, ".git", "HEAD"))
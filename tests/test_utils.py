@@ -0,0 +1,446 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+
+import pytest
+
+from cpggen import utils
+
+
+def write_file(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w", encoding="utf-8") as fp:
+        fp.write(content)
+
+
+# A pytest fixture that returns a small polyglot source tree
+@pytest.fixture
+def src_tree(tmp_path):
+    src = str(tmp_path / "app")
+    write_file(os.path.join(src, "requirements.txt"), "requests\n")
+    write_file(os.path.join(src, "main.py"), "print('hello')\n")
+    write_file(os.path.join(src, "web", "package.json"), "{}")
+    write_file(os.path.join(src, "web", "index.js"), "console.log(1);\n")
+    write_file(os.path.join(src, "web", "app.min.js"), "console.log(1);")
+    write_file(os.path.join(src, "svc", "go.mod"), "module svc\n")
+    write_file(os.path.join(src, "svc", "Makefile"), "all:\n")
+    write_file(os.path.join(src, "node_modules", "lib", "index.js"), "")
+    write_file(os.path.join(src, ".hidden", "pom.xml"), "<project/>")
+    return src
+
+
+# Test that the inventory answers the same queries as a tree walk
+def test_inventory_matches_find_files(src_tree):
+    inventory = utils.build_inventory(src_tree)
+    for ext in (".py", ".js", "go.mod", "Makefile", ".json", "pom.xml", ".txt"):
+        assert utils.find_files(src_tree, ext, inventory=inventory) == utils.find_files(
+            src_tree, ext
+        )
+    assert utils.find_files(src_tree, "index", True, inventory=inventory) == [
+        os.path.join(src_tree, "web", "index.js")
+    ]
+    assert len(utils.find_files(src_tree, ".js", quick=True, inventory=inventory)) == 1
+    assert utils.search_inventory(inventory, "requirements.txt") == []
+    assert utils.search_inventory(
+        inventory, "requirements.txt", include_ignored=True
+    ) == [os.path.join(src_tree, "requirements.txt")]
+
+
+# Test that detection and the build helpers reuse a single inventory
+def test_detect_project_type_single_walk(src_tree, monkeypatch):
+    walks = []
+    real_build_inventory = utils.build_inventory
+
+    def counting_build_inventory(src, *args, **kwargs):
+        walks.append(src)
+        return real_build_inventory(src, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "build_inventory", counting_build_inventory)
+    monkeypatch.setenv("CPGGEN_NO_CACHE", "true")
+    write_file(os.path.join(src_tree, "dev-requirements.txt"), "pytest\n")
+    write_file(os.path.join(src_tree, "env", "myconda.yml"), "name: env\n")
+    utils.clear_inventory_cache()
+    project_types = utils.detect_project_type(src_tree)
+    assert "python" in project_types
+    assert "js" in project_types
+    assert "jimple" not in project_types
+    assert utils.find_go_mods(src_tree) == [os.path.join(src_tree, "svc", "go.mod")]
+    assert utils.find_makefiles(src_tree) == [os.path.join(src_tree, "svc", "Makefile")]
+    assert utils.find_pom_files(src_tree) == []
+    assert utils.find_python_reqfiles(src_tree) == [
+        os.path.join(src_tree, "requirements.txt")
+    ]
+    assert walks == [src_tree]
+
+
+# Test that unchanged directories are not listed again with the on-disk cache
+def test_inventory_disk_cache(src_tree, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / ".cpggen_cache")
+    # Age the directories so that their stamps can be trusted
+    for root, _, _ in os.walk(src_tree):
+        os.utime(root, (1, 1))
+    first = utils.get_inventory(src_tree, refresh=True, cache_dir=cache_dir)
+    assert os.path.exists(utils.get_inventory_cache_file(src_tree, cache_dir))
+    listed = []
+    real_scandir = os.scandir
+
+    def counting_scandir(path):
+        listed.append(path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    second = utils.get_inventory(src_tree, refresh=True, cache_dir=cache_dir)
+    assert listed == []
+    assert second["files"] == first["files"]
+    # A new file changes the mtime of its directory
+    write_file(os.path.join(src_tree, "svc", "main.go"), "package main\n")
+    third = utils.get_inventory(src_tree, refresh=True, cache_dir=cache_dir)
+    assert listed == [os.path.join(src_tree, "svc")]
+    assert os.path.join(src_tree, "svc", "main.go") in third["files"]
+    monkeypatch.setenv("CPGGEN_CACHE_DIR", cache_dir)
+    os.utime(os.path.join(src_tree, "svc"), (1, 1))
+    assert utils.find_files(src_tree, ".go") == [
+        os.path.join(src_tree, "svc", "main.go")
+    ]
+    # Searches reuse the inventory while the directory stamps are unchanged
+    cache_file = utils.get_inventory_cache_file(src_tree, cache_dir)
+    os.remove(cache_file)
+    listed.clear()
+    assert utils.find_files(src_tree, "Makefile") == [
+        os.path.join(src_tree, "svc", "Makefile")
+    ]
+    assert listed == []
+    assert not os.path.exists(cache_file)
+    # Inventories of scratch directories such as snapshots are not persisted
+    snapshot = tempfile.mkdtemp(prefix="cpggen_snapshot_")
+    try:
+        utils.get_inventory(snapshot, refresh=True, cache_dir=cache_dir)
+        assert not os.path.exists(utils.get_inventory_cache_file(snapshot, cache_dir))
+    finally:
+        shutil.rmtree(snapshot)
+    assert not utils.is_scratch_path(src_tree)
+    monkeypatch.delenv("CPGGEN_CACHE_DIR")
+    assert utils.get_cache_dir(str(tmp_path / "cpg_out")) == os.path.join(
+        os.path.expanduser("~"), ".cache", "cpggen"
+    )
+
+
+# Test the compiled ignore rules for files and directories
+def test_ignore_rules():
+    assert utils.is_ignored_file("app.min.js")
+    assert utils.is_ignored_file("Archive.TAR.GZ")
+    assert utils.is_ignored_file("foo.component.spec.ts")
+    assert utils.is_ignored_file(".txt")
+    assert not utils.is_ignored_file("index.js")
+    assert not utils.is_ignored_file("Makefile")
+    assert not utils.is_ignored_file("")
+    assert utils.filter_ignored_dirs(["src", "node_modules", ".git", "Vendor"]) == [
+        "src"
+    ]
+    base = os.path.join(os.path.sep, "work", "test", "app")
+    assert not utils.is_ignored_dir(base, base)
+    assert not utils.is_ignored_dir(base, os.path.join(base, "src"))
+    assert utils.is_ignored_dir(base, os.path.join(base, "docs", "api"))
+    assert utils.is_ignored_dir(base, os.path.join(base, "src", "vendor", "lib"))
+    assert not utils.is_ignored_dir(base, os.path.join(base, "src", "vendor"))
+    assert utils.is_ignored_dir(".", os.path.join(".", "tests"))
+
+
+# Test that .cpggenignore and the optional .gitignore are honoured
+def test_ignore_patterns(src_tree, monkeypatch):
+    write_file(os.path.join(src_tree, ".cpggenignore"), "# generated\n/svc/\n")
+    write_file(
+        os.path.join(src_tree, ".gitignore"), "build/\n*.py\n!main.py\nweb/**/*.js\n"
+    )
+    write_file(os.path.join(src_tree, "build", "gen.py"), "")
+    write_file(os.path.join(src_tree, "tool.py"), "")
+    monkeypatch.delenv("CPGGEN_USE_GITIGNORE", raising=False)
+    files = utils.build_inventory(src_tree)["files"]
+    assert os.path.join(src_tree, "svc", "go.mod") not in files
+    assert os.path.join(src_tree, "build", "gen.py") in files
+    monkeypatch.setenv("CPGGEN_USE_GITIGNORE", "true")
+    files = utils.build_inventory(src_tree)["files"]
+    assert os.path.join(src_tree, "build", "gen.py") not in files
+    assert os.path.join(src_tree, "tool.py") not in files
+    assert os.path.join(src_tree, "main.py") in files
+    assert os.path.join(src_tree, "web", "index.js") not in files
+    assert os.path.join(src_tree, "web", "package.json") in files
+    patterns = utils.get_ignore_patterns(src_tree)
+    assert utils.is_ignored_path(patterns, "build/x/y.c", check_parents=True)
+    assert not utils.is_ignored_path(patterns, "src/build.c", check_parents=True)
+
+
+# Test that the parallel walker yields the same tree as the serial walker
+def test_walk_tree_parallel(src_tree):
+    for i in range(20):
+        write_file(os.path.join(src_tree, "pkg", f"mod{i}", "lib", "a.c"), "int a;\n")
+    serial = list(utils.walk_tree(src_tree, max_workers=1))
+    parallel = list(utils.walk_tree(src_tree, max_workers=8))
+    assert serial == parallel
+    roots = [root for root, _, _ in parallel]
+    assert roots[0] == src_tree
+    assert os.path.join(src_tree, "node_modules") not in roots
+    assert os.path.join(src_tree, ".hidden") not in roots
+    # Stopping early should not raise
+    for root, _, _ in utils.walk_tree(src_tree, max_workers=4):
+        break
+    assert len(utils.find_files(src_tree, ".c")) == 20
+    write_file(os.path.join(src_tree, "libs", "a.jar"), "")
+    assert utils.find_java_artifacts(src_tree) == [
+        os.path.join(src_tree, "libs", "a.jar")
+    ]
+
+
+# Test that git checkouts are enumerated from the index
+@pytest.mark.skipif(not utils.check_command("git"), reason="git is not available")
+def test_git_inventory(src_tree, monkeypatch):
+    monkeypatch.delenv("CPGGEN_USE_GIT_INDEX", raising=False)
+    subprocess.run(["git", "init", "-q"], cwd=src_tree, check=True)
+    subprocess.run(["git", "add", "-A"], cwd=src_tree, check=True)
+    write_file(os.path.join(src_tree, "build", "generated.py"), "")
+    inventory = utils.build_inventory(src_tree)
+    assert inventory["backend"] == "git"
+    assert os.path.join(src_tree, "main.py") in inventory["files"]
+    assert os.path.join(src_tree, "svc", "go.mod") in inventory["files"]
+    assert os.path.join(src_tree, "build", "generated.py") not in inventory["files"]
+    assert os.path.join(src_tree, "node_modules", "lib", "index.js") not in (
+        inventory["files"]
+    )
+    assert utils.search_inventory(inventory, "requirements.txt", include_ignored=True)
+    monkeypatch.setenv("CPGGEN_USE_GIT_INDEX", "false")
+    inventory = utils.build_inventory(src_tree)
+    assert inventory["backend"] == "walk"
+    assert os.path.join(src_tree, "build", "generated.py") in inventory["files"]
+
+
+# Test the language statistics and the threshold gating
+def test_language_stats(src_tree):
+    write_file(os.path.join(src_tree, "web", "app.ts"), "x" * 1000)
+    project_types = utils.detect_project_type(src_tree)
+    stats = utils.get_language_stats(src_tree, project_types)
+    assert stats["python"] == {"files": 1, "bytes": 15}
+    assert stats["js"] == {"files": 2, "bytes": 1016}
+    assert utils.filter_project_types(["python", "js"], stats, min_files=2) == ["js"]
+    assert utils.filter_project_types(["python", "js"], stats, min_bytes=100) == ["js"]
+    assert utils.filter_project_types(["js", "python"], stats, max_languages=1) == [
+        "js"
+    ]
+    assert utils.filter_project_types(["python", "js"], stats, min_files=10) == ["js"]
+    assert utils.filter_project_types(["java", "java"], {}) == ["java"]
+
+
+def write_bytes(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="wb") as fp:
+        fp.write(content)
+
+
+# Test the magic number based binary classifier
+def test_classify_binaries(tmp_path):
+    src = str(tmp_path / "firmware")
+    pe_header = bytearray(128)
+    pe_header[:2] = b"MZ"
+    pe_header[60:64] = (64).to_bytes(4, "little")
+    pe_header[64:68] = b"PE\0\0"
+    samples = {
+        "busybox": b"\x7fELF\x02\x01\x01" + bytes(64),
+        "setup.exe": bytes(pe_header),
+        "dos.com": b"MZ" + bytes(126),
+        "tool": b"\xcf\xfa\xed\xfe" + bytes(32),
+        "universal": b"\xca\xfe\xba\xbe\x00\x00\x00\x02" + bytes(32),
+        "Main.class": b"\xca\xfe\xba\xbe\x00\x00\x00\x34" + bytes(32),
+        "classes.dex": b"dex\n035\0" + bytes(32),
+        "README": b"hello world\n",
+    }
+    for name, content in samples.items():
+        write_bytes(os.path.join(src, name), content)
+    kinds = dict(
+        zip(
+            samples.keys(),
+            utils.classify_binaries([os.path.join(src, n) for n in samples]),
+        )
+    )
+    assert kinds == {
+        "busybox": "elf",
+        "setup.exe": "pe",
+        "dos.com": None,
+        "tool": "macho",
+        "universal": "macho",
+        "Main.class": "class",
+        "classes.dex": "dex",
+        "README": None,
+    }
+    assert sorted(os.path.basename(f) for f in utils.find_exe_files(src)) == [
+        "busybox",
+        "setup.exe",
+        "tool",
+        "universal",
+    ]
+    assert utils.is_exe(os.path.join(src, "busybox"))
+    assert not utils.is_exe(os.path.join(src, "README"))
+    # Cached results are invalidated when the file changes
+    write_bytes(os.path.join(src, "busybox"), b"#!/bin/sh\necho hi\n")
+    assert utils.classify_binary(os.path.join(src, "busybox")) is None
+
+
+def write_zip(path, entries):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, content in entries.items():
+            zf.writestr(name, content)
+
+
+# Test that archives are classified from their central directory
+def test_inspect_archive(tmp_path):
+    src = str(tmp_path / "dist")
+    jar = os.path.join(src, "app.jar")
+    write_zip(jar, {"com/app/Main.class": b"\xca\xfe\xba\xbe" + bytes(64)})
+    sources = os.path.join(src, "sources.zip")
+    write_zip(sources, {"app/main.py": "print(1)\n", "app/util.py": "", "a.js": ""})
+    docs = os.path.join(src, "docs.zip")
+    write_zip(docs, {"README.md": "hello"})
+    summary = utils.inspect_archive(jar)
+    assert summary["entries"] == 1
+    assert summary["classes"] == 1
+    assert summary["uncompressed_bytes"] == 68
+    assert utils.get_archive_project_type(summary) == "jimple"
+    assert utils.inspect_archive(sources)["sources"] == {"python": 2, "js": 1}
+    assert utils.detect_project_type(sources) == ["python"]
+    assert utils.detect_project_type(docs) == []
+    assert utils.detect_project_type(jar) == ["jimple"]
+    assert utils.find_java_artifacts(src) == [jar]
+    stats = utils.get_language_stats(src, ["jimple"])
+    assert stats["jimple"]["classes"] == 1
+    assert stats["jimple"]["archives"] == 3
+    assert stats["jimple"]["uncompressed_bytes"] == 82
+    # Archives without bytecode do not trigger jimple
+    os.remove(jar)
+    assert "jimple" not in utils.detect_project_type(src)
+    extract_dir = utils.expand_source_archive(sources)
+    assert os.path.exists(os.path.join(extract_dir, "app", "main.py"))
+    assert utils.expand_source_archive(docs) == docs
+    write_file(os.path.join(src, "broken.jar"), "not a zip")
+    assert utils.inspect_archive(os.path.join(src, "broken.jar")) is None
+
+
+# Test that java artifacts are bundled without copying them
+def test_bundle_java_artifacts(tmp_path):
+    src = str(tmp_path / "libs")
+    classes = {"a/Main.class": b"\xca\xfe\xba\xbe" + bytes(64)}
+    for jar in ("one/app.jar", "two/app.jar", "web.war"):
+        write_zip(os.path.join(src, jar), classes)
+    artifacts = utils.find_java_artifacts(src)
+    assert len(artifacts) == 3
+    bundle, is_temp = utils.bundle_java_artifacts(src)
+    assert is_temp
+    names = os.listdir(bundle)
+    assert len(names) == 3
+    assert "app.jar" in names and "web.war" in names
+    assert os.path.realpath(os.path.join(bundle, "web.war")) in artifacts
+    utils.remove_bundle(bundle)
+    assert not os.path.exists(bundle)
+    assert all(os.path.exists(a) for a in artifacts)
+    bundle, _ = utils.bundle_java_artifacts(src, mode="archive")
+    with zipfile.ZipFile(bundle) as zf:
+        assert {i.compress_type for i in zf.infolist()} == {zipfile.ZIP_STORED}
+        assert len(zf.infolist()) == 3
+    utils.remove_bundle(bundle)
+    os.remove(os.path.join(src, "web.war"))
+    os.remove(os.path.join(src, "two", "app.jar"))
+    assert utils.bundle_java_artifacts(src) == (
+        os.path.join(src, "one", "app.jar"),
+        False,
+    )
+
+
+# Test that repos are cloned from an incrementally updated local mirror
+@pytest.mark.skipif(not utils.GIT_AVAILABLE, reason="git is not available")
+def test_clone_repo_mirror(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "GIT_CACHE_DIR", str(tmp_path / "cache"))
+    remote = str(tmp_path / "remote")
+    write_file(os.path.join(remote, "main.py"), "print(1)\n")
+
+    def commit(message):
+        subprocess.run(["git", "add", "-A"], cwd=remote, check=True)
+        subprocess.run(
+            [
+                "git",
+                "-c",
+                "user.name=t",
+                "-c",
+                "user.email=t@t",
+                "commit",
+                "-qm",
+                message,
+            ],
+            cwd=remote,
+            check=True,
+        )
+
+    subprocess.run(["git", "init", "-q"], cwd=remote, check=True)
+    commit("first")
+    subprocess.run(
+        ["git", "update-ref", "refs/pull/1/head", "HEAD"], cwd=remote, check=True
+    )
+    first = str(tmp_path / "first")
+    assert utils.clone_repo(remote, first) == first
+    assert os.path.exists(os.path.join(first, "main.py"))
+    mirrors = os.listdir(str(tmp_path / "cache"))
+    assert len(mirrors) == 1
+    write_file(os.path.join(remote, "lib.py"), "x = 1\n")
+    commit("second")
+    second = str(tmp_path / "second")
+    utils.clone_repo(remote, second)
+    assert os.path.exists(os.path.join(second, "lib.py"))
+    assert os.listdir(str(tmp_path / "cache")) == mirrors
+    # The clone shares the objects of the mirror
+    objects = os.path.join(second, ".git", "objects")
+    linked = [
+        os.stat(os.path.join(root, f)).st_nlink
+        for root, _, files in os.walk(objects)
+        for f in files
+        if "pack" not in root
+    ]
+    assert linked and min(linked) > 1
+    repo = utils.git.Repo(second)
+    assert repo.remotes.origin.url == remote
+    # Only the branches and tags of the remote are mirrored
+    mirror = utils.git.Repo(
+        os.path.join(str(tmp_path / "cache"), mirrors[0], "mirror.git")
+    )
+    refs = mirror.git.for_each_ref("--format=%(refname)").splitlines()
+    assert refs and not [r for r in refs if r.startswith("refs/pull/")]
+    # Least recently used mirrors are evicted past the size of the git cache
+    other = str(tmp_path / "other")
+    write_file(os.path.join(other, "main.py"), "print(2)\n")
+    shutil.copytree(os.path.join(remote, ".git"), os.path.join(other, ".git"))
+    monkeypatch.setattr(utils, "GIT_CACHE_BYTES", 0)
+    utils.clone_repo(other, str(tmp_path / "fourth"))
+    cached = [
+        m
+        for m in os.listdir(str(tmp_path / "cache"))
+        if os.path.exists(os.path.join(str(tmp_path / "cache"), m, "mirror.git"))
+    ]
+    assert len(cached) == 1 and cached != mirrors
+    monkeypatch.setattr(utils, "GIT_CACHE_BYTES", 1024 * 1024 * 1024)
+    # The network clone is used when the cache is disabled
+    monkeypatch.setenv("CPGGEN_NO_CACHE", "true")
+    third = str(tmp_path / "third")
+    utils.clone_repo(f"file://{remote}", third)
+    assert os.path.exists(os.path.join(third, "lib.py"))
+    assert len(os.listdir(str(tmp_path / "cache"))) == 2
+
+
+# Test that .Net projects are found in every directory with solutions first
+def test_find_csharp_artifacts(tmp_path):
+    src = str(tmp_path / "dotnet")
+    write_file(os.path.join(src, "src", "App", "App.csproj"), "<Project/>")
+    write_file(os.path.join(src, ".build", "Tools.csproj"), "<Project/>")
+    assert sorted(utils.find_csharp_artifacts(src)) == [
+        os.path.join(src, ".build", "Tools.csproj"),
+        os.path.join(src, "src", "App", "App.csproj"),
+    ]
+    write_file(os.path.join(src, "App.sln"), "")
+    assert utils.find_csharp_artifacts(src) == [os.path.join(src, "App.sln")]